@@ -1,14 +1,22 @@
 import os
 import json
+import asyncio
 import re
 import time
 import random
 import uuid
+import itertools
 import requests
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import fitz  # PyMuPDF
 from dotenv import load_dotenv
 from hashlib import sha256
 
+try:
+    from app import llm_backends, llm_cache, llm_cassette, llm_schemas, rate_limiter
+except ImportError:
+    import llm_backends, llm_cache, llm_cassette, llm_schemas, rate_limiter
+
 # Optional: official Google client (used when available)
 try:
     import google.generativeai as genai
@@ -20,8 +28,32 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-2.0-flash") # Updated default to Flash for speed
 AI_OFFLINE = os.getenv("AI_OFFLINE", "false").lower() in ("1", "true", "yes")
+# Topic fan-out: how many topics are generated at once and how long one topic may take
+TOPIC_CONCURRENCY = int(os.getenv("TOPIC_CONCURRENCY", "4"))
+TOPIC_TIMEOUT_S = float(os.getenv("TOPIC_TIMEOUT_S", "90"))
+# Syllabus map-reduce: documents longer than one chunk are split and analysed chunk by chunk
+SYLLABUS_CHUNK_CHARS = int(os.getenv("SYLLABUS_CHUNK_CHARS", "20000"))
+SYLLABUS_CHUNK_OVERLAP = int(os.getenv("SYLLABUS_CHUNK_OVERLAP", "1000"))
+SYLLABUS_MAX_CHUNKS = int(os.getenv("SYLLABUS_MAX_CHUNKS", "32"))
+SYLLABUS_MAX_TOPICS = int(os.getenv("SYLLABUS_MAX_TOPICS", "8"))
+# Topic batching: small topics are packed into one request (keyed by topic name) under a token budget
+TOPIC_BATCH_ENABLED = os.getenv("TOPIC_BATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+TOPIC_BATCH_MAX_COMPLEXITY = int(os.getenv("TOPIC_BATCH_MAX_COMPLEXITY", "2"))
+TOPIC_BATCH_MAX_TOPICS = int(os.getenv("TOPIC_BATCH_MAX_TOPICS", "4"))
+TOPIC_BATCH_TOKEN_BUDGET = int(os.getenv("TOPIC_BATCH_TOKEN_BUDGET", "4000"))
+# Arena sessions: "single" asks for all N scenarios in one structured response (missing ones are
+# topped up concurrently), "concurrent" sends one request per scenario with at most ARENA_CONCURRENCY in flight
+ARENA_GENERATION_MODE = os.getenv("ARENA_GENERATION_MODE", "single").lower()
+ARENA_CONCURRENCY = int(os.getenv("ARENA_CONCURRENCY", "5"))
+# Structured output: request JSON mode with a declared response schema and validate every item;
+# items that fail validation are asked for again (only those), up to LLM_REASK_ROUNDS follow-up requests
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+LLM_REASK_ROUNDS = max(0, int(os.getenv("LLM_REASK_ROUNDS", "1")))
+# PDF extraction: documents with at least PDF_PARALLEL_MIN_PAGES pages are split across PDF_WORKERS processes
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
 
-if not GEMINI_API_KEY:
+if not GEMINI_API_KEY and llm_backends.LLM_BACKEND == "gemini":
     print("⚠️ Warning: GEMINI_API_KEY is not set. Set it in your .env for real AI calls.")
 
 # configure the official client if present
@@ -31,6 +63,9 @@ if genai and GEMINI_API_KEY:
     except Exception as e:
         print("⚠️ genai.configure failed:", e)
 
+# Shared HTTP session for REST helpers (keeps connections alive between calls)
+_HTTP = requests.Session()
+
 # --- Helpers to inspect available models (debugging) ---
 def list_available_models(api_key=None, use_v1beta=True):
     version = "v1beta" if use_v1beta else "v1"
@@ -38,7 +73,7 @@ def list_available_models(api_key=None, use_v1beta=True):
     if api_key:
         url += f"?key={api_key}"
     try:
-        resp = requests.get(url, timeout=8)
+        resp = _HTTP.get(url, timeout=8)
         resp.raise_for_status()
         data = resp.json()
         models = [m.get("name") for m in data.get("models", [])] if isinstance(data, dict) else data
@@ -50,17 +85,25 @@ def list_available_models(api_key=None, use_v1beta=True):
 # --- Lazy model getter with helpful diagnostics ---
 _MODEL_OBJ = None
 
+def _create_backend():
+    if llm_backends.LLM_BACKEND != "gemini":
+        print(f"Initializing LLM backend: {llm_backends.LLM_BACKEND}")
+        return llm_backends.create(llm_backends.LLM_BACKEND)
+    print(f"Initializing model: {GEMINI_MODEL}")
+    return llm_backends.create("gemini", GEMINI_MODEL)
+
 def get_model():
+    """
+    The configured backend (LLM_BACKEND); every model call in this module goes through it.
+    With LLM_CASSETTE_MODE=record/replay the calls are recorded to / served from a cassette.
+    """
     global _MODEL_OBJ
     if AI_OFFLINE:
         raise RuntimeError("AI_OFFLINE is enabled")
     if _MODEL_OBJ is not None:
         return _MODEL_OBJ
-    if not genai:
-        raise RuntimeError("google.generativeai client not installed or importable.")
     try:
-        print(f"Initializing model: {GEMINI_MODEL}")
-        _MODEL_OBJ = genai.GenerativeModel(GEMINI_MODEL)
+        _MODEL_OBJ = llm_cassette.wrap(_create_backend)
         return _MODEL_OBJ
     except Exception as e:
         print("⚠️ Model instantiation failed:", e)
@@ -72,155 +115,462 @@ def get_model():
         raise
 
 # --- Utility functions ---
+_PDF_POOL = None
+
+def _pdf_pool():
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        _PDF_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _PDF_POOL
+
+def iter_pdf_pages(pdf_content: bytes, start: int = 0, stop: int = None):
+    """Yields (page_number, text) one page at a time, so callers never hold more than one page."""
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for i in range(start, stop):
+            yield i, doc.load_page(i).get_text()
+
+def _extract_page_range(pdf_content: bytes, start: int, stop: int) -> list:
+    # Runs in a worker process: each worker opens its own document from the shared bytes
+    return [text for _, text in iter_pdf_pages(pdf_content, start, stop)]
+
+def extract_pdf_pages(pdf_content: bytes, workers: int = None):
+    """
+    Extracts all page texts. Returns (text, page_offsets) where page_offsets[i] is the character
+    offset at which page i starts in `text`. Large documents are split into contiguous page
+    ranges across a process pool; small ones are read in-process.
+    """
+    workers = PDF_WORKERS if workers is None else workers
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        page_count = doc.page_count
+
+    if workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+        step = -(-page_count // workers)
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        pool = _pdf_pool()
+        futures = [pool.submit(_extract_page_range, pdf_content, a, b) for a, b in ranges]
+        pages = [text for fut in futures for text in fut.result()]
+    else:
+        pages = [text for _, text in iter_pdf_pages(pdf_content)]
+
+    page_offsets = []
+    offset = 0
+    for text in pages:
+        page_offsets.append(offset)
+        offset += len(text)
+    return "".join(pages), page_offsets
+
 def extract_text_from_pdf(pdf_content: bytes) -> str:
     try:
-        text = ""
-        with fitz.open(stream=pdf_content, filetype="pdf") as doc:
-            for page in doc:
-                text += page.get_text()
-        print(f"✅ Extracted {len(text)} characters from PDF.")
+        text, page_offsets = extract_pdf_pages(pdf_content)
+        print(f"✅ Extracted {len(text)} characters from {len(page_offsets)} PDF pages.")
         return text
     except Exception as e:
         print(f"❌ Error extracting text from PDF: {e}")
         return ""
 
-def repair_json(json_str: str) -> str:
+_JSON_OPENERS = {None: re.compile(r"[\[{]"), "[": re.compile(r"\["), "{": re.compile(r"\{")}
+_JSON_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_RAW_CONTROL = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+# LaTeX commands that start with a valid JSON escape letter (\f, \t, \n, \b, \r): a model writing
+# "\frac" means the command, not a form feed followed by "rac"
+_LATEX_COMMANDS = frozenset("""
+    frac tfrac dfrac forall flat frown
+    times theta tau tan tanh text textbf textit to top triangle tilde tt
+    nabla neq ne nu not ni neg nearrow nonumber
+    beta bar bf binom bmod bot bigcup bigcap big bigg boldsymbol bullet backslash
+    rho right rightarrow rangle rceil rfloor rm root
+""".split())
+_LATEX_ALTERNATION = "|".join(sorted(_LATEX_COMMANDS, key=len, reverse=True))
+# An escaped backslash (kept as is) or a backslash that starts no valid escape (doubled).
+# Valid JSON has no backslash outside strings, so this runs over the whole output at once.
+_BAD_ESCAPE = re.compile(
+    r'\\\\|\\(?=(?:' + _LATEX_ALTERNATION + r')(?![A-Za-z])|u(?![0-9a-fA-F]{4})|(?!["/bfnrtu]))'
+)
+# Everything up to the next string literal with a raw newline/tab in it (escapes are all valid by then)
+_CLEAN_RUN = re.compile(r'(?:[^"]+|"[^"\\\n\r\t]*(?:\\[\s\S][^"\\\n\r\t]*)*")*')
+# The body of a string literal (up to its closing quote, or the end of truncated output)
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\[\s\S][^"\\]*)*')
+_DECODER = json.JSONDecoder()
+
+def repair_json(json_str: str, opener: str = None) -> str:
+    """
+    Single-pass sanitizer for model output. Keeps only the outermost JSON array/object (dropping
+    ``` fences and surrounding prose), doubles backslashes that are not valid JSON escapes (LaTeX
+    such as \\frac or \\alpha) and escapes raw newlines/tabs inside strings. Linear time: valid JSON
+    is handed to the C decoder as is, and otherwise only broken string literals are walked in Python.
+    `opener` ("[" or "{") picks which kind of container to look for; by default the first one wins.
+    """
     if not json_str:
         return ""
-    json_str = re.sub(r"^```(?:json)?\s*", "", json_str.strip())
-    json_str = re.sub(r"\s*```$", "", json_str.strip())
-    replacements = {
-        r"\Omega": r"\\Omega",
-        r"\times": r"\\times",
-        r"\le": r"\\le",
-        r"\ge": r"\\ge",
-        r"\frac": r"\\frac",
-    }
-    for old, new in replacements.items():
-        if old in json_str and new not in json_str:
-            json_str = json_str.replace(old, new)
-    json_str = json_str.replace('\\\\', '@@DOUBLE_BACKSLASH@@')
-    json_str = json_str.replace('\\"', '@@QUOTE@@')
-    json_str = json_str.replace('\\n', '@@NEWLINE@@')
-    json_str = json_str.replace('\\t', '@@TAB@@')
-    json_str = json_str.replace('\\/', '@@SLASH@@')
-    json_str = json_str.replace('\\b', '@@BACKSPACE@@')
-    json_str = json_str.replace('\\f', '@@FORMFEED@@')
-    json_str = json_str.replace('\\r', '@@RETURN@@')
-    json_str = json_str.replace('\\', '\\\\')
-    json_str = json_str.replace('@@DOUBLE_BACKSLASH@@', '\\\\')
-    json_str = json_str.replace('@@QUOTE@@', '\\"')
-    json_str = json_str.replace('@@NEWLINE@@', '\\n')
-    json_str = json_str.replace('@@TAB@@', '\\t')
-    json_str = json_str.replace('@@SLASH@@', '\\/')
-    json_str = json_str.replace('@@BACKSPACE@@', '\\b')
-    json_str = json_str.replace('@@FORMFEED@@', '\\f')
-    json_str = json_str.replace('@@RETURN@@', '\\r')
-    return json_str
+    first = _JSON_OPENERS.get(opener, _JSON_OPENERS[None]).search(json_str)
+    if not first:
+        return _JSON_FENCE.sub("", json_str)
+    text = json_str[first.start():]
+    if "\\" in text:
+        text = "\\\\".join(_BAD_ESCAPE.split(text))
+    # Common case: no raw newlines/tabs in strings, so the C decoder finds the end with nothing left to fix
+    try:
+        return text[:_DECODER.raw_decode(text)[1]]
+    except ValueError:
+        pass
+
+    # Escape raw newlines/tabs in the string literals that have them; only those are walked in Python
+    out = []
+    pos = 0
+    while True:
+        start = _CLEAN_RUN.match(text, pos).end()
+        out.append(text[pos:start])
+        if start == len(text):
+            break
+        pos = min(_STRING_BODY.match(text, start + 1).end() + 1, len(text))  # past the closing quote
+        literal = text[start:pos]
+        for ch, escaped in _RAW_CONTROL.items():
+            literal = literal.replace(ch, escaped)
+        out.append(literal)
+    repaired = "".join(out)
+    # Then cut after the outermost container; unbalanced (truncated) output runs to the end
+    try:
+        return repaired[:_DECODER.raw_decode(repaired)[1]]
+    except ValueError:
+        return repaired
+
+def _backoff_delay(e: Exception, delay: float):
+    """Jittered wait before retrying `e`, or None if it isn't retryable. A 429 pauses every caller sharing the quota."""
+    error_msg = str(e).lower()
+    if "429" in error_msg or "quota" in error_msg:
+        wait_s = rate_limiter.jittered(delay)
+        rate_limiter.throttle(wait_s)
+        return wait_s
+    if "500" in error_msg or "internal" in error_msg:
+        return rate_limiter.jittered(2)
+    return None
 
 def retry_with_backoff(func, *args, retries=3, delay=5):
     for i in range(retries):
         try:
             return func(*args)
         except Exception as e:
-            error_msg = str(e).lower()
-            if "429" in error_msg or "quota" in error_msg:
-                print(f"⚠️ Rate limit hit. Waiting {delay}s before retry {i+1}/{retries}...")
-                time.sleep(delay)
-                delay *= 2
-                continue
-            if "500" in error_msg or "internal" in error_msg:
-                print("⚠️ AI Internal Error. Retrying...")
-                time.sleep(2)
-                continue
-            raise
+            wait_s = _backoff_delay(e, delay)
+            if wait_s is None:
+                raise
+            print(f"⚠️ AI call failed ({str(e)[:60]}). Waiting {wait_s:.1f}s before retry {i+1}/{retries}...")
+            time.sleep(wait_s)
+            delay *= 2
+    return None
+
+async def async_retry_with_backoff(func, *args, retries=3, delay=5):
+    """Same policy as retry_with_backoff, but `func` is a coroutine function and waits never block the event loop."""
+    for i in range(retries):
+        try:
+            return await func(*args)
+        except Exception as e:
+            wait_s = _backoff_delay(e, delay)
+            if wait_s is None:
+                raise
+            print(f"⚠️ AI call failed ({str(e)[:60]}). Waiting {wait_s:.1f}s before retry {i+1}/{retries}...")
+            await asyncio.sleep(wait_s)
+            delay *= 2
     return None
 
 def text_hash(s: str) -> str:
     return sha256(s.strip().lower().encode()).hexdigest()
 
-# --- Core AI functions ---
-def generate_syllabus(text: str):
-    print("--- 1. THE ARCHITECT: Analyzing PDF Structure ---")
-    if not text:
-        print("⚠️ No text provided to generate_syllabus.")
-        return []
-    if AI_OFFLINE:
-        print("⚠️ AI_OFFLINE enabled — returning mock syllabus")
-        return [
-            {"topic": "Mock: Introduction", "complexity": 1, "context": "Offline fallback"},
-            {"topic": "Mock: Key Concepts", "complexity": 2, "context": "Offline fallback"}
-        ]
-    prompt = f"""
+# --- Model call plumbing (shared by the sync and async APIs) ---
+def _response_text(response) -> str:
+    try:
+        if hasattr(response, "text") and response.text:
+            return response.text
+        if hasattr(response, "generations"):
+            gens = getattr(response, "generations")
+            if isinstance(gens, (list, tuple)) and len(gens) > 0:
+                return getattr(gens[0], "text", "") or str(gens[0])
+        return str(response)
+    except Exception:
+        return str(response)
+
+def _usage_tokens(response) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return int(getattr(usage, "total_token_count", 0) or 0) if usage is not None else 0
+
+def _call_kwargs(generation_config=None, timeout=None) -> dict:
+    kwargs = {}
+    if generation_config:
+        kwargs["generation_config"] = generation_config
+    if timeout:
+        kwargs["request_options"] = {"timeout": timeout}
+    return kwargs
+
+def _json_config(schema: dict, base: dict = None) -> dict:
+    """Generation config asking for JSON that follows `schema` (or just `base` with structured output off)."""
+    if not LLM_STRUCTURED_OUTPUT:
+        return base
+    return {**(base or {}), "response_mime_type": "application/json", "response_schema": schema}
+
+def _loads(text: str, opener: str = None):
+    """JSON mode answers parse as they are; anything else goes through repair_json first."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(repair_json(text, opener=opener))
+
+def _cache_key(prompt: str, generation_config: dict = None):
+    if llm_cache.CACHE is None:
+        return None
+    # Stub answers must never be served as real ones, so other backends get their own key space
+    model = GEMINI_MODEL if llm_backends.LLM_BACKEND == "gemini" else f"{llm_backends.LLM_BACKEND}:{GEMINI_MODEL}"
+    return llm_cache.make_key(model, llm_cache.prompt_hash(prompt), generation_config)
+
+def _remember(prompt: str, text_out: str, generation_config: dict = None):
+    """Store a response in the LLM cache. Callers only do this once the text parsed cleanly."""
+    key = _cache_key(prompt, generation_config)
+    if key and text_out:
+        llm_cache.CACHE.set(key, text_out)
+
+async def _remember_async(prompt: str, text_out: str, generation_config: dict = None):
+    key = _cache_key(prompt, generation_config)
+    if key and text_out:
+        await llm_cache.CACHE.aset(key, text_out)
+
+def _call_model(prompt: str, generation_config: dict = None, timeout: float = None, use_cache: bool = True,
+                priority: str = rate_limiter.BULK) -> str:
+    """
+    Blocking model call with retries. Returns the response text, or "" when every retry failed.
+    Byte-identical (modulo whitespace) prompts are answered from the LLM cache unless use_cache=False.
+    Each attempt waits for admission from the rate scheduler in its `priority` class.
+    """
+    key = _cache_key(prompt, generation_config) if use_cache else None
+    if key:
+        cached = llm_cache.CACHE.get(key)
+        if cached is not None:
+            return cached
+    elif llm_cache.CACHE is not None:
+        llm_cache.CACHE.note_bypass()
+
+    def _call():
+        with rate_limiter.slot(priority, rate_limiter.estimate_tokens(prompt, generation_config)) as admitted:
+            model = get_model()
+            response = model.generate_content(prompt, **_call_kwargs(generation_config, timeout))
+            admitted.used(_usage_tokens(response))
+            return response
+    response = retry_with_backoff(_call)
+    return _response_text(response) if response else ""
+
+async def _call_model_async(prompt: str, generation_config: dict = None, timeout: float = None, use_cache: bool = True,
+                            priority: str = rate_limiter.BULK) -> str:
+    """
+    Non-blocking model call with retries. Uses the SDK's async client, which is created once
+    per process and reused, so concurrent requests share one connection pool.
+    """
+    key = _cache_key(prompt, generation_config) if use_cache else None
+    if key:
+        cached = await llm_cache.CACHE.aget(key)
+        if cached is not None:
+            return cached
+    elif llm_cache.CACHE is not None:
+        llm_cache.CACHE.note_bypass()
+
+    async def _call():
+        async with rate_limiter.aslot(priority, rate_limiter.estimate_tokens(prompt, generation_config)) as admitted:
+            model = get_model()
+            response = await model.generate_content_async(prompt, **_call_kwargs(generation_config, timeout))
+            admitted.used(_usage_tokens(response))
+            return response
+    response = await async_retry_with_backoff(_call)
+    return _response_text(response) if response else ""
+
+# --- Prompt builders & response parsers ---
+def _syllabus_prompt(text: str) -> str:
+    # Only called for documents that fit in one chunk (split_text_chunks): the text goes in whole
+    return f"""
 Analyze the following academic text. Break it down into distinct, key sub-topics.
 For each topic, assign a 'complexity' (1-5) and provide a short context summary.
 
 Return STRICTLY as a JSON list of objects:
 [{{"topic":"Topic Name","complexity":3,"context":"Brief summary"}}]
 
-Text Context (truncated to 20000 chars):
-{text[:20000]}
+Text Context:
+{text}
 """
+
+def _parse_syllabus(text_out: str, limit: int = SYLLABUS_MAX_TOPICS) -> list:
+    if not text_out.strip():
+        print("❌ AI returned empty text.")
+        return []
     try:
-        def _call():
-            model = get_model()
-            return model.generate_content(prompt)
-        response = retry_with_backoff(_call)
-        if not response:
-            print("❌ No response from model after retries.")
-            return []
-        text_out = ""
-        try:
-            if hasattr(response, "text") and response.text:
-                text_out = response.text
-            elif hasattr(response, "generations"):
-                gens = getattr(response, "generations")
-                if isinstance(gens, (list, tuple)) and len(gens) > 0:
-                    text_out = getattr(gens[0], "text", "") or str(gens[0])
-            else:
-                text_out = str(response)
-        except Exception:
-            text_out = str(response)
-        if not text_out.strip():
-            print("❌ AI returned empty text.")
-            return []
-        cleaned = repair_json(text_out)
-        try:
-            syllabus = json.loads(cleaned)
-        except Exception as e:
-            print("⚠️ JSON parsing failed after repair:", e)
-            m = re.search(r"(\[.*\])", cleaned, flags=re.S)
-            if m:
-                try:
-                    syllabus = json.loads(m.group(1))
-                except Exception as e2:
-                    print("⚠️ Fallback parsing failed:", e2)
-                    return []
-            else:
-                return []
-        print(f"✅ Successfully extracted {len(syllabus)} topics.")
-        return syllabus[:8]
+        data = _loads(text_out, opener="[")
     except Exception as e:
-        msg = str(e)
-        print(f"❌ Error in generate_syllabus: {msg}")
-        if "not found" in msg.lower() or "is not found" in msg.lower() or "404" in msg:
-            print("⚠️ Model not available or doesn't support this method. Returning mock syllabus for development.")
-            models = list_available_models(GEMINI_API_KEY)
-            if models:
-                print("Available models (sample):", models[:30])
-            return [
-                {"topic": "Fallback: Introduction", "complexity": 1, "context": "Model unavailable, dev fallback."},
-                {"topic": "Fallback: Topics Overview", "complexity": 2, "context": "Model unavailable, dev fallback."}
-            ]
+        print("⚠️ JSON parsing failed after repair:", e)
         return []
+    # Topics that don't fit the schema are dropped; the rest of the syllabus is still usable
+    syllabus, invalid = llm_schemas.validate_list(llm_schemas.SYLLABUS_TOPIC, data)
+    if invalid:
+        print(f"⚠️ Dropped {invalid} syllabus topic(s) that failed validation.")
+    print(f"✅ Successfully extracted {len(syllabus)} topics.")
+    return syllabus[:limit] if limit else syllabus
 
-def generate_content_for_topic(topic_data: dict):
-    topic = topic_data.get('topic', 'Unknown Topic')
-    complexity = int(topic_data.get('complexity', 2))
-    context = topic_data.get('context', "")
-    print(f"--- 2. THE MINER: Digging into '{topic}' ---")
-    num_cards = min(max(3, complexity * 2), 12)
-    prompt = f"""
+def split_text_chunks(text: str, chunk_chars: int = None, overlap: int = None, max_chunks: int = None) -> list:
+    """
+    Splits `text` into overlapping chunks, preferring to cut at a paragraph or line break.
+    Chunks grow when needed so the whole document always fits in `max_chunks` chunks.
+    """
+    chunk_chars = chunk_chars or SYLLABUS_CHUNK_CHARS
+    overlap = SYLLABUS_CHUNK_OVERLAP if overlap is None else overlap
+    max_chunks = max_chunks or SYLLABUS_MAX_CHUNKS
+    if len(text) <= chunk_chars:
+        return [text]
+    step = chunk_chars - overlap
+    if (len(text) - overlap) / step > max_chunks:
+        chunk_chars = -(-(len(text) - overlap) // max_chunks) + overlap
+        step = chunk_chars - overlap
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            # Look for a natural break in the last 10% of the chunk
+            floor = end - chunk_chars // 10
+            cut = text.rfind("\n\n", floor, end)
+            if cut == -1:
+                cut = text.rfind("\n", floor, end)
+            if cut > start:
+                end = cut
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def _chunk_syllabus_prompt(chunk: str, index: int, total: int) -> str:
+    return f"""
+Analyze the following excerpt (part {index + 1} of {total}) of a longer academic text.
+List the distinct, key sub-topics covered in THIS excerpt only.
+For each topic, assign a 'complexity' (1-5) and provide a short context summary.
+
+Return STRICTLY as a JSON list of objects:
+[{{"topic":"Topic Name","complexity":3,"context":"Brief summary"}}]
+
+Excerpt:
+{chunk}
+"""
+
+def _topic_key(name: str) -> str:
+    key = re.sub(r"[^a-z0-9 ]+", " ", str(name).lower())
+    key = re.sub(r"^(an? |the |introduction to |overview of |basics of )+", "", " ".join(key.split()))
+    return key
+
+def merge_syllabus_candidates(chunk_topics: list, limit: int = None) -> list:
+    """
+    Reduce step of the chunked syllabus pipeline (no model call). Merges topics that appear in
+    several chunks, keeps the best topic of each document region so later chapters are not
+    crowded out, fills the remaining slots by (chunk frequency, complexity) and returns the
+    result in document order.
+    """
+    limit = limit or SYLLABUS_MAX_TOPICS
+    merged = {}
+    for chunk_idx, topics in enumerate(chunk_topics):
+        for t in topics or []:
+            if not isinstance(t, dict) or not t.get("topic"):
+                continue
+            key = _topic_key(t["topic"])
+            try:
+                complexity = int(t.get("complexity", 2))
+            except (TypeError, ValueError):
+                complexity = 2
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = {
+                    "topic": t["topic"], "complexity": complexity, "context": t.get("context", ""),
+                    "_first": chunk_idx, "_chunks": {chunk_idx},
+                }
+                continue
+            entry["_chunks"].add(chunk_idx)
+            entry["complexity"] = max(entry["complexity"], complexity)
+            extra = t.get("context", "")
+            if extra and extra not in entry["context"] and len(entry["context"]) < 600:
+                entry["context"] = f"{entry['context']} {extra}".strip()
+
+    def _score(e):
+        return (len(e["_chunks"]), e["complexity"])
+
+    entries = sorted(merged.values(), key=_score, reverse=True)
+    picked = []
+    # Pass 1: the best topic from each region of the document
+    regions = max(1, min(limit, len(chunk_topics)))
+    for region in range(regions):
+        lo = region * len(chunk_topics) // regions
+        hi = (region + 1) * len(chunk_topics) // regions
+        for e in entries:
+            if lo <= e["_first"] < hi and e not in picked:
+                picked.append(e)
+                break
+    # Pass 2: fill by score
+    for e in entries:
+        if len(picked) >= limit:
+            break
+        if e not in picked:
+            picked.append(e)
+
+    picked = sorted(picked[:limit], key=lambda e: e["_first"])
+    return [{"topic": e["topic"], "complexity": e["complexity"], "context": e["context"]} for e in picked]
+
+def _chunk_topics(chunk: str, index: int, total: int) -> list:
+    prompt = _chunk_syllabus_prompt(chunk, index, total)
+    config = _json_config(llm_schemas.SYLLABUS_SCHEMA)
+    text_out = _call_model(prompt, generation_config=config)
+    topics = _parse_syllabus(text_out, limit=None) if text_out else []
+    if topics:
+        # Per-chunk cache entries make re-runs over the same document nearly free
+        _remember(prompt, text_out, config)
+    return topics
+
+async def _chunk_topics_async(chunk: str, index: int, total: int) -> list:
+    prompt = _chunk_syllabus_prompt(chunk, index, total)
+    config = _json_config(llm_schemas.SYLLABUS_SCHEMA)
+    text_out = await _call_model_async(prompt, generation_config=config)
+    topics = _parse_syllabus(text_out, limit=None) if text_out else []
+    if topics:
+        await _remember_async(prompt, text_out, config)
+    return topics
+
+def _reduce_chunk_results(results: list) -> list:
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors and len(errors) == len(results):
+        return _syllabus_error_fallback(errors[0])
+    for e in errors:
+        print(f"⚠️ Syllabus chunk failed: {e}")
+    syllabus = merge_syllabus_candidates([r for r in results if not isinstance(r, Exception)])
+    print(f"✅ Merged {len(syllabus)} topics from {len(results)} chunks.")
+    return syllabus
+
+def _syllabus_error_fallback(e: Exception) -> list:
+    msg = str(e)
+    print(f"❌ Error in generate_syllabus: {msg}")
+    if "not found" in msg.lower() or "is not found" in msg.lower() or "404" in msg:
+        print("⚠️ Model not available or doesn't support this method. Returning mock syllabus for development.")
+        models = list_available_models(GEMINI_API_KEY)
+        if models:
+            print("Available models (sample):", models[:30])
+        return [
+            {"topic": "Fallback: Introduction", "complexity": 1, "context": "Model unavailable, dev fallback."},
+            {"topic": "Fallback: Topics Overview", "complexity": 2, "context": "Model unavailable, dev fallback."}
+        ]
+    return []
+
+def _offline_syllabus() -> list:
+    print("⚠️ AI_OFFLINE enabled — returning mock syllabus")
+    return [
+        {"topic": "Mock: Introduction", "complexity": 1, "context": "Offline fallback"},
+        {"topic": "Mock: Key Concepts", "complexity": 2, "context": "Offline fallback"}
+    ]
+
+def _num_cards(complexity: int) -> int:
+    return min(max(3, complexity * 2), 12)
+
+def _topic_prompt(topic: str, complexity: int, context: str) -> str:
+    num_cards = _num_cards(complexity)
+    return f"""
 You are an expert tutor.
 Topic: {topic}
 Context: {context}
@@ -232,68 +582,184 @@ Generate exactly:
 
 Return STRICTLY as a JSON object with keys: "flashcards", "quiz", "arena".
 """
-    def _call_ai():
-        model = get_model()
-        return model.generate_content(prompt)
+
+def _topic_reask_prompt(topic: str, context: str, missing: dict) -> str:
+    wanted = []
+    if missing["flashcards"]:
+        wanted.append(f'- "flashcards": {missing["flashcards"]} Flashcards (question, answer).')
+    if missing["quiz"]:
+        wanted.append('- "quiz": 1 Multiple-Choice Quiz Question (question, 4 options, correct_answer).')
+    if missing["arena"]:
+        wanted.append('- "arena": 1 Application Scenario (scenario, ideal_response).')
+    listing = "\n".join(wanted)
+    return f"""
+You are an expert tutor.
+Topic: {topic}
+Context: {context}
+
+Generate ONLY the following:
+{listing}
+
+Return STRICTLY as a JSON object with exactly these keys.
+"""
+
+def _topic_content(data, topic: str, num_cards: int) -> tuple:
+    """Validated parts of a topic payload, tagged with the topic, and what is still missing."""
+    content, missing = llm_schemas.check_topic_content(data, num_cards)
+    for item in content["flashcards"]:
+        item.setdefault("tag", topic)
+    if content["quiz"]:
+        content["quiz"].setdefault("tag", topic)
+    if content["arena"]:
+        content["arena"].setdefault("related_topic_tag", topic)
+    return content, missing
+
+def _parse_topic_content(response_text: str, topic: str, num_cards: int) -> tuple:
     try:
-        response = retry_with_backoff(_call_ai)
-        if not response:
-            print(f"❌ Skipped topic '{topic}' due to empty AI response.")
-            return None
-        response_text = ""
+        data = _loads(response_text, opener="{")
+    except Exception as e:
+        print("⚠️ Failed to parse topic content JSON:", e)
+        data = None
+    return _topic_content(data, topic, num_cards)
+
+def _has_content(content: dict) -> bool:
+    return bool(content["flashcards"] or content["quiz"] or content["arena"])
+
+def _reask_keys(missing: dict) -> list:
+    return [k for k in ("flashcards", "quiz", "arena") if missing[k]]
+
+def _finish_topic(topic: str, content: dict, missing: dict):
+    """A topic is kept as long as it has flashcards; a quiz or scenario that never validated is left out."""
+    if any(missing.values()):
+        print(f"⚠️ '{topic}' still missing {', '.join(_reask_keys(missing))} after re-asking.")
+    return content if content["flashcards"] else None
+
+def _complete_topic(topic_data: dict, content: dict, missing: dict, timeout: float = None):
+    """Asks again for just the parts of a topic that failed validation, up to LLM_REASK_ROUNDS times."""
+    topic, _, context = _topic_fields(topic_data)
+    for _ in range(LLM_REASK_ROUNDS):
+        if not any(missing.values()):
+            break
+        print(f"🔁 Re-asking '{topic}' for {', '.join(_reask_keys(missing))}.")
+        prompt = _topic_reask_prompt(topic, context, missing)
+        config = _json_config(llm_schemas.topic_content_schema(_reask_keys(missing)))
         try:
-            if hasattr(response, "text") and response.text:
-                response_text = response.text
-            elif hasattr(response, "generations"):
-                gens = getattr(response, "generations")
-                if isinstance(gens, (list, tuple)) and len(gens) > 0:
-                    response_text = getattr(gens[0], "text", "") or str(gens[0])
-            else:
-                response_text = str(response)
-        except Exception:
-            response_text = str(response)
-        cleaned = repair_json(response_text)
+            text_out = _call_model(prompt, generation_config=config, timeout=timeout)
+        except Exception as e:
+            print(f"⚠️ Re-ask for '{topic}' failed: {e}")
+            break
+        extra, _ = _parse_topic_content(text_out, topic, missing["flashcards"]) if text_out else (None, None)
+        if not extra or not _has_content(extra):
+            continue
+        _remember(prompt, text_out, config)
+        content, missing = llm_schemas.merge_topic_content(content, missing, extra)
+    return _finish_topic(topic, content, missing)
+
+async def _complete_topic_async(topic_data: dict, content: dict, missing: dict, timeout: float = None):
+    topic, _, context = _topic_fields(topic_data)
+    for _ in range(LLM_REASK_ROUNDS):
+        if not any(missing.values()):
+            break
+        print(f"🔁 Re-asking '{topic}' for {', '.join(_reask_keys(missing))}.")
+        prompt = _topic_reask_prompt(topic, context, missing)
+        config = _json_config(llm_schemas.topic_content_schema(_reask_keys(missing)))
         try:
-            data = json.loads(cleaned)
+            text_out = await _call_model_async(prompt, generation_config=config, timeout=timeout)
         except Exception as e:
-            print("⚠️ Failed to parse topic content JSON:", e)
-            m = re.search(r"(\{.*\})", cleaned, flags=re.S)
-            if m:
-                try:
-                    data = json.loads(m.group(1))
-                except Exception as e2:
-                    print("⚠️ Fallback parse failed:", e2)
-                    return None
-            else:
-                return None
-        if isinstance(data, dict) and 'quiz' in data and data['quiz']:
-            quiz = data['quiz']
-            options = quiz.get('options')
-            if isinstance(options, dict):
-                quiz['options'] = list(options.values())
-        for item in data.get('flashcards', []):
-            item.setdefault('tag', topic)
-        if 'quiz' in data and data['quiz']:
-            data['quiz'].setdefault('tag', topic)
-        if 'arena' in data and data['arena']:
-            data['arena'].setdefault('related_topic_tag', topic)
-        return data
-    except Exception as e:
-        print(f"❌ Error generating content for {topic}: {e}")
-        return None
+            print(f"⚠️ Re-ask for '{topic}' failed: {e}")
+            break
+        extra, _ = _parse_topic_content(text_out, topic, missing["flashcards"]) if text_out else (None, None)
+        if not extra or not _has_content(extra):
+            continue
+        await _remember_async(prompt, text_out, config)
+        content, missing = llm_schemas.merge_topic_content(content, missing, extra)
+    return _finish_topic(topic, content, missing)
 
-# --- NEW: generate_arena_questions_for_set (session generation) ---
-def generate_arena_questions_for_set(study_set, generation_kwargs: dict):
+def _topic_fields(topic_data: dict):
+    return (
+        topic_data.get('topic', 'Unknown Topic'),
+        int(topic_data.get('complexity', 2)),
+        topic_data.get('context', ""),
+    )
+
+def _topic_tokens(topic_data: dict) -> int:
+    """Rough token cost of one topic in a batch: its context plus ~60 tokens per card and ~250 for quiz + arena."""
+    topic, complexity, context = _topic_fields(topic_data)
+    num_cards = _num_cards(complexity)
+    return (len(topic) + len(context)) // 4 + num_cards * 60 + 250
+
+def plan_topic_batches(syllabus: list, max_complexity: int = None, max_topics: int = None, token_budget: int = None) -> list:
     """
-    Generate `num_questions` application scenarios for the study_set.
-    Returns list of dicts: {"scenario":..., "ideal_response":..., "meta":{...}}
+    Groups syllabus indices into request units. Topics at or below `max_complexity` are packed
+    greedily into batches of up to `max_topics` whose estimated size stays under `token_budget`;
+    everything else gets its own request. Returns a list of index lists.
     """
-    # Defensive defaults
-    num_questions = int(generation_kwargs.get("num_questions", 1))
-    temperature = float(generation_kwargs.get("temperature", 0.8))
-    top_p = float(generation_kwargs.get("top_p", 0.95))
-    seed = generation_kwargs.get("random_seed", str(uuid.uuid4()))
+    max_complexity = TOPIC_BATCH_MAX_COMPLEXITY if max_complexity is None else max_complexity
+    max_topics = max(1, max_topics or TOPIC_BATCH_MAX_TOPICS)
+    token_budget = token_budget or TOPIC_BATCH_TOKEN_BUDGET
+    units, batch, batch_tokens, batch_names = [], [], 0, set()
+    for idx, topic_data in enumerate(syllabus or []):
+        topic, complexity, _ = _topic_fields(topic_data)
+        if complexity > max_complexity:
+            units.append([idx])
+            continue
+        cost = _topic_tokens(topic_data)
+        # Names key the response, so a batch never holds the same topic twice
+        if batch and (len(batch) >= max_topics or batch_tokens + cost > token_budget or topic in batch_names):
+            units.append(batch)
+            batch, batch_tokens, batch_names = [], 0, set()
+        batch.append(idx)
+        batch_tokens += cost
+        batch_names.add(topic)
+    if batch:
+        units.append(batch)
+    return units
+
+def _topic_batch_prompt(topics: list) -> str:
+    sections = []
+    for topic_data in topics:
+        topic, complexity, context = _topic_fields(topic_data)
+        num_cards = _num_cards(complexity)
+        sections.append(f"- Topic: {topic}\n  Context: {context}\n  Flashcards: {num_cards}")
+    listing = "\n".join(sections)
+    return f"""
+You are an expert tutor. Cover EACH of the topics below independently.
+
+{listing}
 
+For every topic generate exactly:
+1. The stated number of Flashcards (question, answer).
+2. 1 Multiple-Choice Quiz Question (question, 4 options, correct_answer).
+3. 1 Application Scenario (scenario, ideal_response).
+
+Return STRICTLY as one JSON object whose keys are the topic names exactly as written above,
+each mapping to an object with keys: "flashcards", "quiz", "arena".
+"""
+
+def _parse_topic_batch(response_text: str, topics: list) -> list:
+    """
+    Splits a batched response back into per-topic (content, missing) pairs aligned with `topics`.
+    Entries with nothing valid in them are None, so the caller sends those topics on their own.
+    """
+    names = [_topic_fields(t)[0] for t in topics]
+    results = [None] * len(names)
+    try:
+        data = _loads(response_text, opener="{")
+    except Exception as e:
+        print("⚠️ Failed to parse batched topic JSON:", e)
+        return results
+    if not isinstance(data, dict):
+        return results
+    by_key = {_topic_key(k): v for k, v in data.items() if isinstance(v, dict)}
+    for i, topic_data in enumerate(topics):
+        name = names[i]
+        entry = data.get(name) if isinstance(data.get(name), dict) else by_key.get(_topic_key(name))
+        if entry:
+            content, missing = _topic_content(entry, name, _num_cards(_topic_fields(topic_data)[1]))
+            results[i] = (content, missing) if content["flashcards"] else None
+    return results
+
+def _arena_topics(study_set) -> list:
     # Determine topic(s) to focus on. If study_set has related topics, prefer them.
     topics = []
     try:
@@ -308,15 +774,10 @@ def generate_arena_questions_for_set(study_set, generation_kwargs: dict):
                     topics.append(str(t))
     except Exception:
         topics = [getattr(study_set, "title", "General")]
+    return topics or ["General"]
 
-    if not topics:
-        topics = ["General"]
-
-    out = []
-    for i in range(num_questions):
-        variant_label = random.choice(["A", "B", "C", "D", "E", "F"])
-        topic_focus = topics[i % len(topics)]
-        prompt = f"""
+def _arena_prompt(study_set, seed: str, variant_label: str, topic_focus: str) -> str:
+    return f"""
 You are an expert evaluator creating an application scenario for learners.
 Session seed: {seed}
 Variant: {variant_label}
@@ -328,84 +789,92 @@ Create 1 application scenario and an ideal model response. The scenario should b
 Return EXACTLY one JSON object like:
 {{"scenario":"...","ideal_response":"..."}}
 """
-        # Call model with attempt to use temperature/top_p if supported
-        try:
-            model = get_model()
-            # Many SDKs accept keyword params for sampling; if not, fallback
-            try:
-                response = model.generate_content(prompt, generation_config=genai.types.GenerationConfig(temperature=temperature, top_p=top_p))
-            except TypeError:
-                response = model.generate_content(prompt)
-        except Exception as e:
-            print("⚠️ generate_arena_questions_for_set model call failed:", e)
-            # fallback: try a simpler call or return placeholder
-            try:
-                if genai:
-                    model = get_model()
-                    response = model.generate_content(prompt)
-                else:
-                    response = None
-            except Exception as e2:
-                print("⚠️ Secondary attempt failed:", e2)
-                response = None
-
-        if not response:
-            # fallback placeholder
-            out.append({
-                "scenario": f"Placeholder scenario (variant {variant_label}) on {topic_focus}",
-                "ideal_response": "Model unavailable — placeholder ideal response.",
-                "meta": {"variant": variant_label, "seed": seed}
-            })
-            continue
 
-        # Extract response text defensively
-        text_out = ""
-        try:
-            if hasattr(response, "text") and response.text:
-                text_out = response.text
-            elif hasattr(response, "generations"):
-                gens = getattr(response, "generations")
-                if isinstance(gens, (list, tuple)) and len(gens) > 0:
-                    text_out = getattr(gens[0], "text", "") or str(gens[0])
-            else:
-                text_out = str(response)
-        except Exception:
-            text_out = str(response)
+def _arena_fields(data):
+    """Validated scenario + ideal response from one arena payload (older key names accepted), or None."""
+    if not isinstance(data, dict):
+        return None
+    return llm_schemas.validate(llm_schemas.ARENA, {
+        "scenario": data.get("scenario") or data.get("prompt") or data.get("problem") or "",
+        "ideal_response": data.get("ideal_response") or data.get("ideal") or data.get("answer") or "",
+    })
 
-        cleaned = repair_json(text_out)
-        data = None
-        try:
-            data = json.loads(cleaned)
-        except Exception:
-            m = re.search(r"(\{.*\})", cleaned, flags=re.S)
-            if m:
-                try:
-                    data = json.loads(m.group(1))
-                except Exception:
-                    data = None
-        if not data:
-            # fallback to using first 1000 chars of output as scenario
-            out.append({
-                "scenario": text_out[:1000],
-                "ideal_response": "",
-                "meta": {"variant": variant_label, "seed": seed}
-            })
-            continue
+def _parse_arena(text_out: str, variant_label: str, seed: str, topic_focus: str):
+    """The scenario in `text_out`, or None when it is missing or fails validation."""
+    try:
+        fields = _arena_fields(_loads(text_out, opener="{")) if text_out else None
+    except Exception:
+        fields = None
+    if not fields:
+        return None
+    return {"scenario": fields["scenario"], "ideal_response": fields["ideal_response"],
+            "meta": {"variant": variant_label, "seed": seed, "topic": topic_focus}}
 
-        scenario = data.get("scenario") or data.get("prompt") or data.get("problem") or ""
-        ideal = data.get("ideal_response") or data.get("ideal") or data.get("answer") or ""
-        out.append({"scenario": scenario, "ideal_response": ideal, "meta": {"variant": variant_label, "seed": seed, "topic": topic_focus}})
+def _arena_fallback(text_out: str, variant_label: str, seed: str, topic_focus: str) -> dict:
+    if not text_out:
+        # fallback placeholder
+        return {
+            "scenario": f"Placeholder scenario (variant {variant_label}) on {topic_focus}",
+            "ideal_response": "Model unavailable — placeholder ideal response.",
+            "meta": {"variant": variant_label, "seed": seed}
+        }
+    # fallback to using first 1000 chars of output as scenario
+    return {
+        "scenario": text_out[:1000],
+        "ideal_response": "",
+        "meta": {"variant": variant_label, "seed": seed}
+    }
 
-    return out
+def _arena_set_prompt(study_set, seed: str, specs: list) -> str:
+    listing = "\n".join(f"{i + 1}. Variant {variant}, topic focus: {topic}" for i, (variant, topic) in enumerate(specs))
+    return f"""
+You are an expert evaluator creating application scenarios for learners.
+Session seed: {seed}
+Study set title: {getattr(study_set, 'title', 'Untitled')}
 
-# --- NEW FEATURES: QUIZ REGENERATION & ARENA GRADING ---
+Create {len(specs)} DISTINCT application scenarios, one per line below, each with an ideal model response.
+Each scenario should be moderately challenging, require applying knowledge from its topic, and must not
+repeat the setting or question of another scenario. Keep the JSON compact.
+{listing}
 
-def generate_quiz_from_context(context_text: str, num_questions: int = 5):
-    """
-    Generates dynamic MCQ quiz questions based on provided text (e.g. Flashcards).
-    """
-    print(f"--- 3. THE EXAMINER: Creating {num_questions} new questions ---")
-    prompt = f"""
+Return EXACTLY one JSON list of {len(specs)} objects, in the same order, like:
+[{{"scenario":"...","ideal_response":"..."}}]
+"""
+
+def _parse_arena_set(text_out: str, specs: list, seed: str) -> list:
+    """Splits a single-request arena response into scenarios aligned with `specs`; None where missing."""
+    results = [None] * len(specs)
+    if not text_out:
+        return results
+    try:
+        data = _loads(text_out)
+    except Exception as e:
+        print("⚠️ Failed to parse arena scenario list:", e)
+        return results
+    if isinstance(data, dict):
+        data = data.get("scenarios") or [data]
+    if not isinstance(data, list):
+        return results
+    for i, item in enumerate(data[:len(specs)]):
+        fields = _arena_fields(item)
+        if fields:
+            variant, topic = specs[i]
+            results[i] = {**fields, "meta": {"variant": variant, "seed": seed, "topic": topic}}
+    return results
+
+def _arena_kwargs(generation_kwargs: dict):
+    # Defensive defaults
+    num_questions = int(generation_kwargs.get("num_questions", 1))
+    temperature = float(generation_kwargs.get("temperature", 0.8))
+    top_p = float(generation_kwargs.get("top_p", 0.95))
+    seed = generation_kwargs.get("random_seed", str(uuid.uuid4()))
+    return num_questions, {"temperature": temperature, "top_p": top_p}, seed
+
+def _arena_specs(num_questions: int, topics: list) -> list:
+    return [(random.choice(["A", "B", "C", "D", "E", "F"]), topics[i % len(topics)]) for i in range(num_questions)]
+
+def _quiz_prompt(context_text: str, num_questions: int) -> str:
+    return f"""
     You are a strict exam setter.
     Create {num_questions} multiple-choice questions based ONLY on the following context.
     
@@ -421,30 +890,36 @@ def generate_quiz_from_context(context_text: str, num_questions: int = 5):
       }}
     ]
     """
-    
-    def _call():
-        model = get_model()
-        return model.generate_content(prompt)
 
+def _quiz_reask_prompt(context_text: str, num_questions: int, have: list) -> str:
+    existing = "\n".join(f"- {q['question']}" for q in have)
+    return _quiz_prompt(context_text, num_questions) + f"""
+    Do NOT repeat any of these questions:
+    {existing}
+    """
+
+def _parse_quiz(text_out: str) -> list:
+    """Valid questions only; a question that fails validation is dropped (and re-asked for by the caller)."""
     try:
-        response = retry_with_backoff(_call)
-        if not response:
-            return []
-        
-        text_out = response.text if hasattr(response, 'text') else str(response)
-        cleaned = repair_json(text_out)
-        return json.loads(cleaned)
+        data = _loads(text_out, opener="[")
     except Exception as e:
         print(f"Quiz Gen Error: {e}")
         return []
+    if isinstance(data, dict):
+        data = data.get("questions") or [data]
+    questions, invalid = llm_schemas.validate_list(llm_schemas.QUIZ, data)
+    if invalid:
+        print(f"⚠️ {invalid} quiz question(s) failed validation.")
+    return questions
 
-def grade_arena_submission(scenario: str, user_response: str):
-    """
-    Grades the user's open-ended response against the scenario.
-    Returns JSON: { "score": 85, "feedback": "Good job, but you missed..." }
-    """
-    print("--- 4. THE GRADER: Assessing Arena Submission ---")
-    prompt = f"""
+def _parse_grade(text_out: str):
+    try:
+        return llm_schemas.validate(llm_schemas.GRADE, _loads(text_out, opener="{"))
+    except Exception:
+        return None
+
+def _grade_prompt(scenario: str, user_response: str) -> str:
+    return f"""
     You are an expert professor. Grade this student's answer.
     
     SCENARIO: {scenario}
@@ -460,19 +935,455 @@ def grade_arena_submission(scenario: str, user_response: str):
         "feedback": "Your logic was sound, but you forgot to mention X."
     }}
     """
-    
-    def _call():
-        model = get_model()
-        return model.generate_content(prompt)
 
+# --- Core AI functions ---
+def generate_syllabus(text: str):
+    print("--- 1. THE ARCHITECT: Analyzing PDF Structure ---")
+    if not text:
+        print("⚠️ No text provided to generate_syllabus.")
+        return []
+    if AI_OFFLINE:
+        return _offline_syllabus()
+    chunks = split_text_chunks(text)
+    if len(chunks) > 1:
+        print(f"📚 Long document: map-reducing syllabus over {len(chunks)} chunks.")
+
+        def _safe(idx_chunk):
+            try:
+                return _chunk_topics(idx_chunk[1], idx_chunk[0], len(chunks))
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(TOPIC_CONCURRENCY, len(chunks)), thread_name_prefix="syllabus-map") as pool:
+            results = list(pool.map(_safe, enumerate(chunks)))
+        return _reduce_chunk_results(results)
+    prompt = _syllabus_prompt(text)
+    config = _json_config(llm_schemas.SYLLABUS_SCHEMA)
+    try:
+        text_out = _call_model(prompt, generation_config=config)
+        if not text_out:
+            print("❌ No response from model after retries.")
+            return []
+        syllabus = _parse_syllabus(text_out)
+        if syllabus:
+            _remember(prompt, text_out, config)
+        return syllabus
+    except Exception as e:
+        return _syllabus_error_fallback(e)
+
+def generate_content_for_topic(topic_data: dict, timeout: float = None):
+    topic, complexity, context = _topic_fields(topic_data)
+    print(f"--- 2. THE MINER: Digging into '{topic}' ---")
+    prompt = _topic_prompt(topic, complexity, context)
+    config = _json_config(llm_schemas.TOPIC_CONTENT_SCHEMA)
+    try:
+        response_text = _call_model(prompt, generation_config=config, timeout=timeout)
+        if not response_text:
+            print(f"❌ Skipped topic '{topic}' due to empty AI response.")
+            return None
+        content, missing = _parse_topic_content(response_text, topic, _num_cards(complexity))
+        if _has_content(content):
+            # Cached even when partial: a replay re-asks for the same gaps, which are cached too
+            _remember(prompt, response_text, config)
+        return _complete_topic(topic_data, content, missing, timeout=timeout)
+    except Exception as e:
+        print(f"❌ Error generating content for {topic}: {e}")
+        return None
+
+def generate_content_for_topic_batch(topics: list, timeout: float = None) -> list:
+    """One request for several small topics. Returns a list aligned with `topics`; None where the batch had no usable entry."""
+    print(f"--- 2. THE MINER: Digging into {len(topics)} topics in one request ---")
+    prompt = _topic_batch_prompt(topics)
+    config = _json_config(llm_schemas.topic_batch_schema([_topic_fields(t)[0] for t in topics]))
+    try:
+        response_text = _call_model(prompt, generation_config=config, timeout=timeout)
+    except Exception as e:
+        print(f"❌ Batched topic request failed: {e}")
+        return [None] * len(topics)
+    parsed = _parse_topic_batch(response_text, topics) if response_text else [None] * len(topics)
+    if all(parsed):
+        _remember(prompt, response_text, config)
+    # Entries that came back partly invalid only re-ask for their gaps
+    return [_complete_topic(t, *entry, timeout=timeout) if entry else None for t, entry in zip(topics, parsed)]
+
+def generate_content_for_topics(syllabus: list, max_concurrency: int = None, timeout: float = None, batch: bool = None):
+    """
+    Fan-out of generate_content_for_topic over a bounded thread pool.
+    Returns a list aligned with `syllabus`; topics that failed or ran longer than
+    `timeout` seconds are None, so callers keep whatever finished.
+    With batching on, small topics share one request; topics a batch failed to cover are retried on their own.
+    """
+    max_concurrency = max(1, int(max_concurrency or TOPIC_CONCURRENCY))
+    timeout = float(timeout or TOPIC_TIMEOUT_S)
+    batch = TOPIC_BATCH_ENABLED if batch is None else batch
+    results = [None] * len(syllabus or [])
+    if not results:
+        return results
+    units = plan_topic_batches(syllabus) if batch else [[i] for i in range(len(results))]
+
+    started = {}
+
+    def _run(unit_id, indices):
+        started[unit_id] = time.monotonic()
+        if len(indices) == 1:
+            return [generate_content_for_topic(syllabus[indices[0]], timeout=timeout)]
+        return generate_content_for_topic_batch([syllabus[i] for i in indices], timeout=timeout)
+
+    pool = ThreadPoolExecutor(max_workers=min(max_concurrency, len(units)), thread_name_prefix="topic-gen")
+    unit_ids = itertools.count()
+
+    def _submit(indices):
+        unit_id = next(unit_ids)
+        return pool.submit(_run, unit_id, indices), (unit_id, indices)
+
+    pending = dict(_submit(u) for u in units)
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                _, indices = pending.pop(fut)
+                try:
+                    contents = fut.result()
+                except Exception as e:
+                    print(f"❌ Topic(s) {indices} failed: {e}")
+                    contents = [None] * len(indices)
+                missing = []
+                for idx, content in zip(indices, contents):
+                    results[idx] = content
+                    if content is None:
+                        missing.append(idx)
+                if len(indices) > 1 and missing:
+                    print(f"↩️ Batch missed {len(missing)}/{len(indices)} topics, falling back to one request each.")
+                    pending.update(_submit([idx]) for idx in missing)
+            # The timeout counts from when a unit actually started, not from when it was queued
+            now = time.monotonic()
+            for fut, (unit_id, indices) in list(pending.items()):
+                t0 = started.get(unit_id)
+                if t0 is not None and now - t0 > timeout:
+                    print(f"⏱️ Topic(s) {indices} exceeded {timeout:.0f}s, keeping partial results without them.")
+                    fut.cancel()
+                    pending.pop(fut)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    ok = sum(1 for r in results if r)
+    print(f"✅ Generated content for {ok}/{len(results)} topics in {len(units)} requests (concurrency={max_concurrency}).")
+    return results
+
+async def generate_syllabus_async(text: str):
+    print("--- 1. THE ARCHITECT: Analyzing PDF Structure (async) ---")
+    if not text:
+        print("⚠️ No text provided to generate_syllabus.")
+        return []
+    if AI_OFFLINE:
+        return _offline_syllabus()
+    chunks = split_text_chunks(text)
+    if len(chunks) > 1:
+        print(f"📚 Long document: map-reducing syllabus over {len(chunks)} chunks.")
+        sem = asyncio.Semaphore(TOPIC_CONCURRENCY)
+
+        async def _map(idx, chunk):
+            async with sem:
+                return await _chunk_topics_async(chunk, idx, len(chunks))
+
+        results = await asyncio.gather(*(_map(i, c) for i, c in enumerate(chunks)), return_exceptions=True)
+        return _reduce_chunk_results(list(results))
+    prompt = _syllabus_prompt(text)
+    config = _json_config(llm_schemas.SYLLABUS_SCHEMA)
+    try:
+        text_out = await _call_model_async(prompt, generation_config=config)
+        if not text_out:
+            print("❌ No response from model after retries.")
+            return []
+        syllabus = _parse_syllabus(text_out)
+        if syllabus:
+            await _remember_async(prompt, text_out, config)
+        return syllabus
+    except Exception as e:
+        return _syllabus_error_fallback(e)
+
+async def generate_content_for_topic_async(topic_data: dict, timeout: float = None):
+    topic, complexity, context = _topic_fields(topic_data)
+    print(f"--- 2. THE MINER: Digging into '{topic}' (async) ---")
+    prompt = _topic_prompt(topic, complexity, context)
+    config = _json_config(llm_schemas.TOPIC_CONTENT_SCHEMA)
+    try:
+        response_text = await _call_model_async(prompt, generation_config=config, timeout=timeout)
+        if not response_text:
+            print(f"❌ Skipped topic '{topic}' due to empty AI response.")
+            return None
+        content, missing = _parse_topic_content(response_text, topic, _num_cards(complexity))
+        if _has_content(content):
+            await _remember_async(prompt, response_text, config)
+        return await _complete_topic_async(topic_data, content, missing, timeout=timeout)
+    except Exception as e:
+        print(f"❌ Error generating content for {topic}: {e}")
+        return None
+
+async def generate_content_for_topic_batch_async(topics: list, timeout: float = None) -> list:
+    print(f"--- 2. THE MINER: Digging into {len(topics)} topics in one request (async) ---")
+    prompt = _topic_batch_prompt(topics)
+    config = _json_config(llm_schemas.topic_batch_schema([_topic_fields(t)[0] for t in topics]))
+    try:
+        response_text = await _call_model_async(prompt, generation_config=config, timeout=timeout)
+    except Exception as e:
+        print(f"❌ Batched topic request failed: {e}")
+        return [None] * len(topics)
+    parsed = _parse_topic_batch(response_text, topics) if response_text else [None] * len(topics)
+    if all(parsed):
+        await _remember_async(prompt, response_text, config)
+
+    async def _complete(topic_data, entry):
+        return await _complete_topic_async(topic_data, *entry, timeout=timeout) if entry else None
+
+    return list(await asyncio.gather(*(_complete(t, entry) for t, entry in zip(topics, parsed))))
+
+async def generate_content_for_topics_async(syllabus: list, max_concurrency: int = None, timeout: float = None,
+                                            on_topic_done=None, batch: bool = None):
+    """
+    Async counterpart of generate_content_for_topics: a semaphore bounds the fan-out and
+    asyncio.wait_for cancels a request once it has run for `timeout` seconds.
+    If given, `on_topic_done(idx, content)` is awaited as soon as each topic finishes
+    (content is None for failed topics), so callers can persist results incrementally.
+    """
+    max_concurrency = max(1, int(max_concurrency or TOPIC_CONCURRENCY))
+    timeout = float(timeout or TOPIC_TIMEOUT_S)
+    batch = TOPIC_BATCH_ENABLED if batch is None else batch
+    sem = asyncio.Semaphore(max_concurrency)
+    results = [None] * len(syllabus or [])
+    units = plan_topic_batches(syllabus) if batch else [[i] for i in range(len(results))]
+
+    async def _finish(idx, content):
+        results[idx] = content
+        if on_topic_done:
+            await on_topic_done(idx, content)
+
+    async def _single(idx):
+        content = None
+        async with sem:
+            try:
+                content = await asyncio.wait_for(generate_content_for_topic_async(syllabus[idx], timeout=timeout), timeout)
+            except asyncio.TimeoutError:
+                print(f"⏱️ Topic #{idx} exceeded {timeout:.0f}s, keeping partial results without it.")
+            except Exception as e:
+                print(f"❌ Topic #{idx} failed: {e}")
+        await _finish(idx, content)
+
+    async def _batch(indices):
+        contents = [None] * len(indices)
+        async with sem:
+            try:
+                contents = await asyncio.wait_for(
+                    generate_content_for_topic_batch_async([syllabus[i] for i in indices], timeout=timeout), timeout
+                )
+            except asyncio.TimeoutError:
+                print(f"⏱️ Batch {indices} exceeded {timeout:.0f}s.")
+            except Exception as e:
+                print(f"❌ Batch {indices} failed: {e}")
+        missing = []
+        for idx, content in zip(indices, contents):
+            if content:
+                await _finish(idx, content)
+            else:
+                missing.append(idx)
+        if missing:
+            print(f"↩️ Batch missed {len(missing)}/{len(indices)} topics, falling back to one request each.")
+            await asyncio.gather(*(_single(idx) for idx in missing))
+
+    await asyncio.gather(*(_single(u[0]) if len(u) == 1 else _batch(u) for u in units))
+    ok = sum(1 for r in results if r)
+    print(f"✅ Generated content for {ok}/{len(results)} topics in {len(units)} requests (concurrency={max_concurrency}).")
+    return results
+
+# --- NEW: generate_arena_questions_for_set (session generation) ---
+def _arena_one(study_set, seed: str, spec: tuple, sampling: dict, priority: str) -> dict:
+    variant_label, topic_focus = spec
+    prompt = _arena_prompt(study_set, seed, variant_label, topic_focus)
+    config = _json_config(llm_schemas.ARENA_SCHEMA, sampling)
+    text_out = ""
+    # A scenario that fails validation is asked for again before falling back to a placeholder
+    for _ in range(1 + LLM_REASK_ROUNDS):
+        # Call model with sampling params; fall back to a plain call if that fails
+        try:
+            try:
+                text_out = _call_model(prompt, generation_config=config, use_cache=False, priority=priority)
+            except TypeError:
+                text_out = _call_model(prompt, use_cache=False, priority=priority)
+        except Exception as e:
+            print("⚠️ generate_arena_questions_for_set model call failed:", e)
+            text_out = ""
+        item = _parse_arena(text_out, variant_label, seed, topic_focus)
+        if item or not text_out:
+            break
+    return item or _arena_fallback(text_out, variant_label, seed, topic_focus)
+
+def generate_arena_questions_for_set(study_set, generation_kwargs: dict, priority: str = rate_limiter.INTERACTIVE):
+    """
+    Generate `num_questions` application scenarios for the study_set.
+    Returns list of dicts: {"scenario":..., "ideal_response":..., "meta":{...}}
+    generation_kwargs["mode"] overrides ARENA_GENERATION_MODE ("single" or "concurrent").
+    """
+    num_questions, sampling, seed = _arena_kwargs(generation_kwargs)
+    mode = generation_kwargs.get("mode") or ARENA_GENERATION_MODE
+    specs = _arena_specs(num_questions, _arena_topics(study_set))
+
+    out = [None] * len(specs)
+    if mode == "single" and len(specs) > 1:
+        try:
+            text_out = _call_model(_arena_set_prompt(study_set, seed, specs),
+                                   generation_config=_json_config(llm_schemas.ARENA_LIST_SCHEMA, sampling),
+                                   use_cache=False, priority=priority)
+            out = _parse_arena_set(text_out, specs, seed)
+        except Exception as e:
+            print("⚠️ Single-request arena generation failed:", e)
+
+    # Concurrent mode, or whatever the single request did not cover (or that failed validation)
+    missing = [i for i, item in enumerate(out) if item is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(ARENA_CONCURRENCY, len(missing))), thread_name_prefix="arena-gen") as pool:
+            for i, item in zip(missing, pool.map(lambda i: _arena_one(study_set, seed, specs[i], sampling, priority), missing)):
+                out[i] = item
+    return out
+
+async def _arena_one_async(study_set, seed: str, spec: tuple, sampling: dict, priority: str) -> dict:
+    variant_label, topic_focus = spec
+    prompt = _arena_prompt(study_set, seed, variant_label, topic_focus)
+    config = _json_config(llm_schemas.ARENA_SCHEMA, sampling)
+    text_out = ""
+    for _ in range(1 + LLM_REASK_ROUNDS):
+        try:
+            # Arena variants are meant to differ per seed, so they never come from the cache
+            text_out = await _call_model_async(prompt, generation_config=config, use_cache=False, priority=priority)
+        except Exception as e:
+            print("⚠️ generate_arena_questions_for_set_async model call failed:", e)
+            text_out = ""
+        item = _parse_arena(text_out, variant_label, seed, topic_focus)
+        if item or not text_out:
+            break
+    return item or _arena_fallback(text_out, variant_label, seed, topic_focus)
+
+async def generate_arena_questions_for_set_async(study_set, generation_kwargs: dict, priority: str = rate_limiter.INTERACTIVE):
+    num_questions, sampling, seed = _arena_kwargs(generation_kwargs)
+    mode = generation_kwargs.get("mode") or ARENA_GENERATION_MODE
+    specs = _arena_specs(num_questions, _arena_topics(study_set))
+
+    out = [None] * len(specs)
+    if mode == "single" and len(specs) > 1:
+        try:
+            text_out = await _call_model_async(_arena_set_prompt(study_set, seed, specs),
+                                               generation_config=_json_config(llm_schemas.ARENA_LIST_SCHEMA, sampling),
+                                               use_cache=False, priority=priority)
+            out = _parse_arena_set(text_out, specs, seed)
+        except Exception as e:
+            print("⚠️ Single-request arena generation failed:", e)
+
+    missing = [i for i, item in enumerate(out) if item is None]
+    if missing:
+        sem = asyncio.Semaphore(max(1, ARENA_CONCURRENCY))
+
+        async def _run(i):
+            async with sem:
+                out[i] = await _arena_one_async(study_set, seed, specs[i], sampling, priority)
+
+        await asyncio.gather(*(_run(i) for i in missing))
+    return out
+
+# --- NEW FEATURES: QUIZ REGENERATION & ARENA GRADING ---
+
+def generate_quiz_from_context(context_text: str, num_questions: int = 5, use_cache: bool = True):
+    """
+    Generates dynamic MCQ quiz questions based on provided text (e.g. Flashcards).
+    Pass use_cache=False to get a new quiz rather than the one cached for the same context.
+    """
+    print(f"--- 3. THE EXAMINER: Creating {num_questions} new questions ---")
+    prompt = _quiz_prompt(context_text, num_questions)
+    config = _json_config(llm_schemas.QUIZ_LIST_SCHEMA)
+    try:
+        text_out = _call_model(prompt, generation_config=config, use_cache=use_cache, priority=rate_limiter.INTERACTIVE)
+        if not text_out:
+            return []
+        questions = _parse_quiz(text_out)
+        if questions:
+            _remember(prompt, text_out, config)
+        # Only the shortfall (invalid or missing questions) is asked for again
+        for _ in range(LLM_REASK_ROUNDS):
+            if len(questions) >= num_questions:
+                break
+            reask = _quiz_reask_prompt(context_text, num_questions - len(questions), questions)
+            text_out = _call_model(reask, generation_config=config, use_cache=use_cache, priority=rate_limiter.INTERACTIVE)
+            extra = _parse_quiz(text_out) if text_out else []
+            if extra:
+                _remember(reask, text_out, config)
+                questions.extend(extra)
+        return questions[:num_questions]
+    except Exception as e:
+        print(f"Quiz Gen Error: {e}")
+        return []
+
+async def generate_quiz_from_context_async(context_text: str, num_questions: int = 5, use_cache: bool = True,
+                                           priority: str = rate_limiter.INTERACTIVE):
+    print(f"--- 3. THE EXAMINER: Creating {num_questions} new questions (async) ---")
+    prompt = _quiz_prompt(context_text, num_questions)
+    config = _json_config(llm_schemas.QUIZ_LIST_SCHEMA)
+    try:
+        text_out = await _call_model_async(prompt, generation_config=config, use_cache=use_cache, priority=priority)
+        if not text_out:
+            return []
+        questions = _parse_quiz(text_out)
+        if questions:
+            await _remember_async(prompt, text_out, config)
+        for _ in range(LLM_REASK_ROUNDS):
+            if len(questions) >= num_questions:
+                break
+            reask = _quiz_reask_prompt(context_text, num_questions - len(questions), questions)
+            text_out = await _call_model_async(reask, generation_config=config, use_cache=use_cache, priority=priority)
+            extra = _parse_quiz(text_out) if text_out else []
+            if extra:
+                await _remember_async(reask, text_out, config)
+                questions.extend(extra)
+        return questions[:num_questions]
+    except Exception as e:
+        print(f"Quiz Gen Error: {e}")
+        return []
+
+def grade_arena_submission(scenario: str, user_response: str):
+    """
+    Grades the user's open-ended response against the scenario.
+    Returns JSON: { "score": 85, "feedback": "Good job, but you missed..." }
+    """
+    print("--- 4. THE GRADER: Assessing Arena Submission ---")
+    prompt = _grade_prompt(scenario, user_response)
+    config = _json_config(llm_schemas.GRADE_SCHEMA)
+    try:
+        for attempt in range(1 + LLM_REASK_ROUNDS):
+            # A re-ask must not be answered with the cached invalid reply
+            text_out = _call_model(prompt, generation_config=config, use_cache=attempt == 0, priority=rate_limiter.INTERACTIVE)
+            if not text_out:
+                return {"score": 0, "feedback": "AI Grading unavailable."}
+            grade = _parse_grade(text_out)
+            if grade:
+                _remember(prompt, text_out, config)
+                return grade
+        raise ValueError(f"grade failed validation: {text_out[:80]!r}")
+    except Exception as e:
+        print(f"Grading Error: {e}")
+        return {"score": 0, "feedback": "AI Grading failed. Please try again."}
+
+async def grade_arena_submission_async(scenario: str, user_response: str):
+    print("--- 4. THE GRADER: Assessing Arena Submission (async) ---")
+    prompt = _grade_prompt(scenario, user_response)
+    config = _json_config(llm_schemas.GRADE_SCHEMA)
     try:
-        response = retry_with_backoff(_call)
-        if not response:
-            return {"score": 0, "feedback": "AI Grading unavailable."}
-            
-        text_out = response.text if hasattr(response, 'text') else str(response)
-        cleaned = repair_json(text_out)
-        return json.loads(cleaned)
+        for attempt in range(1 + LLM_REASK_ROUNDS):
+            text_out = await _call_model_async(prompt, generation_config=config, use_cache=attempt == 0,
+                                               priority=rate_limiter.INTERACTIVE)
+            if not text_out:
+                return {"score": 0, "feedback": "AI Grading unavailable."}
+            grade = _parse_grade(text_out)
+            if grade:
+                await _remember_async(prompt, text_out, config)
+                return grade
+        raise ValueError(f"grade failed validation: {text_out[:80]!r}")
     except Exception as e:
         print(f"Grading Error: {e}")
-        return {"score": 0, "feedback": "AI Grading failed. Please try again."}
\ No newline at end of file
+        return {"score": 0, "feedback": "AI Grading failed. Please try again."}
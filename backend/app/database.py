@@ -1,7 +1,13 @@
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 import os
+import time
+import threading
+from collections import deque
 from dotenv import load_dotenv
 
 # 1. Load the .env file explicitly
@@ -14,8 +20,95 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("DATABASE_URL is missing! Please check your .env file.")
 
+# Pool tuning. Sizes are per engine: the sync and the async engine each get their own pool.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "10"))
+# Connections older than this are replaced (stays under server / proxy idle timeouts)
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Async engine URL; derived from DATABASE_URL (postgresql -> postgresql+asyncpg, sqlite -> sqlite+aiosqlite) when unset
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
+
+class PoolStats:
+    """Checkout wait times and timeouts of one pool, for /api/metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = deque(maxlen=2000)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_s_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.waits.append(waited)
+            self.wait_s_max = max(self.wait_s_max, waited)
+
+    def snapshot(self, pool) -> dict:
+        with self.lock:
+            recent = sorted(self.waits)
+            out = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_s_p50": round(recent[len(recent) // 2], 4) if recent else 0.0,
+                "wait_s_p99": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 4) if recent else 0.0,
+                "wait_s_max": round(self.wait_s_max, 4),
+            }
+        if isinstance(pool, QueuePool):
+            out.update({"size": pool.size(), "checked_out": pool.checkedout(), "checked_in": pool.checkedin(),
+                        "overflow": max(0, pool.overflow()), "max_overflow": DB_MAX_OVERFLOW})
+        return out
+
+def _timed(pool_class):
+    """`pool_class` that times how long each checkout waited for a connection."""
+
+    class TimedPool(pool_class):
+        stats = None
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except PoolTimeoutError:
+                self.stats.record(time.perf_counter() - started, timed_out=True)
+                raise
+            self.stats.record(time.perf_counter() - started)
+            return conn
+
+        def recreate(self):
+            new = super().recreate()
+            new.stats = self.stats
+            return new
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+def _pool_kwargs(url: str, pool_class) -> dict:
+    # In-memory SQLite keeps its single-connection pool
+    if url.startswith("sqlite") and (":memory:" in url or url.endswith("://")):
+        return {}
+    return {
+        "poolclass": _timed(pool_class),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_S,
+        "pool_recycle": DB_POOL_RECYCLE_S,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def _with_stats(engine):
+    if hasattr(engine.pool, "stats"):
+        engine.pool.stats = PoolStats()
+    return engine
+
 # 4. Create the engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = _with_stats(create_engine(SQLALCHEMY_DATABASE_URL, **_pool_kwargs(SQLALCHEMY_DATABASE_URL, QueuePool)))
 
 # 5. Create the SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -30,3 +123,41 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# 8. Async engine, created on first use so deployments without the async driver still start
+def async_url(url: str = SQLALCHEMY_DATABASE_URL) -> str:
+    if ASYNC_DATABASE_URL:
+        return ASYNC_DATABASE_URL
+    scheme, sep, rest = url.partition("://")
+    driver = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg",
+              "postgresql+psycopg2": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}.get(scheme, scheme)
+    return f"{driver}{sep}{rest}"
+
+_async_engine = None
+_AsyncSessionLocal = None
+_async_lock = threading.Lock()
+
+def get_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    with _async_lock:
+        if _async_engine is None:
+            url = async_url()
+            _async_engine = create_async_engine(url, **_pool_kwargs(url, AsyncAdaptedQueuePool))
+            _with_stats(_async_engine.sync_engine)
+            _AsyncSessionLocal = async_sessionmaker(_async_engine, expire_on_commit=False, autoflush=False)
+    return _async_engine
+
+async def get_async_db():
+    """Async counterpart of get_db for `async def` endpoints: no threadpool slot is held while waiting on the DB."""
+    get_async_engine()
+    async with _AsyncSessionLocal() as db:
+        yield db
+
+def pool_stats() -> dict:
+    out = {"sync": engine.pool.stats.snapshot(engine.pool) if hasattr(engine.pool, "stats") else {"pool": type(engine.pool).__name__}}
+    if _async_engine is not None:
+        pool = _async_engine.sync_engine.pool
+        out["async"] = pool.stats.snapshot(pool) if hasattr(pool, "stats") else {"pool": type(pool).__name__}
+    else:
+        out["async"] = {"started": False}
+    return out
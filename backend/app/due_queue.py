@@ -0,0 +1,145 @@
+import os
+import math
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+try:
+    from app import models
+except ImportError:
+    import models
+
+# --- Config ---
+load_dotenv()
+# Width of a due bucket. A card counts as due from the end of its bucket, i.e. at most this much late.
+DUE_BUCKET_MINUTES = int(os.getenv("DUE_BUCKET_MINUTES", "60"))
+
+# Bucket of never-reviewed cards (always due). Past buckets are folded into it as well.
+NEW_CARDS = datetime(1970, 1, 1)
+
+# Per (user, set, bucket) card counts, kept in step with flashcards.next_review_date by the code that
+# creates and reviews cards. Counts are additive: a row may go negative until the next fold.
+_counters = models.DueCardCounter.__table__
+
+def bucket(next_review_date) -> datetime:
+    """The bucket a card with this next_review_date is counted in: its due time rounded up."""
+    if next_review_date is None:
+        return NEW_CARDS
+    step = DUE_BUCKET_MINUTES * 60
+    seconds = (next_review_date - NEW_CARDS).total_seconds()
+    return NEW_CARDS + timedelta(seconds=math.ceil(seconds / step) * step)
+
+def _insert(dialect: str):
+    if dialect == "postgresql":
+        return pg_insert(_counters)
+    if dialect == "sqlite":
+        return sqlite_insert(_counters)
+    raise NotImplementedError(f"due_queue needs an upsert; not available for {dialect}")
+
+def _add_on_conflict(stmt):
+    return stmt.on_conflict_do_update(
+        index_elements=[_counters.c.user_id, _counters.c.set_id, _counters.c.due_at],
+        set_={"card_count": _counters.c.card_count + stmt.excluded.card_count},
+    )
+
+def add_stmt(dialect: str, rows: list):
+    """Upsert that adds rows' {"user_id", "set_id", "due_at", "card_count"} to the counters."""
+    return _add_on_conflict(_insert(dialect).values(rows))
+
+def new_cards_stmt(dialect: str, set_id: int, count: int):
+    """Upsert that counts `count` new cards of a set (the owner is read from study_sets in the same statement)."""
+    study_sets = models.StudySet.__table__
+    # The WHERE clause also keeps SQLite from reading ON CONFLICT as a join constraint
+    source = select(study_sets.c.user_id, study_sets.c.id, literal(NEW_CARDS, _counters.c.due_at.type), literal(count))\
+        .where(study_sets.c.id == set_id)
+    stmt = _insert(dialect).from_select(["user_id", "set_id", "due_at", "card_count"], source)
+    return _add_on_conflict(stmt)
+
+def card_moved(db: Session, user_id: int, set_id: int, old_due, new_due, now: datetime = None):
+    """Moves one card from the bucket of `old_due` to that of `new_due`. Does not commit."""
+    cards_moved(db, user_id, [(set_id, old_due, new_due)], now)
+
+def cards_moved(db: Session, user_id: int, moves: list, now: datetime = None):
+    """
+    Applies [(set_id, old_due, new_due)] of one user as a single upsert of the net bucket changes,
+    then folds the touched sets. Does not commit.
+    """
+    deltas = Counter()
+    for set_id, old_due, new_due in moves:
+        old, new = bucket(old_due), bucket(new_due)
+        if old != new:
+            deltas[(set_id, old)] -= 1
+            deltas[(set_id, new)] += 1
+    rows = [{"user_id": user_id, "set_id": s, "due_at": d, "card_count": n} for (s, d), n in deltas.items() if n]
+    if rows:
+        db.execute(add_stmt(db.get_bind().dialect.name, rows))
+    for set_id in sorted({m[0] for m in moves}):
+        fold(db, user_id, set_id, now or datetime.utcnow())
+
+def fold(db: Session, user_id: int, set_id: int, now: datetime):
+    """
+    Merges a set's past buckets into NEW_CARDS, so the due sum stays one row per set. Does not commit.
+    The rows are locked first; a concurrent update of a deleted bucket simply re-creates it.
+    """
+    rows = db.execute(
+        select(_counters.c.due_at, _counters.c.card_count)
+        .where(_counters.c.user_id == user_id, _counters.c.set_id == set_id,
+               _counters.c.due_at > NEW_CARDS, _counters.c.due_at <= now)
+        .with_for_update()
+    ).all()
+    if not rows:
+        return
+    db.execute(delete(_counters).where(
+        _counters.c.user_id == user_id, _counters.c.set_id == set_id,
+        _counters.c.due_at.in_([r.due_at for r in rows]),
+    ))
+    db.execute(add_stmt(db.get_bind().dialect.name, [
+        {"user_id": user_id, "set_id": set_id, "due_at": NEW_CARDS, "card_count": sum(r.card_count for r in rows)},
+    ]))
+
+def due_counts_stmt(user_id: int, now: datetime):
+    """Per-set due counts of a user: reads the user's counter rows, never the flashcards."""
+    total = func.sum(_counters.c.card_count)
+    due = select(_counters.c.set_id, total.label("due_count"))\
+        .where(_counters.c.user_id == user_id, _counters.c.due_at <= now)\
+        .group_by(_counters.c.set_id)\
+        .having(total > 0)\
+        .subquery()
+    return select(models.StudySet.id, models.StudySet.title, due.c.due_count)\
+        .join(due, due.c.set_id == models.StudySet.id)
+
+def daily_load(db: Session, user_id: int, start: datetime, end: datetime) -> dict:
+    """{date: cards due that day} for one user between `start` and `end`, summed from the hourly buckets."""
+    width = timedelta(minutes=DUE_BUCKET_MINUTES)
+    rows = db.execute(
+        select(_counters.c.due_at, func.sum(_counters.c.card_count))
+        .where(_counters.c.user_id == user_id, _counters.c.due_at > start, _counters.c.due_at <= end + width)
+        .group_by(_counters.c.due_at)
+    ).all()
+    load = Counter()
+    for due_at, count in rows:
+        # A bucket is labelled with its end; its cards fall due during the bucket
+        load[(due_at - width).date()] += count
+    return dict(load)
+
+def rebuild(db: Session, user_id: int = None) -> int:
+    """Recomputes the counters from flashcards (all users, or one). Does not commit. Returns the cards counted."""
+    cards = select(models.StudySet.user_id, models.Flashcard.set_id, models.Flashcard.next_review_date)\
+        .join(models.StudySet, models.StudySet.id == models.Flashcard.set_id)
+    clear = delete(_counters)
+    if user_id is not None:
+        cards = cards.where(models.StudySet.user_id == user_id)
+        clear = clear.where(_counters.c.user_id == user_id)
+    counts = Counter()
+    for owner, set_id, next_review_date in db.execute(cards.execution_options(yield_per=10000)):
+        counts[(owner, set_id, bucket(next_review_date))] += 1
+    db.execute(clear)
+    rows = [{"user_id": u, "set_id": s, "due_at": d, "card_count": n} for (u, s, d), n in counts.items()]
+    for start in range(0, len(rows), 5000):
+        db.execute(_counters.insert(), rows[start:start + 5000])
+    return sum(counts.values())
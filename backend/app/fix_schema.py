@@ -80,6 +80,34 @@ def fix_schema():
                 except Exception as e:
                     print(f"   🔥 Failed to add column: {e}")
 
+        # --- FIX 4: JOBS TABLE (queue columns) ---
+        print("\n4️⃣ Checking 'jobs' table for queue columns...")
+        queue_columns = {
+            "priority": "INTEGER DEFAULT 100",
+            "attempts": "INTEGER DEFAULT 0",
+            "max_attempts": "INTEGER DEFAULT 3",
+            "run_after": "TIMESTAMP",
+            "locked_by": "VARCHAR",
+            "locked_until": "TIMESTAMP",
+        }
+        for column, ddl in queue_columns.items():
+            try:
+                conn.execute(text(f"SELECT {column} FROM jobs LIMIT 1"))
+            except Exception:
+                conn.rollback()
+                try:
+                    conn.execute(text(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}"))
+                    conn.commit()
+                    print(f"   ✅ Created '{column}' column")
+                except Exception as e:
+                    conn.rollback()
+                    print(f"   ⚠️ Could not add '{column}' (jobs table may not exist yet): {e}")
+        try:
+            conn.execute(text("UPDATE jobs SET run_after = created_at WHERE run_after IS NULL"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_jobs_claim ON jobs (status, priority, run_after)"))
+        except Exception:
+            conn.rollback()
+
         conn.commit()
         print("\n✨ Schema Repair Complete!")
 
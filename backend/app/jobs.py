@@ -0,0 +1,407 @@
+import os
+import asyncio
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, or_, and_, func
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+try:
+    from app import database, models
+except ImportError:
+    import database, models
+
+# --- Config ---
+load_dotenv()
+# "inline": the API process runs jobs itself (single-box dev setup), retries included.
+# "queue": the API only enqueues; `python worker.py` processes claim and run the jobs.
+JOB_EXECUTION = os.getenv("JOB_EXECUTION", "inline").lower()
+QUEUE_MODE = JOB_EXECUTION == "queue"
+# Worker loops started inside the API process in queue mode (0 = rely on external workers only)
+EMBEDDED_WORKERS = int(os.getenv("EMBEDDED_WORKERS", "0"))
+JOB_VISIBILITY_TIMEOUT_S = float(os.getenv("JOB_VISIBILITY_TIMEOUT_S", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_S = float(os.getenv("JOB_RETRY_BASE_S", "10"))
+JOB_POLL_INTERVAL_S = float(os.getenv("JOB_POLL_INTERVAL_S", "1.0"))
+JOB_WAIT_TIMEOUT_S = float(os.getenv("JOB_WAIT_TIMEOUT_S", "120"))
+
+# Lower number = claimed first
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BULK = 100
+
+# queued -> running -> succeeded | queued (retry) | failed (permanent) | dead (retries exhausted)
+TERMINAL_STATUSES = ("succeeded", "failed", "dead")
+
+HANDLERS = {}
+
+# wait_for() callers in this process, woken when this process commits a job change:
+# job id -> {(loop, asyncio.Event)}. Jobs run by other processes are seen by polling.
+_waiters = {}
+_waiters_lock = threading.Lock()
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help (bad input, missing rows...)."""
+
+def register(kind: str):
+    """Decorator: registers `async def handler(db, job) -> dict` for a job kind."""
+    def _wrap(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return _wrap
+
+def _load_handlers():
+    # Handlers live next to the code they drive; importing the module registers them
+    if not HANDLERS:
+        try:
+            from app import pipeline  # noqa: F401
+        except ImportError:
+            import pipeline  # noqa: F401
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+# --- Producer side ---
+def enqueue(db: Session, kind: str, user_id: int = None, set_id: int = None, payload: dict = None,
+            input_blob: bytes = None, priority: int = PRIORITY_BULK, max_attempts: int = None):
+    now = datetime.utcnow()
+    job = models.Job(
+        kind=kind,
+        user_id=user_id,
+        set_id=set_id,
+        status="queued",
+        priority=priority,
+        attempts=0,
+        max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+        run_after=now,
+        progress=[],
+        payload=payload or {},
+        input_blob=input_blob,
+        created_at=now,
+        updated_at=now
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def _notify(job_id: int):
+    """Wakes this process's wait_for() callers of the job (from any thread)."""
+    with _waiters_lock:
+        waiters = list(_waiters.get(job_id, ()))
+    for loop, event in waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass  # that caller's loop is closed
+
+async def wait_for(job_id: int, timeout: float = None) -> dict:
+    """
+    Waits for a job to reach a terminal status (or the timeout) and returns its view. Woken as soon as
+    this process changes the job; jobs run elsewhere are re-read every JOB_POLL_INTERVAL_S.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (timeout or JOB_WAIT_TIMEOUT_S)
+    waiter = (loop, asyncio.Event())
+    with _waiters_lock:
+        _waiters.setdefault(job_id, set()).add(waiter)
+    try:
+        while True:
+            # Cleared before the read: a change committed after it still wakes the wait below
+            waiter[1].clear()
+            db = database.SessionLocal()
+            try:
+                job = db.get(models.Job, job_id)
+                view = job_view(job) if job else None
+            finally:
+                db.close()
+            if view is None or view["status"] in TERMINAL_STATUSES:
+                return view
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return view
+            try:
+                await asyncio.wait_for(waiter[1].wait(), min(JOB_POLL_INTERVAL_S, remaining))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        with _waiters_lock:
+            _waiters[job_id].discard(waiter)
+            if not _waiters[job_id]:
+                del _waiters[job_id]
+
+# --- Consumer side ---
+def _lease(db: Session, job, worker_id: str, now: datetime) -> bool:
+    """
+    Takes the lease with a guarded UPDATE (status and attempts unchanged since we read the row).
+    On Postgres the row lock already makes this a formality; on SQLite, which has no
+    SKIP LOCKED, it is what stops two workers from claiming the same job.
+    """
+    taken = db.query(models.Job).filter(
+        models.Job.id == job.id, models.Job.status == job.status, models.Job.attempts == (job.attempts or 0)
+    ).update({
+        "status": "running",
+        "locked_by": worker_id,
+        "locked_until": now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT_S),
+        "attempts": (job.attempts or 0) + 1,
+        "updated_at": now,
+    }, synchronize_session=False)
+    db.commit()
+    if taken:
+        db.refresh(job)
+    return bool(taken)
+
+def claim_next_stmt(now: datetime, kinds: list = None):
+    """The next runnable job (see claim_next), locked with FOR UPDATE SKIP LOCKED. Also EXPLAINed by check_query_plans.py."""
+    stmt = select(models.Job).where(or_(
+        and_(models.Job.status == "queued", models.Job.run_after <= now),
+        and_(models.Job.status == "running", models.Job.locked_until < now),
+    ))
+    if kinds:
+        stmt = stmt.where(models.Job.kind.in_(kinds))
+    return stmt.order_by(models.Job.priority, models.Job.run_after, models.Job.id)\
+        .limit(1).with_for_update(skip_locked=True)
+
+def claim_next(db: Session, worker_id: str, kinds: list = None):
+    """
+    Claims the next runnable job: queued and due, or running with an expired lease (its worker died).
+    SELECT ... FOR UPDATE SKIP LOCKED lets any number of workers poll the table without blocking
+    each other or double-claiming. Jobs whose lease expired on their last attempt are dead-lettered.
+    """
+    while True:
+        now = datetime.utcnow()
+        job = db.execute(claim_next_stmt(now, kinds)).scalars().first()
+        if job is None:
+            db.commit()
+            return None
+        if job.status == "running" and (job.attempts or 0) >= (job.max_attempts or JOB_MAX_ATTEMPTS):
+            _dead_letter(db, job, f"Lease expired on final attempt (worker {job.locked_by})")
+            continue
+        if _lease(db, job, worker_id, now):
+            return job
+
+def claim(db: Session, job_id: int, worker_id: str = None) -> bool:
+    """Claims one specific queued job (used by the API in inline mode)."""
+    job = db.query(models.Job).filter(models.Job.id == job_id, models.Job.status == "queued")\
+        .with_for_update(skip_locked=True).first()
+    if job is None:
+        db.commit()
+        return False
+    return _lease(db, job, worker_id or default_worker_id(), datetime.utcnow())
+
+def heartbeat(job_id: int, worker_id: str) -> bool:
+    """Extends the lease of a job this worker still owns. False means the job was taken over."""
+    db = database.SessionLocal()
+    try:
+        updated = db.query(models.Job).filter(
+            models.Job.id == job_id, models.Job.locked_by == worker_id, models.Job.status == "running"
+        ).update({"locked_until": datetime.utcnow() + timedelta(seconds=JOB_VISIBILITY_TIMEOUT_S)},
+                 synchronize_session=False)
+        db.commit()
+        return bool(updated)
+    finally:
+        db.close()
+
+def emit(db: Session, job, stage: str, message: str, **data):
+    """Appends a progress event to the job and commits it (together with any pending row writes)."""
+    now = datetime.utcnow()
+    events = list(job.progress or [])
+    events.append({"seq": len(events) + 1, "stage": stage, "message": message, "at": now.isoformat(), **data})
+    job.progress = events
+    job.stage = stage
+    job.updated_at = now
+    if job.status == "running" and job.locked_by:
+        # Progress doubles as a heartbeat
+        job.locked_until = now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT_S)
+    db.commit()
+    _notify(job.id)
+
+def complete(db: Session, job, result: dict):
+    job.status = "succeeded"
+    job.result = result
+    job.error = None
+    job.input_blob = None
+    job.locked_until = None
+    emit(db, job, "done", "Job finished", result=result)
+
+def _dead_letter(db: Session, job, error: str):
+    job.status = "dead"
+    job.error = error
+    job.locked_until = None
+    emit(db, job, "dead", error, attempts=job.attempts)
+
+def fail(db: Session, job, error: str, retryable: bool = True):
+    """Schedules a retry with jittered exponential backoff, or ends the job (failed / dead-lettered)."""
+    attempts = job.attempts or 0
+    if not retryable:
+        job.status = "failed"
+        job.error = error
+        job.locked_until = None
+        emit(db, job, "failed", error)
+        return
+    if attempts >= (job.max_attempts or JOB_MAX_ATTEMPTS):
+        _dead_letter(db, job, error)
+        return
+    delay = JOB_RETRY_BASE_S * (2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+    job.status = "queued"
+    job.error = error
+    job.locked_by = None
+    job.locked_until = None
+    job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+    emit(db, job, "retry", f"{error} (retrying in {delay:.0f}s)", attempts=attempts)
+
+def requeue_dead(db: Session, kinds: list = None) -> int:
+    """Moves dead-lettered jobs back to the queue with a fresh attempt budget."""
+    query = db.query(models.Job).filter(models.Job.status == "dead")
+    if kinds:
+        query = query.filter(models.Job.kind.in_(kinds))
+    count = query.update({"status": "queued", "attempts": 0, "run_after": datetime.utcnow(),
+                          "locked_by": None, "locked_until": None}, synchronize_session=False)
+    db.commit()
+    return count
+
+def job_view(job) -> dict:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "stage": job.stage,
+        "set_id": job.set_id,
+        "attempts": job.attempts,
+        "progress": job.progress or [],
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+def queue_stats(db: Session) -> dict:
+    rows = db.query(models.Job.kind, models.Job.status, func.count(models.Job.id))\
+        .group_by(models.Job.kind, models.Job.status).all()
+    out = {}
+    for kind, status, count in rows:
+        out.setdefault(kind, {})[status] = count
+    return out
+
+# --- Execution ---
+async def _keep_alive(job_id: int, worker_id: str):
+    while True:
+        await asyncio.sleep(JOB_VISIBILITY_TIMEOUT_S / 3)
+        if not await asyncio.to_thread(heartbeat, job_id, worker_id):
+            print(f"⚠️ Lost lease on job #{job_id}")
+            return
+
+async def run_job(job_id: int, worker_id: str = None):
+    """Runs one claimed job through its handler and records the outcome."""
+    _load_handlers()
+    worker_id = worker_id or default_worker_id()
+    db = database.SessionLocal()
+    keep_alive = asyncio.get_running_loop().create_task(_keep_alive(job_id, worker_id))
+    try:
+        job = db.get(models.Job, job_id)
+        if job is None or job.status in TERMINAL_STATUSES:
+            return
+        handler = HANDLERS.get(job.kind)
+        if handler is None:
+            fail(db, job, f"No handler for job kind '{job.kind}'", retryable=False)
+            return
+        try:
+            result = await handler(db, job)
+        except PermanentJobError as e:
+            db.rollback()
+            fail(db, job, str(e), retryable=False)
+        except Exception as e:
+            print(f"🔥 Job #{job_id} ({job.kind}) attempt {job.attempts} failed: {e}")
+            db.rollback()
+            fail(db, job, f"{type(e).__name__}: {e}")
+        else:
+            complete(db, job, result)
+    except Exception as e:
+        print(f"⚠️ Could not record outcome of job #{job_id}: {e}")
+    finally:
+        keep_alive.cancel()
+        db.close()
+
+# Keep references to in-process job tasks so they aren't garbage-collected mid-run
+_BACKGROUND_TASKS = set()
+
+def start_in_background(job_id: int, worker_id: str = None):
+    task = asyncio.get_running_loop().create_task(run_job(job_id, worker_id))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+async def run_worker(worker_id: str = None, concurrency: int = 1, kinds: list = None, stop: asyncio.Event = None):
+    """
+    Worker loop: keeps up to `concurrency` jobs in flight, claiming more whenever a slot frees up.
+    Safe to run in many processes on many nodes against the same database.
+    """
+    _load_handlers()
+    worker_id = worker_id or default_worker_id()
+    stop = stop or asyncio.Event()
+    slots = asyncio.Semaphore(max(1, concurrency))
+    running = set()
+    print(f"👷 Worker {worker_id} started (concurrency={concurrency}, kinds={kinds or 'all'})")
+    while not stop.is_set():
+        await slots.acquire()
+        try:
+            job = await asyncio.to_thread(_claim_in_new_session, worker_id, kinds)
+        except Exception as e:
+            print(f"⚠️ Worker {worker_id} could not claim a job: {e}")
+            job = None
+        if job is None:
+            slots.release()
+            try:
+                await asyncio.wait_for(stop.wait(), JOB_POLL_INTERVAL_S)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        task = asyncio.get_running_loop().create_task(run_job(job, worker_id))
+        running.add(task)
+        task.add_done_callback(lambda t: (running.discard(t), slots.release()))
+    if running:
+        await asyncio.gather(*running, return_exceptions=True)
+
+def start_worker_in_background(worker_id: str = None, concurrency: int = 1, kinds: list = None):
+    """Runs a worker loop inside the current event loop (API process with EMBEDDED_WORKERS)."""
+    task = asyncio.get_running_loop().create_task(run_worker(worker_id, concurrency, kinds))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+def _claim_in_new_session(worker_id: str, kinds: list = None):
+    db = database.SessionLocal()
+    try:
+        job = claim_next(db, worker_id, kinds)
+        return job.id if job else None
+    finally:
+        db.close()
+
+def recover_inline_jobs():
+    """
+    Inline mode startup: picks up jobs left queued, or running with an expired lease, by a
+    previous API process and runs them here. Claims go through the same SKIP LOCKED path.
+    """
+    db = database.SessionLocal()
+    worker_id = default_worker_id()
+    resumed = 0
+    try:
+        while True:
+            job = claim_next(db, worker_id)
+            if job is None:
+                break
+            start_in_background(job.id, worker_id)
+            resumed += 1
+    finally:
+        db.close()
+    if resumed:
+        print(f"🔁 Resumed {resumed} pending job(s).")
+
+def start_inline_retries():
+    """
+    Inline mode: a one-slot claim loop in the API process. fail() puts a retryable job back in the
+    queue with a future run_after; this loop runs it once it is due (and anything else left queued).
+    """
+    return start_worker_in_background(f"{default_worker_id()}:inline", concurrency=1)
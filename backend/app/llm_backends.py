@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import random
+import asyncio
+import weakref
+from abc import ABC, abstractmethod
+from hashlib import sha256
+
+import requests
+from dotenv import load_dotenv
+
+# Optional: async HTTP client for the stub backend (falls back to requests in a thread)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Optional: official Google client (used when available)
+try:
+    import google.generativeai as genai
+except Exception:
+    genai = None
+
+# --- Config ---
+load_dotenv()
+# "gemini" (default), "stub" (HTTP stub server, see llm_stub_server.py) or "local" (stub answers in-process, no network)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+LLM_STUB_URL = os.getenv("LLM_STUB_URL", "http://127.0.0.1:8765")
+# Used when a call doesn't pass its own timeout
+LLM_STUB_TIMEOUT_S = float(os.getenv("LLM_STUB_TIMEOUT_S", "60"))
+
+BACKENDS = ("gemini", "stub", "local")
+
+class BackendError(RuntimeError):
+    """An HTTP error from a backend. The status code leads the message, so the retry policy in ai_engine sees "429" / "500"."""
+
+    def __init__(self, status: int, detail: str = ""):
+        super().__init__(f"{status} {detail}".strip())
+        self.status = status
+
+class Usage:
+    def __init__(self, total_token_count: int = 0):
+        self.total_token_count = total_token_count
+
+class Response:
+    """The part of a Gemini response ai_engine reads: `.text` and `.usage_metadata.total_token_count`."""
+
+    def __init__(self, text: str, total_tokens: int = 0):
+        self.text = text
+        self.usage_metadata = Usage(total_tokens)
+
+class LLMBackend(ABC):
+    """
+    What ai_engine needs from a model: the two calls of google.generativeai.GenerativeModel.
+    `generation_config` is a plain dict and `request_options` may carry a "timeout" in seconds.
+    Both return a Response-like object (`.text`, `.usage_metadata.total_token_count`).
+    """
+    name = "base"
+
+    @abstractmethod
+    def generate_content(self, prompt: str, generation_config: dict = None, request_options: dict = None):
+        ...
+
+    @abstractmethod
+    async def generate_content_async(self, prompt: str, generation_config: dict = None, request_options: dict = None):
+        ...
+
+def _sdk_kwargs(generation_config=None, request_options=None) -> dict:
+    kwargs = {}
+    if generation_config:
+        kwargs["generation_config"] = generation_config
+    if request_options:
+        kwargs["request_options"] = request_options
+    return kwargs
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model_name: str):
+        if not genai:
+            raise RuntimeError("google.generativeai client not installed or importable.")
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        return self.model.generate_content(prompt, **_sdk_kwargs(generation_config, request_options))
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        return await self.model.generate_content_async(prompt, **_sdk_kwargs(generation_config, request_options))
+
+class StubBackend(LLMBackend):
+    """Talks to llm_stub_server.py. Sync calls share one requests.Session; async calls use httpx when installed."""
+    name = "stub"
+
+    def __init__(self, url: str = None):
+        self.url = (url or LLM_STUB_URL).rstrip("/") + "/v1/generate"
+        self._http = requests.Session()
+        self._clients = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+
+    def _timeout(self, request_options) -> float:
+        return float((request_options or {}).get("timeout") or LLM_STUB_TIMEOUT_S)
+
+    def _response(self, status: int, body: str) -> Response:
+        if status >= 400:
+            raise BackendError(status, body[:200])
+        data = json.loads(body)
+        return Response(data.get("text", ""), int((data.get("usage") or {}).get("total_tokens") or 0))
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        resp = self._http.post(self.url, json={"prompt": prompt, "generation_config": generation_config or {}},
+                               timeout=self._timeout(request_options))
+        return self._response(resp.status_code, resp.text)
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        if httpx is None:
+            return await super().generate_content_async(prompt, generation_config, request_options)
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = httpx.AsyncClient(limits=httpx.Limits(max_connections=100))
+        resp = await client.post(self.url, json={"prompt": prompt, "generation_config": generation_config or {}},
+                                 timeout=self._timeout(request_options))
+        return self._response(resp.status_code, resp.text)
+
+class LocalBackend(LLMBackend):
+    """The stub's answers without the server: no latency, no errors, no network."""
+    name = "local"
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        text = stub_response(prompt, generation_config)
+        return Response(text, estimate_usage(prompt, text))
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        return self.generate_content(prompt, generation_config, request_options)
+
+def create(name: str = None, model_name: str = None) -> LLMBackend:
+    name = (name or LLM_BACKEND).lower()
+    if name == "gemini":
+        return GeminiBackend(model_name)
+    if name == "stub":
+        return StubBackend()
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"Unknown LLM_BACKEND {name!r} (expected one of {', '.join(BACKENDS)})")
+
+# --- Deterministic stub answers ---
+# Shaped after the prompts in ai_engine; the same prompt always gets the same answer.
+_WORDS = ("energy", "matrix", "signal", "process", "model", "system", "value", "structure", "function",
+          "boundary", "pressure", "network", "sample", "theory", "method", "rate", "balance", "layer")
+
+def _rng(prompt: str) -> random.Random:
+    return random.Random(int(sha256(prompt.encode("utf-8")).hexdigest()[:16], 16))
+
+def _phrase(rng: random.Random, n: int = 4) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(n))
+
+def _flashcards(rng, topic: str, n: int) -> list:
+    return [{"question": f"In {topic}, what does the {_phrase(rng, 2)} describe?", "answer": f"The {_phrase(rng, 5)}."}
+            for _ in range(n)]
+
+def _quiz(rng, topic: str) -> dict:
+    options = [_phrase(rng, 3).capitalize() for _ in range(4)]
+    return {"question": f"Which statement about {topic} is correct?", "options": options, "correct_answer": rng.choice(options)}
+
+def _arena(rng, topic: str) -> dict:
+    return {"scenario": f"A team working on {topic} sees the {_phrase(rng, 3)} change unexpectedly. What do you do?",
+            "ideal_response": f"Check the {_phrase(rng, 2)}, then adjust the {_phrase(rng, 2)} and verify the result."}
+
+def _topic_content(rng, topic: str, num_cards: int) -> dict:
+    return {"flashcards": _flashcards(rng, topic, num_cards), "quiz": _quiz(rng, topic), "arena": _arena(rng, topic)}
+
+def _syllabus(rng, text: str) -> list:
+    lines = [l.strip() for l in text.splitlines() if len(l.strip().split()) >= 2]
+    topics, seen = [], set()
+    for line in lines:
+        name = " ".join(re.findall(r"[A-Za-z][A-Za-z-]+", line)[:4]).title()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            topics.append({"topic": name, "complexity": rng.randint(1, 5), "context": line[:160]})
+        if len(topics) >= 6:
+            break
+    return topics or [{"topic": "General Overview", "complexity": 2, "context": text[:160]}]
+
+def _int(pattern: str, prompt: str, default: int) -> int:
+    m = re.search(pattern, prompt)
+    return int(m.group(1)) if m else default
+
+def _topic_name(prompt: str) -> str:
+    m = re.search(r"Topic: (.*)", prompt)
+    return m.group(1).strip() if m else "the topic"
+
+def stub_response(prompt: str, generation_config: dict = None) -> str:
+    """A schema-valid answer for any ai_engine prompt: syllabus, topic (single, batched, re-ask), quiz, arena or grade."""
+    rng = _rng(prompt)
+    if "Cover EACH" in prompt:
+        topics = re.findall(r"- Topic: (.*)\n\s*Context: .*\n\s*Flashcards: (\d+)", prompt)
+        return json.dumps({name: _topic_content(rng, name, int(n)) for name, n in topics})
+    if "Generate ONLY the following" in prompt:
+        topic = _topic_name(prompt)
+        out = {}
+        if '"flashcards"' in prompt:
+            out["flashcards"] = _flashcards(rng, topic, _int(r"(\d+) Flashcards", prompt, 1))
+        if '"quiz"' in prompt:
+            out["quiz"] = _quiz(rng, topic)
+        if '"arena"' in prompt:
+            out["arena"] = _arena(rng, topic)
+        return json.dumps(out)
+    if "exam setter" in prompt:
+        n = _int(r"Create (\d+) multiple-choice", prompt, 5)
+        return json.dumps([_quiz(rng, f"question {i + 1}") for i in range(n)])
+    if "Grade this" in prompt:
+        score = rng.randint(40, 95)
+        return json.dumps({"score": score, "feedback": f"Scored {score}: solid reasoning, but mention the {_phrase(rng, 2)}."})
+    if "DISTINCT application scenarios" in prompt:
+        foci = re.findall(r"topic focus: (.*)", prompt)
+        return json.dumps([_arena(rng, topic) for topic in foci])
+    if "application scenario" in prompt:
+        m = re.search(r"Topic focus: (.*)", prompt)
+        return json.dumps(_arena(rng, m.group(1).strip() if m else "the topic"))
+    if "Topic:" in prompt:
+        return json.dumps(_topic_content(rng, _topic_name(prompt), _int(r"(\d+) Flashcards", prompt, 3)))
+    m = re.search(r"(?:Text Context.*?:|Excerpt:)\n(.*)", prompt, flags=re.S)
+    if m:
+        return json.dumps(_syllabus(rng, m.group(1)))
+    return json.dumps({"text": _phrase(rng, 8)})
+
+def estimate_usage(prompt: str, text: str) -> int:
+    return (len(prompt) + len(text)) // 4
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from dotenv import load_dotenv
+
+# --- Config ---
+load_dotenv()
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# On-disk tier (SQLite file). Set LLM_CACHE_PATH="" to keep the cache in memory only.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "100000"))
+
+def normalize_prompt(prompt: str) -> str:
+    # Collapse whitespace so indentation changes in prompt templates don't split the cache
+    return " ".join((prompt or "").split())
+
+def prompt_hash(prompt: str) -> str:
+    """Hash of the normalized prompt. Case is kept: prompts that differ only in case (code, exact answers) differ."""
+    return sha256(normalize_prompt(prompt).encode()).hexdigest()
+
+def make_key(model: str, prompt_hash: str, params: dict = None) -> str:
+    """Content address of one model call: model name + normalized prompt hash + sampling params."""
+    params_json = json.dumps(params or {}, sort_keys=True, default=str)
+    return sha256(f"{model}\x00{prompt_hash}\x00{params_json}".encode()).hexdigest()
+
+class LLMCache:
+    """
+    Two-tier response cache: an in-process LRU (bounded by entry count and bytes) in front
+    of a SQLite file shared by every worker on the host. Both tiers honour the same TTL.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES,
+                 ttl_s=LLM_CACHE_TTL_S, path=LLM_CACHE_PATH, disk_max_entries=LLM_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.path = path
+        self.disk_max_entries = disk_max_entries
+        self._mem = OrderedDict()  # key -> (stored_at, value)
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_writes = 0
+        self.counters = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "stores": 0,
+                         "evictions_memory": 0, "evictions_disk": 0, "expired": 0, "bypassed": 0}
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                    " stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+            except Exception as e:
+                print(f"⚠️ LLM disk cache unavailable ({path}): {e}")
+                self._db = None
+
+    # --- memory tier ---
+    def _mem_put(self, key, value, stored_at):
+        old = self._mem.pop(key, None)
+        if old:
+            self._mem_bytes -= len(old[1])
+        self._mem[key] = (stored_at, value)
+        self._mem_bytes += len(value)
+        while self._mem and (len(self._mem) > self.max_entries or self._mem_bytes > self.max_bytes):
+            _, (_, evicted) = self._mem.popitem(last=False)
+            self._mem_bytes -= len(evicted)
+            self.counters["evictions_memory"] += 1
+
+    def _mem_drop(self, key):
+        old = self._mem.pop(key, None)
+        if old:
+            self._mem_bytes -= len(old[1])
+
+    # --- public API ---
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry:
+                if now - entry[0] <= self.ttl_s:
+                    self._mem.move_to_end(key)
+                    self.counters["hits_memory"] += 1
+                    return entry[1]
+                self._mem_drop(key)
+                self.counters["expired"] += 1
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT value, stored_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                    if row and now - row[1] <= self.ttl_s:
+                        self._db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._mem_put(key, row[0], row[1])
+                        self.counters["hits_disk"] += 1
+                        return row[0]
+                    if row:
+                        self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                        self.counters["expired"] += 1
+                except Exception as e:
+                    print(f"⚠️ LLM disk cache read failed: {e}")
+            self.counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        if not value:
+            return
+        now = time.time()
+        with self._lock:
+            existing = self._mem.get(key)
+            if existing and existing[1] == value:
+                # Already cached (typically a response that was just served from the cache)
+                return
+            self._mem_put(key, value, now)
+            self.counters["stores"] += 1
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._disk_writes += 1
+                # Trim the file every 100 writes rather than on every insert
+                if self._disk_writes % 100 == 0:
+                    self._evict_disk(now)
+            except Exception as e:
+                print(f"⚠️ LLM disk cache write failed: {e}")
+
+    def _evict_disk(self, now):
+        cur = self._db.execute("DELETE FROM llm_cache WHERE stored_at < ?", (now - self.ttl_s,))
+        self.counters["expired"] += max(cur.rowcount, 0)
+        (count,) = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        overflow = count - self.disk_max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+            self.counters["evictions_disk"] += overflow
+
+    async def aget(self, key: str):
+        # Memory hits are answered inline; only the SQLite lookup is pushed to a thread
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and time.time() - entry[0] <= self.ttl_s:
+                self._mem.move_to_end(key)
+                self.counters["hits_memory"] += 1
+                return entry[1]
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: str):
+        await asyncio.to_thread(self.set, key, value)
+
+    def note_bypass(self):
+        with self._lock:
+            self.counters["bypassed"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self._mem_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits_memory"] + self.counters["hits_disk"] + self.counters["misses"]
+            hits = self.counters["hits_memory"] + self.counters["hits_disk"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._mem),
+                "memory_bytes": self._mem_bytes,
+                "disk_enabled": self._db is not None,
+            }
+
+# Process-wide cache used by ai_engine
+CACHE = LLMCache() if LLM_CACHE_ENABLED else None
@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from hashlib import sha256
+from dotenv import load_dotenv
+
+try:
+    from app import llm_backends, llm_cache
+except ImportError:
+    import llm_backends, llm_cache
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+load_dotenv()
+# "off", "record" (call the real backend and append every call to the cassette) or "replay" (serve calls from it)
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+# Replay: sleep for the recorded latency times this factor (0 = answer immediately)
+LLM_CASSETTE_SPEED = float(os.getenv("LLM_CASSETTE_SPEED", "1.0"))
+# Replay: "exact" only serves the call recorded for the same prompt; "shape" (default) falls back to
+# the next recorded call of the same kind (same prompt template and params) when the inputs differ,
+# e.g. because topics finished in another order and the quiz context came out shuffled
+LLM_CASSETTE_MATCH = os.getenv("LLM_CASSETTE_MATCH", "shape").lower()
+
+# Session seeds (UUIDs), timestamps (e.g. in default study set titles) and the randomly drawn arena
+# variant change on every run; they are blanked out of the key so a replayed run finds the recorded call.
+_VOLATILE = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+    r"|\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?"
+    r"|\bVariant:? [A-F]\b"
+)
+
+def call_key(prompt: str, generation_config: dict = None) -> str:
+    """Prompt hash + params hash of one call; stable across runs of the same traffic."""
+    shape = _VOLATILE.sub("#", llm_cache.normalize_prompt(prompt))
+    params = json.dumps(generation_config or {}, sort_keys=True, default=str)
+    return sha256(f"{shape}\x00{params}".encode()).hexdigest()[:32]
+
+def shape_key(prompt: str, generation_config: dict = None) -> str:
+    """Which kind of call this is: the prompt template's first line + params."""
+    head = next((line.strip() for line in (prompt or "").splitlines() if line.strip()), "")
+    params = json.dumps(generation_config or {}, sort_keys=True, default=str)
+    return sha256(f"{head}\x00{params}".encode()).hexdigest()[:16]
+
+class CassetteMiss(RuntimeError):
+    """Replay mode met a call that was never recorded."""
+
+class ReplayedError(RuntimeError):
+    """A recorded failure, raised again with its original message so the retry policy treats it the same."""
+
+class Cassette:
+    """
+    Append-only JSON-lines file, one model call per line:
+    {"k": call key, "s": shape key, "p": params, "t": response text, "u": tokens, "ms": latency, "e": error}
+    ("t"/"u" or "e"). Calls recorded more than once under one key are replayed in recording order, then round-robin.
+    """
+
+    def __init__(self, path: str = LLM_CASSETTE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._lines = queue.SimpleQueue()  # recorded lines waiting for the writer thread
+        self._writer = None
+        self._entries = defaultdict(list)  # call key or ("shape", shape key) -> entries
+        self._next = defaultdict(int)
+        self.counters = {"recorded": 0, "replayed": 0, "shape_matches": 0, "misses": 0, "errors_replayed": 0,
+                         "model_s_total": 0.0}
+
+    # --- recording ---
+    def append(self, key: str, shape: str, generation_config: dict, latency_s: float, text: str = None, tokens: int = 0,
+               error: str = None):
+        entry = {"k": key, "s": shape, "ms": round(latency_s * 1000, 1)}
+        # The response schema is part of the key already; only the sampling params are kept readable
+        params = {k: v for k, v in (generation_config or {}).items() if k != "response_schema"}
+        if params:
+            entry["p"] = params
+        if error is None:
+            entry["t"], entry["u"] = text, tokens
+        else:
+            entry["e"] = error
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_lines, name="llm-cassette-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+            self.counters["recorded"] += 1
+            self.counters["model_s_total"] += latency_s
+            # Never blocks (the async backend calls this on the event loop): the file I/O is the writer thread's
+            self._lines.put(line)
+
+    def _write_lines(self):
+        """Writer thread: appends queued lines, one flush per burst, until close() queues None."""
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                line = self._lines.get()
+                while line is not None:
+                    f.write(line)
+                    try:
+                        line = self._lines.get_nowait()
+                    except queue.Empty:
+                        break
+                f.flush()
+                if line is None:
+                    return
+
+    def close(self):
+        """Writes out every queued line and stops the writer thread (also run at exit)."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._lines.put(None)
+        if writer is not None:
+            writer.join()
+
+    # --- replay ---
+    def load(self):
+        count = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["k"]].append(entry)
+                    self._entries[("shape", entry.get("s"))].append(entry)
+                    count += 1
+        distinct = sum(1 for k in self._entries if not isinstance(k, tuple))
+        logger.info(f"📼 Loaded {count} recorded model calls ({distinct} distinct) from {self.path}.")
+        return self
+
+    def next(self, key: str, shape: str = None) -> dict:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries and shape is not None:
+                key = ("shape", shape)
+                entries = self._entries.get(key)
+                self.counters["shape_matches"] += bool(entries)
+            if not entries:
+                self.counters["misses"] += 1
+                raise CassetteMiss(f"cassette miss for call {key}")
+            entry = entries[self._next[key] % len(entries)]
+            self._next[key] += 1
+            self.counters["replayed"] += 1
+            self.counters["errors_replayed"] += "e" in entry
+            self.counters["model_s_total"] += entry.get("ms", 0) / 1000.0
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"mode": LLM_CASSETTE_MODE, "path": self.path, **self.counters,
+                    "model_s_total": round(self.counters["model_s_total"], 3)}
+
+class RecordingBackend(llm_backends.LLMBackend):
+    """Passes every call to `inner` and appends what came back (or the error) to the cassette."""
+    name = "record"
+
+    def __init__(self, inner, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    def _record(self, prompt, generation_config, started, response=None, error=None):
+        latency = time.monotonic() - started
+        keys = (call_key(prompt, generation_config), shape_key(prompt, generation_config))
+        if error is not None:
+            self.cassette.append(*keys, generation_config, latency, error=str(error))
+            return
+        usage = getattr(response, "usage_metadata", None)
+        tokens = int(getattr(usage, "total_token_count", 0) or 0) if usage is not None else 0
+        self.cassette.append(*keys, generation_config, latency, text=getattr(response, "text", "") or "", tokens=tokens)
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        started = time.monotonic()
+        try:
+            response = self.inner.generate_content(prompt, generation_config=generation_config, request_options=request_options)
+        except Exception as e:
+            self._record(prompt, generation_config, started, error=e)
+            raise
+        self._record(prompt, generation_config, started, response=response)
+        return response
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        started = time.monotonic()
+        try:
+            response = await self.inner.generate_content_async(prompt, generation_config=generation_config,
+                                                               request_options=request_options)
+        except Exception as e:
+            self._record(prompt, generation_config, started, error=e)
+            raise
+        self._record(prompt, generation_config, started, response=response)
+        return response
+
+class ReplayBackend(llm_backends.LLMBackend):
+    """Serves recorded responses (and recorded errors, e.g. 429s) without any network access."""
+    name = "replay"
+
+    def __init__(self, cassette: Cassette, speed: float = LLM_CASSETTE_SPEED, match: str = LLM_CASSETTE_MATCH):
+        self.cassette = cassette
+        self.speed = speed
+        self.match = match
+
+    def _entry(self, prompt, generation_config):
+        shape = shape_key(prompt, generation_config) if self.match == "shape" else None
+        entry = self.cassette.next(call_key(prompt, generation_config), shape)
+        return entry, entry.get("ms", 0) / 1000.0 * self.speed
+
+    @staticmethod
+    def _result(entry):
+        if "e" in entry:
+            raise ReplayedError(entry["e"])
+        return llm_backends.Response(entry.get("t", ""), entry.get("u", 0))
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        entry, delay = self._entry(prompt, generation_config)
+        if delay > 0:
+            time.sleep(delay)
+        return self._result(entry)
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        entry, delay = self._entry(prompt, generation_config)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._result(entry)
+
+# Process-wide cassette (None when LLM_CASSETTE_MODE=off)
+CASSETTE = None
+
+def wrap(make_backend):
+    """
+    The backend ai_engine should call. `make_backend()` builds the real one; replay mode never calls it,
+    so replays work without credentials or network.
+    """
+    global CASSETTE
+    if LLM_CASSETTE_MODE == "replay":
+        CASSETTE = Cassette().load()
+        return ReplayBackend(CASSETTE)
+    if LLM_CASSETTE_MODE == "record":
+        CASSETTE = Cassette()
+        logger.info(f"📼 Recording model calls to {CASSETTE.path}.")
+        return RecordingBackend(make_backend(), CASSETTE)
+    return make_backend()
+
+def stats() -> dict:
+    return CASSETTE.stats() if CASSETTE else {"mode": LLM_CASSETTE_MODE}
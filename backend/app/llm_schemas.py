@@ -0,0 +1,121 @@
+from typing import List, Optional, Any
+
+from pydantic import BaseModel, TypeAdapter, ValidationError, Field, field_validator
+
+# --- Payloads the model is asked to produce ---
+class SyllabusTopic(BaseModel):
+    topic: str = Field(min_length=1)
+    complexity: int = 2
+    context: str = ""
+
+    @field_validator("complexity", mode="before")
+    @classmethod
+    def _clamp_complexity(cls, v):
+        try:
+            return min(5, max(1, int(v)))
+        except (TypeError, ValueError):
+            return 2
+
+class FlashcardItem(BaseModel):
+    question: str = Field(min_length=1)
+    answer: str = Field(min_length=1)
+    tag: Optional[str] = None
+
+class QuizItem(BaseModel):
+    question: str = Field(min_length=1)
+    options: List[str] = Field(min_length=2)
+    correct_answer: str = Field(min_length=1)
+    tag: Optional[str] = None
+
+    @field_validator("options", mode="before")
+    @classmethod
+    def _options_list(cls, v):
+        # Models sometimes answer {"A": "...", "B": "..."}
+        return list(v.values()) if isinstance(v, dict) else v
+
+class ArenaItem(BaseModel):
+    scenario: str = Field(min_length=1)
+    ideal_response: str = ""
+    related_topic_tag: Optional[str] = None
+
+class GradeResult(BaseModel):
+    score: int = Field(ge=0, le=100)
+    feedback: str = ""
+
+# Compiled once at import; validation on the hot path is a single Rust call per item
+SYLLABUS_TOPIC = TypeAdapter(SyllabusTopic)
+FLASHCARD = TypeAdapter(FlashcardItem)
+QUIZ = TypeAdapter(QuizItem)
+ARENA = TypeAdapter(ArenaItem)
+GRADE = TypeAdapter(GradeResult)
+
+# --- Response schemas sent with JSON mode (OpenAPI subset understood by the Gemini API) ---
+_STR = {"type": "STRING"}
+_FLASHCARD_SCHEMA = {"type": "OBJECT", "properties": {"question": _STR, "answer": _STR}, "required": ["question", "answer"]}
+_QUIZ_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"question": _STR, "options": {"type": "ARRAY", "items": _STR}, "correct_answer": _STR},
+    "required": ["question", "options", "correct_answer"],
+}
+_ARENA_SCHEMA = {"type": "OBJECT", "properties": {"scenario": _STR, "ideal_response": _STR}, "required": ["scenario", "ideal_response"]}
+
+SYLLABUS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"topic": _STR, "complexity": {"type": "INTEGER"}, "context": _STR},
+        "required": ["topic", "complexity", "context"],
+    },
+}
+_TOPIC_PARTS = {"flashcards": {"type": "ARRAY", "items": _FLASHCARD_SCHEMA}, "quiz": _QUIZ_SCHEMA, "arena": _ARENA_SCHEMA}
+
+def topic_content_schema(keys=("flashcards", "quiz", "arena")) -> dict:
+    """Schema for a topic payload; a re-ask declares only the parts it asks for."""
+    return {"type": "OBJECT", "properties": {k: _TOPIC_PARTS[k] for k in keys}, "required": list(keys)}
+
+def topic_batch_schema(names: list) -> dict:
+    """One topic payload per topic name."""
+    return {"type": "OBJECT", "properties": {name: TOPIC_CONTENT_SCHEMA for name in names}, "required": list(names)}
+
+TOPIC_CONTENT_SCHEMA = topic_content_schema()
+QUIZ_LIST_SCHEMA = {"type": "ARRAY", "items": _QUIZ_SCHEMA}
+ARENA_SCHEMA = _ARENA_SCHEMA
+ARENA_LIST_SCHEMA = {"type": "ARRAY", "items": _ARENA_SCHEMA}
+GRADE_SCHEMA = {"type": "OBJECT", "properties": {"score": {"type": "INTEGER"}, "feedback": _STR}, "required": ["score", "feedback"]}
+
+# --- Validation helpers ---
+def validate(adapter: TypeAdapter, item: Any):
+    """Returns the validated item as a plain dict, or None if it doesn't fit the schema."""
+    try:
+        return adapter.validate_python(item).model_dump(exclude_none=True)
+    except ValidationError:
+        return None
+
+def validate_list(adapter: TypeAdapter, items: Any):
+    """Validates each element on its own. Returns (valid dicts, number of invalid elements)."""
+    if not isinstance(items, list):
+        return [], 1
+    valid = [v for v in (validate(adapter, item) for item in items) if v is not None]
+    return valid, len(items) - len(valid)
+
+def check_topic_content(data: Any, num_cards: int) -> tuple:
+    """
+    Splits a topic payload into its valid parts and what still has to be asked for:
+    {"flashcards": <cards to replace>, "quiz": bool, "arena": bool}. Invalid cards are replaced
+    one for one; a payload without a single valid card asks for all `num_cards` again.
+    """
+    data = data if isinstance(data, dict) else {}
+    flashcards, bad_cards = validate_list(FLASHCARD, data.get("flashcards") or [])
+    quiz = validate(QUIZ, data["quiz"]) if data.get("quiz") else None
+    arena = validate(ARENA, data["arena"]) if data.get("arena") else None
+    missing = {"flashcards": bad_cards if flashcards else num_cards, "quiz": quiz is None, "arena": arena is None}
+    return {"flashcards": flashcards, "quiz": quiz, "arena": arena}, missing
+
+def merge_topic_content(content: dict, missing: dict, extra: dict) -> tuple:
+    """Fills the gaps of `content` with the valid parts of a re-ask answer. Returns (content, what is still missing)."""
+    cards = extra["flashcards"][:missing["flashcards"]]
+    content["flashcards"].extend(cards)
+    content["quiz"] = content["quiz"] or extra["quiz"]
+    content["arena"] = content["arena"] or extra["arena"]
+    still = {"flashcards": missing["flashcards"] - len(cards), "quiz": content["quiz"] is None, "arena": content["arena"] is None}
+    return content, still
@@ -1,39 +1,56 @@
 import os
+import json
+import asyncio
 import base64
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from uuid import uuid4
 from importlib import import_module
 
-from fastapi import FastAPI, Depends, HTTPException, Request, status, File, UploadFile, Form
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import select, update, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # ---------------------------------------------------------
 # Import internal modules
 # ---------------------------------------------------------
 try:
-    from app import database, models, security, ai_engine
-    from app.database import get_db, engine, Base
-    # IMPORT NEW AI FUNCTIONS
-    from app.ai_engine import generate_quiz_from_context, grade_arena_submission
+    from app import database, models, security, ai_engine, pipeline, jobs, warm_pool, due_queue, srs, pagination
+    from app.database import get_db, get_async_db, engine, Base
 except ImportError:
-    import database, models, security, ai_engine
-    from database import get_db, engine, Base
-    from ai_engine import generate_quiz_from_context, grade_arena_submission
+    import database, models, security, ai_engine, pipeline, jobs, warm_pool, due_queue, srs, pagination
+    from database import get_db, get_async_db, engine, Base
 
 app = FastAPI(title="Notewise AI Backend")
 
+SSE_POLL_INTERVAL_S = float(os.getenv("SSE_POLL_INTERVAL_S", "1.0"))
+REVIEW_BATCH_MAX = int(os.getenv("REVIEW_BATCH_MAX", "1000"))
+FORECAST_MAX_DAYS = int(os.getenv("FORECAST_MAX_DAYS", "365"))
+FORECAST_MAX_RUNS = int(os.getenv("FORECAST_MAX_RUNS", "20"))
+
+@app.on_event("startup")
+async def start_job_processing():
+    try:
+        if not jobs.QUEUE_MODE:
+            jobs.recover_inline_jobs()
+            jobs.start_inline_retries()
+        for i in range(jobs.EMBEDDED_WORKERS if jobs.QUEUE_MODE else 0):
+            jobs.start_worker_in_background(f"{jobs.default_worker_id()}:api{i}")
+    except Exception as e:
+        print(f"⚠️ Could not start job processing: {e}")
+
 # ---------------------------------------------------------
 # Auth Bypass / Dev User Logic
 # ---------------------------------------------------------
 def _find_get_current_user_functions():
     candidates = [
-        ("app.security", ["get_current_user", "get_current_active_user"]),
-        ("security", ["get_current_user", "get_current_active_user"]),
+        ("app.security", ["get_current_user", "get_current_active_user", "get_current_user_async"]),
+        ("security", ["get_current_user", "get_current_active_user", "get_current_user_async"]),
         ("app.auth", ["get_current_user"]),
         ("auth", ["get_current_user"])
     ]
@@ -83,6 +100,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
 
 @app.middleware("http")
@@ -119,6 +137,18 @@ class ReviewPayload(BaseModel):
     card_id: int
     difficulty: str  # "again", "hard", "good", "easy"
 
+class ReviewEvent(BaseModel):
+    card_id: int
+    difficulty: str  # "again", "hard", "good", "easy"
+    reviewed_at: Optional[datetime] = None  # when the card was rated (clients studying offline); default: now
+
+class BatchReviewPayload(BaseModel):
+    reviews: List[ReviewEvent]
+
+class SrsSettingsPayload(BaseModel):
+    scheduler: Optional[str] = None  # "sm2" or "fsrs"
+    desired_retention: Optional[float] = None  # FSRS: target recall probability at the next review
+
 class ArenaSubmitPayload(BaseModel):
     set_id: int
     challenge_id: int
@@ -138,6 +168,27 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(securit
 def root():
     return {"status": "ok", "service": "Notewise AI Backend"}
 
+@app.get("/api/metrics")
+def get_metrics():
+    cache = ai_engine.llm_cache.CACHE
+    return {
+        "llm_cache": cache.stats() if cache else {"enabled": False},
+        "llm_scheduler": ai_engine.rate_limiter.SCHEDULER.stats() if ai_engine.rate_limiter.SCHEDULER else {"enabled": False},
+        "llm_cassette": ai_engine.llm_cassette.stats(),
+        "db_pool": database.pool_stats(),
+        **_db_stats(),
+    }
+
+def _db_stats():
+    db = database.SessionLocal()
+    try:
+        return {
+            "jobs": {"mode": jobs.JOB_EXECUTION, "by_kind": jobs.queue_stats(db)},
+            "warm_pool": warm_pool.stats(db),
+        }
+    finally:
+        db.close()
+
 # --- AUTH ROUTES ---
 @app.post("/api/register", status_code=201)
 def register(user: UserRegister, db: Session = Depends(get_db)):
@@ -165,20 +216,41 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 # --- Study Sets ---
 
+# Fields a listing may return (?fields=...), and the keyset it is paginated on (always queried)
+STUDY_SET_FIELDS = {
+    "id": models.StudySet.id,
+    "title": models.StudySet.title,
+    "description": models.StudySet.description,
+    "card_count": models.StudySet.card_count,
+    "mastery_score": models.StudySet.mastery_score,
+    "srs_success_rate": models.StudySet.srs_success_rate,
+    "created_at": models.StudySet.created_at,
+}
+STUDY_SET_KEY = {"user_id": models.StudySet.user_id, "created_at": models.StudySet.created_at, "id": models.StudySet.id}
+
+def study_sets_query(user_id: int, fields: str = None, cursor: str = None, limit: int = None) -> tuple:
+    """(field names, query) for a page of a user's study sets. Also EXPLAINed by check_query_plans.py."""
+    names, columns = pagination.select_fields(fields, STUDY_SET_FIELDS, STUDY_SET_KEY)
+    query = select(*columns).where(models.StudySet.user_id == user_id)
+    return names, pagination.page(query, STUDY_SET_KEY, (int, datetime, int), cursor, limit)
+
 @app.get("/api/study-sets")
-def get_study_sets(db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
-    sets = db.query(models.StudySet).filter(models.StudySet.user_id == current_user.id).all()
-    out = []
-    for s in sets:
-        out.append({
-            "id": s.id,
-            "title": s.title,
-            "description": s.description,
-            "card_count": s.card_count,
-            "mastery_score": s.mastery_score,
-            "srs_success_rate": s.srs_success_rate,
-            "created_at": s.created_at.isoformat() if s.created_at else None
-        })
+def get_study_sets(
+    response: Response,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    The user's study sets, oldest first. With `limit`, one keyset page on (user_id, created_at, id); the next
+    page's cursor is in the X-Next-Cursor header. `fields` picks the columns returned (comma-separated).
+    """
+    names, query = study_sets_query(current_user.id, fields, cursor, limit)
+    out, next_cursor = pagination.finish(db.execute(query).all(), names, STUDY_SET_KEY, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
     return out
 
 @app.delete("/api/study-sets/{set_id}", status_code=204)
@@ -193,19 +265,10 @@ def delete_study_set(set_id: int, db: Session = Depends(get_db), current_user: m
     return None
 
 @app.get("/api/reviews/today")
-def get_reviews_today(db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
-    now = datetime.utcnow()
-    
-    results = db.query(
-        models.StudySet.id,
-        models.StudySet.title,
-        func.count(models.Flashcard.id).label("due_count")
-    ).join(models.Flashcard)\
-    .filter(models.StudySet.user_id == current_user.id)\
-    .filter(
-        (models.Flashcard.next_review_date <= now) | 
-        (models.Flashcard.next_review_date == None)
-    ).group_by(models.StudySet.id).all()
+async def get_reviews_today(db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(security.get_current_user_async)):
+    # O(sets): sums the user's due_card_counters buckets instead of scanning their flashcards
+    stmt = due_queue.due_counts_stmt(current_user.id, datetime.utcnow())
+    results = (await db.execute(stmt)).all()
     
     out = []
     for r in results:
@@ -217,155 +280,285 @@ def get_reviews_today(db: Session = Depends(get_db), current_user: models.User =
         
     return out
 
+@app.get("/api/reviews/forecast")
+def get_reviews_forecast(
+    days: int = 90,
+    set_id: Optional[int] = None,
+    again: float = srs.DEFAULT_ANSWER_PROBS[0],
+    hard: float = srs.DEFAULT_ANSWER_PROBS[1],
+    good: float = srs.DEFAULT_ANSWER_PROBS[2],
+    easy: float = srs.DEFAULT_ANSWER_PROBS[3],
+    runs: int = 1,
+    seed: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Expected reviews per day for the next `days` days (the user's cards, or one set's), simulated with
+    the user's scheduler (SM-2 or FSRS) under the given answer mix (relative weights of again/hard/good/easy).
+    """
+    if not 1 <= days <= FORECAST_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {FORECAST_MAX_DAYS}")
+    weights = (again, hard, good, easy)
+    if min(weights) < 0 or sum(weights) <= 0:
+        raise HTTPException(status_code=400, detail="Answer weights must be non-negative and not all zero")
+    settings = _srs_settings(db, current_user.id)
+    now = datetime.utcnow()
+    query = select(*srs.card_columns(db.get_bind().dialect.name, now, settings["scheduler"]))\
+        .select_from(models.Flashcard)\
+        .join(models.StudySet, models.StudySet.id == models.Flashcard.set_id)\
+        .where(models.StudySet.user_id == current_user.id)
+    if set_id is not None:
+        query = query.where(models.Flashcard.set_id == set_id)
+
+    cards = srs.card_arrays(db.connection().execute(query), settings["scheduler"])
+    per_day = srs.forecast(cards, days, weights, runs=min(max(1, runs), FORECAST_MAX_RUNS), seed=seed, settings=settings)
+    today = now.date()
+    return {
+        "scheduler": settings["scheduler"],
+        "cards": int(cards["due_day"].size),
+        "total_reviews": round(float(per_day.sum()), 2),
+        "days": [{"date": (today + timedelta(days=i)).isoformat(), "reviews": round(float(n), 2)} for i, n in enumerate(per_day)]
+    }
+
 # --- Generation ---
 
-@app.post("/api/generate")
+@app.post("/api/generate", status_code=202)
 async def generate(
     title: str = Form(default=None),
     file: UploadFile = File(...),
+    wait: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(security.get_current_user)
 ):
+    """
+    Queues a generation job and returns immediately with its id. Progress is available from
+    /api/jobs/{job_id} and /api/jobs/{job_id}/events; topics appear in the set as they finish
+    (with GENERATE_PERSIST_MODE=bulk, only once the whole job succeeds).
+    Pass ?wait=true to block until the job is done (old behaviour).
+    """
     try:
         pdf_bytes = await file.read()
         final_title = title or f"Study Set {datetime.utcnow().isoformat()}"
-        
-        extracted_text = ai_engine.extract_text_from_pdf(pdf_bytes)
-        syllabus = ai_engine.generate_syllabus(extracted_text)
-        if not syllabus:
-            raise HTTPException(status_code=503, detail="AI failed to generate syllabus")
-
-        study_set = models.StudySet(
-            title=final_title, 
-            description="Generated from PDF", 
-            user_id=current_user.id, 
-            created_at=datetime.utcnow()
-        )
-        db.add(study_set)
-        db.commit()
-        db.refresh(study_set)
-
-        total_cards = 0
-
-        for topic in syllabus:
-            topic_content = ai_engine.generate_content_for_topic(topic)
-            if not topic_content: continue
-
-            for fc in topic_content.get("flashcards", []):
-                frow = models.Flashcard(
-                    set_id=study_set.id,
-                    question=fc.get("question"),
-                    answer=fc.get("answer"),
-                    tag=fc.get("tag")
-                )
-                db.add(frow)
-                total_cards += 1
-
-            quiz = topic_content.get("quiz")
-            if quiz:
-                qrow = models.QuizQuestion(
-                    set_id=study_set.id,
-                    question=quiz.get("question"),
-                    options=quiz.get("options") or [],
-                    correct_answer=quiz.get("correct_answer"),
-                    tag=quiz.get("tag")
-                )
-                db.add(qrow)
-
-            arena = topic_content.get("arena")
-            if arena:
-                arow = models.ArenaChallenge(
-                    set_id=study_set.id,
-                    scenario=arena.get("scenario"),
-                    ideal_response=arena.get("ideal_response"),
-                    related_topic_tag=arena.get("related_topic_tag")
-                )
-                db.add(arow)
-            db.commit()
-
-        study_set.card_count = total_cards
-        db.commit()
-
-        return {"set_id": study_set.id, "title": study_set.title, "cards_created": total_cards}
+        job = pipeline.create_generate_job(db, current_user.id, final_title, pdf_bytes)
+        # Queue mode: a worker process picks the job up; inline mode: this process runs it
+        if not jobs.QUEUE_MODE and jobs.claim(db, job.id):
+            if wait:
+                await jobs.run_job(job.id)
+            else:
+                jobs.start_in_background(job.id)
+        if wait:
+            # A failed attempt goes back to the queue with a backoff: wait for the retries too
+            await jobs.wait_for(job.id)
+        db.refresh(job)
+        if wait and job.status in ("failed", "dead"):
+            raise HTTPException(status_code=503, detail=job.error or "Generation failed")
+        return {
+            "job_id": job.id,
+            "set_id": job.set_id,
+            "title": final_title,
+            "status": job.status,
+            "cards_created": (job.result or {}).get("cards_created", 0),
+            "reused": (job.result or {}).get("reused", False),
+        }
 
     except HTTPException: raise
     except Exception as e:
         print(f"🔥 CRITICAL ERROR in /api/generate: {e}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
+async def _run_ai_job(db: Session, kind: str, work, user_id: int, set_id: int = None, payload: dict = None) -> dict:
+    """
+    Interactive AI work. Inline mode runs `work()` right here; queue mode enqueues it at interactive
+    priority (ahead of bulk PDF jobs) and waits for a worker to finish it.
+    """
+    if not jobs.QUEUE_MODE:
+        try:
+            return await work()
+        except jobs.PermanentJobError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"AI generation failed: {e}")
+
+    job = jobs.enqueue(db, kind, user_id=user_id, set_id=set_id, payload=payload, priority=jobs.PRIORITY_INTERACTIVE)
+    view = await jobs.wait_for(job.id)
+    if view and view["status"] == "succeeded":
+        return view["result"]
+    if view and view["status"] == "failed":
+        raise HTTPException(status_code=400, detail=view["error"])
+    if view and view["status"] not in jobs.TERMINAL_STATUSES:
+        raise HTTPException(status_code=503, detail=f"Still processing, check /api/jobs/{job.id}")
+    raise HTTPException(status_code=503, detail=(view or {}).get("error") or "AI generation failed")
+
+def _get_user_job(db: Session, job_id: int, user_id: int):
+    job = db.query(models.Job).filter(models.Job.id == job_id, models.Job.user_id == user_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    return jobs.job_view(_get_user_job(db, job_id, current_user.id))
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: int, request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    """
+    Server-sent events: one `progress` event per job progress entry, then a final `end` event.
+    Reconnecting clients resume after the Last-Event-ID they already saw.
+    """
+    _get_user_job(db, job_id, current_user.id)
+    try:
+        last_seq = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        last_seq = 0
+
+    async def _events():
+        nonlocal last_seq
+        while True:
+            poll_db = database.SessionLocal()
+            try:
+                job = poll_db.get(models.Job, job_id)
+                view = jobs.job_view(job) if job else None
+            finally:
+                poll_db.close()
+            if view is None:
+                break
+            for event in view["progress"]:
+                if event["seq"] > last_seq:
+                    last_seq = event["seq"]
+                    yield f"id: {event['seq']}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+            if view["status"] in jobs.TERMINAL_STATUSES:
+                yield f"event: end\ndata: {json.dumps({'status': view['status'], 'result': view['result'], 'error': view['error']})}\n\n"
+                break
+            if await request.is_disconnected():
+                break
+            await asyncio.sleep(SSE_POLL_INTERVAL_S)
+
+    return StreamingResponse(_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # --- Flashcards ---
 
+FLASHCARD_FIELDS = {
+    "id": models.Flashcard.id,
+    "question": models.Flashcard.question,
+    "answer": models.Flashcard.answer,
+    "tag": models.Flashcard.tag,
+    "repetition_number": models.Flashcard.repetition_number,
+    "interval": models.Flashcard.interval,
+    "ease_factor": models.Flashcard.ease_factor,
+    "next_review_date": models.Flashcard.next_review_date,
+}
+FLASHCARD_KEY = {"set_id": models.Flashcard.set_id, "id": models.Flashcard.id}
+
+def flashcards_query(set_id: int, mode: str = "all", fields: str = None, cursor: str = None, limit: int = None,
+                     now: datetime = None) -> tuple:
+    """(field names, query) for a page of a set's cards (`mode` "due": only those due at `now`). Also EXPLAINed by check_query_plans.py."""
+    # Plain column rows: no ORM objects to build for a large set
+    names, columns = pagination.select_fields(fields, FLASHCARD_FIELDS, FLASHCARD_KEY)
+    query = select(*columns).where(models.Flashcard.set_id == set_id)
+    
+    if mode == "due":
+        now = now or datetime.utcnow()
+        query = query.where(
+            (models.Flashcard.next_review_date <= now) | 
+            (models.Flashcard.next_review_date == None)
+        )
+        
+    return names, pagination.page(query, FLASHCARD_KEY, (int, int), cursor, limit)
+
 @app.get("/api/study-set/{set_id}/flashcards")
 def get_flashcards(
     set_id: int, 
+    response: Response,
     mode: str = "all", 
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(security.get_current_user)
 ):
-    study_set = db.query(models.StudySet).filter(models.StudySet.id == set_id, models.StudySet.user_id == current_user.id).first()
-    if not study_set:
+    """
+    Cards of a set in id order. With `limit`, one keyset page on (set_id, id); the next page's cursor is
+    in the X-Next-Cursor header. `fields` picks the columns returned (comma-separated).
+    """
+    owned = db.execute(
+        select(models.StudySet.id).where(models.StudySet.id == set_id, models.StudySet.user_id == current_user.id)
+    ).first()
+    if not owned:
         raise HTTPException(status_code=404, detail="Study set not found")
     
-    query = db.query(models.Flashcard).filter(models.Flashcard.set_id == set_id)
-    
-    if mode == "due":
-        now = datetime.utcnow()
-        query = query.filter(
-            (models.Flashcard.next_review_date <= now) | 
-            (models.Flashcard.next_review_date == None)
-        )
-        
-    frows = query.all()
-    
-    return [{
-        "id": f.id, 
-        "question": f.question, 
-        "answer": f.answer, 
-        "tag": f.tag,
-        "repetition_number": f.repetition_number, 
-        "interval": f.interval, 
-        "ease_factor": f.ease_factor,
-        "next_review_date": f.next_review_date.isoformat() if f.next_review_date else None
-    } for f in frows]
+    names, query = flashcards_query(set_id, mode, fields, cursor, limit)
+    out, next_cursor = pagination.finish(db.execute(query).all(), names, FLASHCARD_KEY, limit)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return out
 
 # --- SRS Review Endpoint ---
+def _srs_settings(db: Session, user_id: int) -> dict:
+    return srs.scheduler_settings(db.get(models.SrsSettings, user_id))
+
+@app.get("/api/srs/settings")
+def get_srs_settings(db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    row = db.get(models.SrsSettings, current_user.id)
+    settings = srs.scheduler_settings(row)
+    return {
+        "scheduler": settings["scheduler"],
+        "desired_retention": settings["retention"],
+        "personalized": bool(row and row.fsrs_params),
+        "optimized_at": row.optimized_at.isoformat() if row and row.optimized_at else None,
+        "optimized_reviews": (row.optimized_reviews or 0) if row else 0,
+    }
+
+@app.put("/api/srs/settings")
+def update_srs_settings(payload: SrsSettingsPayload, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    """Switches the user's scheduler. Cards keep their due dates; the new scheduler takes over at their next review."""
+    if payload.scheduler is not None and payload.scheduler not in srs.SCHEDULERS:
+        raise HTTPException(status_code=400, detail=f"scheduler must be one of {', '.join(srs.SCHEDULERS)}")
+    if payload.desired_retention is not None and not 0.7 <= payload.desired_retention <= 0.97:
+        raise HTTPException(status_code=400, detail="desired_retention must be between 0.7 and 0.97")
+    row = db.get(models.SrsSettings, current_user.id)
+    if row is None:
+        row = models.SrsSettings(user_id=current_user.id, scheduler=srs.SRS_DEFAULT_SCHEDULER,
+                                 desired_retention=srs.SRS_DEFAULT_RETENTION)
+        db.add(row)
+    if payload.scheduler is not None:
+        row.scheduler = payload.scheduler
+    if payload.desired_retention is not None:
+        row.desired_retention = payload.desired_retention
+    row.updated_at = datetime.utcnow()
+    db.commit()
+    return get_srs_settings(db, current_user)
+
 @app.post("/api/flashcards/review")
 def review_flashcard(payload: ReviewPayload, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
     """
-    Updates the flashcard's SRS data (SM-2 Algorithm) based on user difficulty rating.
+    Updates the flashcard's SRS data based on user difficulty rating, with the user's scheduler
+    (SM-2 or FSRS, see /api/srs/settings), and appends the rating to the review log.
     """
     card = db.query(models.Flashcard).filter(models.Flashcard.id == payload.card_id).first()
     if not card:
         raise HTTPException(status_code=404, detail="Card not found")
+    owner_id = card.study_set.user_id
+    previous_review_date = card.next_review_date
+    # Never before the card's last review (another server's clock may be a little ahead)
+    now = max(datetime.utcnow(), card.last_review_date or datetime.min)
     
-    # 1. Map difficulty string to Quality score (0-5)
-    # again=0, hard=3, good=4, easy=5
-    quality_map = {"again": 0, "hard": 3, "good": 4, "easy": 5}
-    quality = quality_map.get(payload.difficulty, 4)
-
-    # 2. Apply SM-2 Algorithm Logic
-    if quality < 3: # "Again" - Reset progress
-        card.repetition_number = 0
-        card.interval = 1
-    else:
-        if card.repetition_number == 0:
-            card.interval = 1
-        elif card.repetition_number == 1:
-            card.interval = 6
-        else:
-            card.interval = int(card.interval * card.ease_factor)
-        
-        card.repetition_number += 1
-        
-        # Adjust Ease Factor
-        # EF' = EF + (0.1 - (5-q) * (0.08 + (5-q)*0.02))
-        card.ease_factor = card.ease_factor + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
-        if card.ease_factor < 1.3:
-            card.ease_factor = 1.3
-
-    # 3. Set Next Review Date
-    card.next_review_date = datetime.utcnow() + timedelta(days=card.interval)
+    # 1. Apply the scheduler (srs.py) to the card's SRS fields
+    settings = _srs_settings(db, owner_id)
+    state = {f: getattr(card, f) for f in srs.CARD_FIELDS}
+    elapsed = srs.elapsed_days(state, now)
+    state = srs.review(state, payload.difficulty, now, settings)
+    if srs.SRS_LOAD_BALANCE:
+        srs.rebalance(state, due_queue.daily_load(db, owner_id, *srs.balance_range([state])))
+
+    # 2. Set Next Review Date
+    for f in srs.CARD_FIELDS:
+        setattr(card, f, state[f])
+    db.add(models.ReviewLog(user_id=owner_id, card_id=card.id, reviewed_at=now, rating=srs.rating(payload.difficulty),
+                            elapsed_days=elapsed, scheduler=settings["scheduler"]))
     
+    # 3. Move the card to its new due bucket in the same transaction
+    due_queue.card_moved(db, owner_id, card.set_id, previous_review_date, card.next_review_date)
     db.commit()
     
     return {
@@ -373,6 +566,71 @@ def review_flashcard(payload: ReviewPayload, db: Session = Depends(get_db), curr
         "new_interval": card.interval,
         "next_review": card.next_review_date.isoformat()
     }
+
+@app.post("/api/flashcards/review/batch")
+def review_flashcards_batch(payload: BatchReviewPayload, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+    """
+    Applies a whole session of ratings (e.g. queued while offline): one SELECT for every card, the user's
+    scheduler in reviewed_at order in memory, one bulk UPDATE, one review-log INSERT and a single commit. Cards that don't exist or belong
+    to another user are skipped; ratings older than the card's last review (already superseded, e.g. by another device) are
+    rejected as stale instead of rewinding its schedule.
+    """
+    if len(payload.reviews) > REVIEW_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {REVIEW_BATCH_MAX} reviews per batch")
+    now = datetime.utcnow()
+
+    # 1. Load every card of the batch in one query
+    ids = {r.card_id for r in payload.reviews}
+    rows = db.execute(
+        select(models.Flashcard.id, models.Flashcard.set_id, *(getattr(models.Flashcard, f) for f in srs.CARD_FIELDS))
+        .join(models.StudySet, models.StudySet.id == models.Flashcard.set_id)
+        .where(models.Flashcard.id.in_(ids), models.StudySet.user_id == current_user.id)
+    ).all()
+    cards = {r.id: dict(r._mapping) for r in rows}
+    previous = {card_id: card["next_review_date"] for card_id, card in cards.items()}
+
+    # 2. The user's scheduler in memory, oldest rating first (ties keep the client's order)
+    settings = _srs_settings(db, current_user.id)
+    events = sorted(enumerate(payload.reviews), key=lambda e: (srs.utc_naive(e[1].reviewed_at, now), e[0]))
+    reviewed, skipped, stale, logs = {}, set(), set(), []
+    for _, event in events:
+        card = cards.get(event.card_id)
+        if card is None:
+            skipped.add(event.card_id)
+            continue
+        reviewed_at = srs.utc_naive(event.reviewed_at, now)
+        if srs.is_stale(card, reviewed_at):
+            stale.add(event.card_id)
+            continue
+        logs.append({"user_id": current_user.id, "card_id": event.card_id, "reviewed_at": reviewed_at,
+                     "rating": srs.rating(event.difficulty), "elapsed_days": srs.elapsed_days(card, reviewed_at),
+                     "scheduler": settings["scheduler"]})
+        reviewed[event.card_id] = srs.review(card, event.difficulty, reviewed_at, settings)
+    if reviewed and srs.SRS_LOAD_BALANCE:
+        # One histogram read for the batch; each placed card counts towards the next one's choice
+        load = due_queue.daily_load(db, current_user.id, *srs.balance_range(list(reviewed.values())))
+        for card in reviewed.values():
+            srs.rebalance(card, load)
+
+    # 3. One bulk UPDATE (by primary key), the review log and the due buckets, in one transaction
+    if reviewed:
+        db.execute(update(models.Flashcard), [
+            {k: card[k] for k in ("id", *srs.CARD_FIELDS)} for card in reviewed.values()
+        ])
+        db.execute(insert(models.ReviewLog), logs)
+        due_queue.cards_moved(db, current_user.id, [
+            (card["set_id"], previous[card_id], card["next_review_date"]) for card_id, card in reviewed.items()
+        ], now)
+    db.commit()
+
+    return {
+        "status": "success",
+        "reviewed": len(logs),
+        "skipped": sorted(skipped),
+        "stale": sorted(stale),
+        "cards": [{"card_id": card_id, "new_interval": card["interval"], "next_review": card["next_review_date"].isoformat()}
+                  for card_id, card in reviewed.items()]
+    }
     
 # --- Quiz ---
 
@@ -427,39 +685,24 @@ def quiz_complete(payload: QuizCompletePayload, db: Session = Depends(get_db), c
 
 # --- NEW: Quiz Regeneration ---
 @app.post("/api/quiz/regenerate/{set_id}")
-def regenerate_quiz(set_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+async def regenerate_quiz(set_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
     study_set = db.query(models.StudySet).filter(models.StudySet.id == set_id, models.StudySet.user_id == current_user.id).first()
     if not study_set:
         raise HTTPException(status_code=404, detail="Study set not found")
 
-    flashcards = db.query(models.Flashcard).filter(models.Flashcard.set_id == set_id).all()
-    if not flashcards:
-        raise HTTPException(status_code=400, detail="No flashcards available to generate quiz from.")
-    
-    context_text = "\n".join([f"Q: {f.question}\nA: {f.answer}" for f in flashcards])
+    # Serve a pre-generated quiz if the warm pool has one; either way, top the pool back up
+    count = pipeline.quiz_from_pool(db, set_id, num_questions=5)
+    if count:
+        warm_pool.schedule_refill(db, warm_pool.QUIZ, set_id)
+        return {"message": "Quiz regenerated successfully", "count": count}
 
-    # Call AI
-    new_questions_data = generate_quiz_from_context(context_text, num_questions=5)
-    
-    if not new_questions_data:
-        raise HTTPException(status_code=503, detail="AI failed to generate quiz")
+    async def _work():
+        count = await pipeline.regenerate_quiz_for_set(db, set_id, num_questions=5)
+        return {"message": "Quiz regenerated successfully", "count": count}
 
-    # Replace old questions
-    db.query(models.QuizQuestion).filter(models.QuizQuestion.set_id == set_id).delete()
-    
-    for q in new_questions_data:
-        new_q = models.QuizQuestion(
-            set_id=set_id,
-            question=q["question"],
-            options=q["options"],
-            correct_answer=q["correct_answer"],
-            tag="Generated"
-        )
-        db.add(new_q)
-    
-    db.commit()
-    
-    return {"message": "Quiz regenerated successfully", "count": len(new_questions_data)}
+    result = await _run_ai_job(db, "regenerate_quiz", _work, current_user.id, set_id=set_id, payload={"num_questions": 5})
+    warm_pool.schedule_refill(db, warm_pool.QUIZ, set_id)
+    return result
 
 # --- Arena ---
 
@@ -477,7 +720,7 @@ def get_arena_challenge_by_set(set_id: int, db: Session = Depends(get_db), curre
     return {"id": arena_row.id, "scenario": arena_row.scenario, "ideal_response": arena_row.ideal_response, "related_topic_tag": arena_row.related_topic_tag, "set_id": arena_row.set_id}
 
 @app.post("/api/arena/session/start")
-def start_arena_session(payload: StartArenaSessionPayload, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+async def start_arena_session(payload: StartArenaSessionPayload, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
     study_set = db.query(models.StudySet).filter(models.StudySet.id == payload.set_id, models.StudySet.user_id == current_user.id).first()
     if not study_set:
         raise HTTPException(status_code=404, detail="Study set not found")
@@ -487,32 +730,36 @@ def start_arena_session(payload: StartArenaSessionPayload, db: Session = Depends
     db.commit()
     db.refresh(session_row)
 
-    generation_kwargs = {"temperature": 0.8, "top_p": 0.95, "random_seed": str(uuid4()), "num_questions": max(1, min(10, payload.num_questions))}
+    num_questions = max(1, min(10, payload.num_questions))
+    questions = pipeline.arena_session_from_pool(db, session_row, num_questions)
+    remaining = num_questions - len(questions)
+    warm_pool.schedule_refill(db, warm_pool.ARENA, payload.set_id)
 
-    try:
-        generated = ai_engine.generate_arena_questions_for_set(study_set, generation_kwargs)
-    except Exception as e:
-        db.delete(session_row)
-        db.commit()
-        raise HTTPException(status_code=503, detail=f"AI generation failed: {e}")
-
-    saved_questions = []
-    for item in generated:
-        qrow = models.ArenaSessionQuestion(
-            session_id=session_row.id, set_id=payload.set_id,
-            question_text=item.get("scenario") or item.get("question") or "",
-            ideal_response=item.get("ideal_response") or item.get("answer") or "",
-            question_meta=item.get("meta", {}),
-            created_at=datetime.utcnow()
-        )
-        db.add(qrow)
-        saved_questions.append(qrow)
-    db.commit()
+    if remaining:
+        async def _work():
+            generated = await pipeline.generate_arena_session(db, session_row.id, remaining)
+            return {"session_id": session_row.id, "questions": generated}
+
+        try:
+            result = await _run_ai_job(
+                db, "arena_session", _work, current_user.id, set_id=payload.set_id,
+                payload={"session_id": session_row.id, "num_questions": remaining}
+            )
+        except HTTPException:
+            if questions:
+                # The pooled part of the session is still usable
+                result = {"questions": []}
+            else:
+                db.rollback()
+                db.delete(session_row)
+                db.commit()
+                raise
+        questions += result["questions"]
 
     return {
         "session_id": session_row.id,
         "created_at": session_row.created_at.isoformat(),
-        "questions": [{"id": q.id, "question_text": q.question_text, "ideal_response": q.ideal_response, "meta": q.question_meta} for q in saved_questions]
+        "questions": questions
     }
 
 @app.get("/api/arena/session/{session_id}")
@@ -527,26 +774,22 @@ def get_arena_session(session_id: int, db: Session = Depends(get_db), current_us
 
 # --- UPDATED: Arena Submit with AI Grading ---
 @app.post("/api/arena/submit")
-def submit_arena_assessment(payload: ArenaSubmitPayload, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+async def submit_arena_assessment(payload: ArenaSubmitPayload, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
     study_set = db.query(models.StudySet).filter(models.StudySet.id == payload.set_id, models.StudySet.user_id == current_user.id).first()
     if not study_set:
         raise HTTPException(status_code=404, detail="Study set not found")
         
-    challenge = db.query(models.ArenaChallenge).filter(models.ArenaChallenge.id == payload.challenge_id).first()
-    scenario_text = challenge.scenario if challenge else "General Context"
-
     # Call AI Grading
     print(f"🤖 Grading Arena submission for User {current_user.id}...")
-    grading_result = grade_arena_submission(scenario_text, payload.user_response)
-    
-    return {
-        "status": "success", 
-        "ai_score": grading_result.get("score", 0),
-        "ai_feedback": grading_result.get("feedback", "No feedback.")
-    }
+    return await _run_ai_job(
+        db, "grade_arena",
+        lambda: pipeline.grade_submission(db, payload.challenge_id, payload.user_response),
+        current_user.id, set_id=payload.set_id,
+        payload={"challenge_id": payload.challenge_id, "user_response": payload.user_response}
+    )
     
 @app.post("/api/arena/regenerate/{set_id}")
-def regenerate_arena_challenge(set_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
+async def regenerate_arena_challenge(set_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(security.get_current_user)):
     """
     Generates a FRESH Arena scenario and updates the database.
     """
@@ -556,15 +799,18 @@ def regenerate_arena_challenge(set_id: int, db: Session = Depends(get_db), curre
 
     print(f"🔄 Regenerating Arena Scenario for Set {set_id}...")
 
-    # 1. Call AI to generate 1 new scenario
+    # 1. Take a pre-generated scenario from the warm pool, or call AI to generate 1 new one
     # We use a random seed to ensure it's different from the last one
-    gen_kwargs = {"num_questions": 1, "random_seed": str(uuid4())}
-    new_scenarios = ai_engine.generate_arena_questions_for_set(study_set, gen_kwargs)
-    
-    if not new_scenarios:
-        raise HTTPException(status_code=503, detail="AI failed to generate new scenario")
+    new_data = pipeline.arena_scenario_from_pool(db, set_id)
+    if new_data is None:
+        gen_kwargs = {"num_questions": 1, "random_seed": str(uuid4())}
+        new_scenarios = await ai_engine.generate_arena_questions_for_set_async(study_set, gen_kwargs)
+
+        if not new_scenarios:
+            raise HTTPException(status_code=503, detail="AI failed to generate new scenario")
 
-    new_data = new_scenarios[0]
+        new_data = new_scenarios[0]
+    warm_pool.schedule_refill(db, warm_pool.ARENA, set_id)
 
     # 2. Update the existing record in DB
     arena_row = db.query(models.ArenaChallenge).filter(models.ArenaChallenge.set_id == set_id).first()
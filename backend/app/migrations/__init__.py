@@ -0,0 +1,133 @@
+"""
+Versioned schema migrations.
+
+Each `mNNNN_<name>.py` module in this package defines `VERSION` (int), `DESCRIPTION` and
+`upgrade(conn)`. Applied versions are recorded in the `schema_migrations` table; `upgrade()`
+runs the pending ones in order. A module may set `TRANSACTIONAL = False` when it has to run
+outside a transaction (e.g. CREATE INDEX CONCURRENTLY on Postgres).
+"""
+import re
+import time
+import pkgutil
+import importlib
+from datetime import datetime
+
+from sqlalchemy import text
+
+try:
+    from app.database import engine as default_engine
+except ImportError:
+    from database import engine as default_engine
+
+# Arbitrary key for pg_advisory_lock: two deploys migrating at once run one after the other
+_LOCK_KEY = 0x6E77_6D67
+
+_MODULE = re.compile(r"^m(\d{4})_\w+$")
+
+def discover() -> list:
+    """Migration modules sorted by version."""
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        if _MODULE.match(info.name):
+            module = importlib.import_module(f"{__name__}.{info.name}")
+            found.append(module)
+    found.sort(key=lambda m: m.VERSION)
+    versions = [m.VERSION for m in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return found
+
+def _ensure_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INTEGER PRIMARY KEY,"
+            " description VARCHAR NOT NULL,"
+            " applied_at TIMESTAMP NOT NULL,"
+            " duration_ms INTEGER NOT NULL)"
+        ))
+
+def applied_versions(engine=None) -> dict:
+    """{version: applied_at} of the migrations already run."""
+    engine = engine or default_engine
+    _ensure_table(engine)
+    with engine.connect() as conn:
+        return {row.version: row.applied_at for row in conn.execute(text("SELECT version, applied_at FROM schema_migrations"))}
+
+def status(engine=None) -> list:
+    """[(version, description, applied_at or None)] for every known migration."""
+    applied = applied_versions(engine)
+    return [(m.VERSION, m.DESCRIPTION, applied.get(m.VERSION)) for m in discover()]
+
+def _record(conn, module, started: float):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, description, applied_at, duration_ms) VALUES (:v, :d, :at, :ms)"),
+        {"v": module.VERSION, "d": module.DESCRIPTION, "at": datetime.utcnow(), "ms": int((time.monotonic() - started) * 1000)},
+    )
+
+def _apply(engine, module):
+    started = time.monotonic()
+    if getattr(module, "TRANSACTIONAL", True):
+        with engine.begin() as conn:
+            module.upgrade(conn)
+            _record(conn, module, started)
+        return
+    # Non-transactional steps must be idempotent: a failure halfway is retried from the top
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        module.upgrade(conn)
+    with engine.begin() as conn:
+        _record(conn, module, started)
+
+def upgrade(engine=None, target: int = None, dry_run: bool = False) -> list:
+    """Applies pending migrations up to `target` (default: all). Returns the versions applied (or pending, on a dry run)."""
+    engine = engine or default_engine
+    _ensure_table(engine)
+    lock = engine.connect() if engine.dialect.name == "postgresql" else None
+    try:
+        if lock is not None:
+            lock.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _LOCK_KEY})
+        applied = applied_versions(engine)
+        pending = [m for m in discover() if m.VERSION not in applied and (target is None or m.VERSION <= target)]
+        done = []
+        for module in pending:
+            if dry_run:
+                print(f"   ⏳ {module.VERSION:04d} {module.DESCRIPTION}")
+                done.append(module.VERSION)
+                continue
+            print(f"🔧 Applying migration {module.VERSION:04d}: {module.DESCRIPTION}...")
+            _apply(engine, module)
+            print(f"   ✅ {module.VERSION:04d} applied.")
+            done.append(module.VERSION)
+        return done
+    finally:
+        if lock is not None:
+            lock.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+            lock.close()
+
+# --- Helpers for migration modules ---
+def _autocommit(conn) -> bool:
+    return conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+
+def create_index(conn, name: str, table: str, columns: str, where: str = None, unique: bool = False):
+    """
+    CREATE INDEX IF NOT EXISTS, built CONCURRENTLY on Postgres when `conn` is in autocommit mode
+    (so big tables stay writable). `where` makes it a partial index (Postgres and SQLite).
+    """
+    concurrently = ""
+    if conn.dialect.name == "postgresql":
+        if _autocommit(conn):
+            concurrently = "CONCURRENTLY "
+        # A concurrent build that failed leaves an INVALID index that IF NOT EXISTS would keep
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :n AND NOT i.indisvalid"
+        ), {"n": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+    ddl = f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})"
+    if where:
+        ddl += f" WHERE {where}"
+    conn.execute(text(ddl))
+
+def drop_index(conn, name: str):
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" and _autocommit(conn) else ""
+    conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
@@ -0,0 +1,157 @@
+"""
+The schema as it stood when migrations were introduced, frozen here as explicit table definitions so
+the baseline never changes with app.models (later changes belong in later migrations). Creates the
+tables that don't exist yet; existing databases adopt the migration history here.
+"""
+from sqlalchemy import (
+    MetaData, Table, Column, Index, ForeignKey,
+    Integer, String, Text, DateTime, JSON, Float, LargeBinary,
+)
+
+VERSION = 1
+DESCRIPTION = "baseline schema"
+
+baseline = MetaData()
+
+Table(
+    "users", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String, unique=True, index=True),
+    Column("password_hash", String),
+)
+
+Table(
+    "study_sets", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("title", String),
+    Column("description", Text, nullable=True),
+    Column("pdf_filename", String, nullable=True),
+    Column("card_count", Integer),
+    Column("mastery_score", Float),
+    Column("srs_success_rate", Float),
+    Column("total_time_studied", Integer),
+    Column("created_at", DateTime),
+)
+
+Table(
+    "flashcards", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("set_id", Integer, ForeignKey("study_sets.id")),
+    Column("question", Text),
+    Column("answer", Text),
+    Column("tag", String, nullable=True),
+    Column("repetition_number", Integer),
+    Column("ease_factor", Float),
+    Column("interval", Float),
+    Column("next_review_date", DateTime, nullable=True),
+)
+
+Table(
+    "quiz_questions", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("set_id", Integer, ForeignKey("study_sets.id")),
+    Column("question", Text),
+    Column("options", JSON),
+    Column("correct_answer", String),
+    Column("tag", String, nullable=True),
+)
+
+Table(
+    "pooled_quiz_questions", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("set_id", Integer, ForeignKey("study_sets.id", ondelete="CASCADE"), index=True),
+    Column("question", Text),
+    Column("options", JSON),
+    Column("correct_answer", String),
+    Column("tag", String, nullable=True),
+    Column("created_at", DateTime),
+)
+
+Table(
+    "quiz_sessions", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("set_id", Integer, ForeignKey("study_sets.id")),
+    Column("score", Integer),
+    Column("answers", JSON),
+    Column("duration_ms", Integer),
+    Column("created_at", DateTime),
+)
+
+Table(
+    "arena_challenges", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("set_id", Integer, ForeignKey("study_sets.id")),
+    Column("scenario", Text),
+    Column("ideal_response", Text),
+    Column("related_topic_tag", String, nullable=True),
+)
+
+Table(
+    "pooled_arena_scenarios", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("set_id", Integer, ForeignKey("study_sets.id", ondelete="CASCADE"), index=True),
+    Column("scenario", Text),
+    Column("ideal_response", Text),
+    Column("related_topic_tag", String, nullable=True),
+    Column("meta", JSON, nullable=True),
+    Column("created_at", DateTime),
+)
+
+Table(
+    "arena_sessions", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("set_id", Integer, ForeignKey("study_sets.id")),
+    Column("created_at", DateTime),
+    Column("meta", JSON, nullable=True),
+)
+
+Table(
+    "arena_session_questions", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("session_id", Integer, ForeignKey("arena_sessions.id")),
+    Column("set_id", Integer, ForeignKey("study_sets.id")),
+    Column("question_text", Text),
+    Column("ideal_response", Text),
+    Column("question_meta", JSON, nullable=True),
+    Column("created_at", DateTime),
+)
+
+Table(
+    "generated_materials", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("pdf_sha256", String(64), index=True),
+    Column("text_sha256", String(64), index=True),
+    Column("syllabus", JSON),
+    Column("topic_contents", JSON),
+    Column("created_at", DateTime),
+)
+
+Table(
+    "jobs", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("kind", String),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("set_id", Integer, ForeignKey("study_sets.id", ondelete="SET NULL"), nullable=True),
+    Column("status", String, index=True),
+    Column("stage", String, nullable=True),
+    Column("progress", JSON),
+    Column("payload", JSON, nullable=True),
+    Column("input_blob", LargeBinary, nullable=True),
+    Column("result", JSON, nullable=True),
+    Column("error", Text, nullable=True),
+    Column("priority", Integer),
+    Column("attempts", Integer),
+    Column("max_attempts", Integer),
+    Column("run_after", DateTime),
+    Column("locked_by", String, nullable=True),
+    Column("locked_until", DateTime, nullable=True),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Index("ix_jobs_claim", "status", "priority", "run_after"),
+)
+
+def upgrade(conn):
+    baseline.create_all(bind=conn, checkfirst=True)
@@ -0,0 +1,25 @@
+"""
+Indexes for the per-set and due-card queries (/api/reviews/today, flashcards?mode=due, every
+/api/study-set/{id}/... endpoint). Built CONCURRENTLY on Postgres so a 10M-card table stays writable.
+Declared in app.models as well (for create_all); IF NOT EXISTS skips the ones a database already has.
+"""
+try:
+    from app.migrations import create_index
+except ImportError:
+    from migrations import create_index
+
+VERSION = 2
+DESCRIPTION = "indexes for per-set and due-card queries"
+TRANSACTIONAL = False
+
+def upgrade(conn):
+    # Owner lookups: the set list and the set_id + user_id check at the top of every per-set endpoint
+    create_index(conn, "ix_study_sets_user_id", "study_sets", "user_id, id")
+    # Cards of a set, and its due cards as a range on next_review_date within the set
+    create_index(conn, "ix_flashcards_set_due", "flashcards", "set_id, next_review_date")
+    # Never-reviewed cards are always due: the `next_review_date IS NULL` branch of the due filter.
+    # (The "<= now" branch can't be a partial predicate, it changes every second; it is the range above.)
+    create_index(conn, "ix_flashcards_set_new", "flashcards", "set_id", where="next_review_date IS NULL")
+    create_index(conn, "ix_quiz_questions_set_id", "quiz_questions", "set_id")
+    create_index(conn, "ix_arena_challenges_set_id", "arena_challenges", "set_id")
+    create_index(conn, "ix_arena_session_questions_session_id", "arena_session_questions", "session_id")
@@ -0,0 +1,17 @@
+"""Materialized due queue: the due_card_counters table, filled from the existing flashcards."""
+from sqlalchemy.orm import Session
+
+try:
+    from app import models, due_queue
+except ImportError:
+    import models, due_queue
+
+VERSION = 3
+DESCRIPTION = "due card counters"
+
+def upgrade(conn):
+    models.DueCardCounter.__table__.create(bind=conn, checkfirst=True)
+    with Session(bind=conn) as db:
+        cards = due_queue.rebuild(db)
+        db.flush()
+    print(f"   📊 Counted {cards} card(s) into due buckets.")
@@ -0,0 +1,25 @@
+"""FSRS scheduler: review log, per-user scheduler settings and the FSRS memory state on flashcards."""
+from sqlalchemy import inspect, text
+
+try:
+    from app import models
+except ImportError:
+    import models
+
+VERSION = 4
+DESCRIPTION = "review log, srs settings and FSRS card state"
+
+_CARD_COLUMNS = {
+    "last_review_date": "TIMESTAMP",
+    "fsrs_stability": "FLOAT",
+    "fsrs_difficulty": "FLOAT",
+}
+
+def upgrade(conn):
+    existing = {c["name"] for c in inspect(conn).get_columns("flashcards")}
+    for column, ddl in _CARD_COLUMNS.items():
+        if column not in existing:
+            # Nullable without a default: a catalog-only change on Postgres, no table rewrite
+            conn.execute(text(f"ALTER TABLE flashcards ADD COLUMN {column} {ddl}"))
+    models.ReviewLog.__table__.create(bind=conn, checkfirst=True)
+    models.SrsSettings.__table__.create(bind=conn, checkfirst=True)
@@ -0,0 +1,21 @@
+"""
+Indexes for the keyset-paginated listings: flashcards in (set_id, id) order and study sets in
+(user_id, created_at, id) order, so every page is an index range scan however deep the cursor.
+Declared in app.models as well (for create_all); IF NOT EXISTS skips the ones a database already has.
+"""
+from sqlalchemy import text
+
+try:
+    from app.migrations import create_index
+except ImportError:
+    from migrations import create_index
+
+VERSION = 5
+DESCRIPTION = "indexes for keyset pagination of flashcards and study sets"
+TRANSACTIONAL = False
+
+def upgrade(conn):
+    # A NULL created_at would drop the set out of the (user_id, created_at, id) keyset
+    conn.execute(text("UPDATE study_sets SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
+    create_index(conn, "ix_study_sets_user_created", "study_sets", "user_id, created_at, id")
+    create_index(conn, "ix_flashcards_set_id_id", "flashcards", "set_id, id")
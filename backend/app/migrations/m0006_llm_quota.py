@@ -0,0 +1,11 @@
+"""Shared model API budget: the llm_quota table read and updated by every process's rate scheduler."""
+try:
+    from app import models
+except ImportError:
+    import models
+
+VERSION = 6
+DESCRIPTION = "shared llm quota"
+
+def upgrade(conn):
+    models.LlmQuota.__table__.create(bind=conn, checkfirst=True)
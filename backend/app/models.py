@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON, Boolean, Float, BigInteger
+from sqlalchemy import text, Column, Integer, String, Text, ForeignKey, DateTime, JSON, Boolean, Float, BigInteger, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime
@@ -33,6 +33,15 @@ class StudySet(Base):
     flashcards = relationship("Flashcard", back_populates="study_set", cascade="all, delete-orphan")
     quiz_questions = relationship("QuizQuestion", back_populates="study_set", cascade="all, delete-orphan")
     arena_challenges = relationship("ArenaChallenge", back_populates="study_set", cascade="all, delete-orphan")
+    pooled_quiz_questions = relationship("PooledQuizQuestion", cascade="all, delete-orphan")
+    pooled_arena_scenarios = relationship("PooledArenaScenario", cascade="all, delete-orphan")
+    due_counters = relationship("DueCardCounter", cascade="all, delete-orphan")
+
+    # Indexes are created by migrations (app/migrations); declared here so create_all matches them
+    __table_args__ = (
+        Index("ix_study_sets_user_id", "user_id", "id"),
+        Index("ix_study_sets_user_created", "user_id", "created_at", "id"),
+    )
 
 class Flashcard(Base):
     __tablename__ = "flashcards"
@@ -48,9 +57,62 @@ class Flashcard(Base):
     ease_factor = Column(Float, default=2.5)
     interval = Column(Float, default=0.0)
     next_review_date = Column(DateTime, nullable=True)
+    last_review_date = Column(DateTime, nullable=True)
+    # FSRS memory state (srs.py); NULL until the card's first review under FSRS
+    fsrs_stability = Column(Float, nullable=True)  # days until recall probability drops to 90%
+    fsrs_difficulty = Column(Float, nullable=True)  # 1 (easy) .. 10 (hard)
     
     study_set = relationship("StudySet", back_populates="flashcards")
 
+    __table_args__ = (
+        Index("ix_flashcards_set_due", "set_id", "next_review_date"),
+        Index("ix_flashcards_set_id_id", "set_id", "id"),
+        Index("ix_flashcards_set_new", "set_id",
+              postgresql_where=text("next_review_date IS NULL"), sqlite_where=text("next_review_date IS NULL")),
+    )
+
+class DueCardCounter(Base):
+    """
+    How many cards of a set fall due in a time bucket (materialized due queue, see due_queue.py).
+    The dashboard sums a user's buckets up to now instead of scanning their flashcards.
+    """
+    __tablename__ = "due_card_counters"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    set_id = Column(Integer, ForeignKey("study_sets.id", ondelete="CASCADE"), primary_key=True)
+    due_at = Column(DateTime, primary_key=True)  # end of the bucket; 1970-01-01 for new and overdue cards
+    card_count = Column(Integer, nullable=False, default=0)
+
+class ReviewLog(Base):
+    """One rating of one card; the history the FSRS optimizer fits per-user parameters to."""
+    __tablename__ = "review_logs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    card_id = Column(Integer, ForeignKey("flashcards.id", ondelete="CASCADE"), nullable=False)
+    reviewed_at = Column(DateTime, nullable=False)
+    rating = Column(Integer, nullable=False)  # 1 again, 2 hard, 3 good, 4 easy
+    elapsed_days = Column(Float, nullable=True)  # since the card's previous review; NULL for the first
+    scheduler = Column(String, nullable=False)  # "sm2" or "fsrs": which one scheduled the next review
+
+    __table_args__ = (
+        # The optimizer streams the log user by user, card by card, in time order
+        Index("ix_review_logs_user_card", "user_id", "card_id", "reviewed_at"),
+    )
+
+class SrsSettings(Base):
+    """A user's scheduler choice and fitted FSRS parameters (see srs.py and optimize_srs.py)."""
+    __tablename__ = "srs_settings"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    scheduler = Column(String, nullable=False, default="sm2")  # "sm2" or "fsrs"
+    desired_retention = Column(Float, nullable=False, default=0.9)
+    fsrs_params = Column(JSON, nullable=True)  # NULL: srs.FSRS_DEFAULT_PARAMS
+    optimized_at = Column(DateTime, nullable=True)
+    optimized_reviews = Column(Integer, default=0)
+    log_loss = Column(Float, nullable=True)  # of fsrs_params on the log they were fitted to
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class QuizQuestion(Base):
     __tablename__ = "quiz_questions"
 
@@ -63,6 +125,22 @@ class QuizQuestion(Base):
 
     study_set = relationship("StudySet", back_populates="quiz_questions")
 
+    __table_args__ = (
+        Index("ix_quiz_questions_set_id", "set_id"),
+    )
+
+class PooledQuizQuestion(Base):
+    """Pre-generated, not yet served MCQ (warm pool, see warm_pool.py)."""
+    __tablename__ = "pooled_quiz_questions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    set_id = Column(Integer, ForeignKey("study_sets.id", ondelete="CASCADE"), index=True)
+    question = Column(Text)
+    options = Column(JSON)
+    correct_answer = Column(String)
+    tag = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class QuizSession(Base):
     __tablename__ = "quiz_sessions"
     
@@ -85,6 +163,22 @@ class ArenaChallenge(Base):
 
     study_set = relationship("StudySet", back_populates="arena_challenges")
 
+    __table_args__ = (
+        Index("ix_arena_challenges_set_id", "set_id"),
+    )
+
+class PooledArenaScenario(Base):
+    """Pre-generated, not yet served application scenario (warm pool, see warm_pool.py)."""
+    __tablename__ = "pooled_arena_scenarios"
+
+    id = Column(Integer, primary_key=True, index=True)
+    set_id = Column(Integer, ForeignKey("study_sets.id", ondelete="CASCADE"), index=True)
+    scenario = Column(Text)
+    ideal_response = Column(Text)
+    related_topic_tag = Column(String, nullable=True)
+    meta = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class ArenaSession(Base):
     __tablename__ = "arena_sessions"
 
@@ -109,4 +203,71 @@ class ArenaSessionQuestion(Base):
     question_meta = Column(JSON, nullable=True) 
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    session = relationship("ArenaSession", back_populates="questions")
\ No newline at end of file
+    session = relationship("ArenaSession", back_populates="questions")
+
+    __table_args__ = (
+        Index("ix_arena_session_questions_session_id", "session_id"),
+    )
+
+class GeneratedMaterial(Base):
+    """
+    AI output for one uploaded document, stored under its fingerprints so that a repeat
+    upload of the same PDF (or of a PDF with identical text) is cloned instead of regenerated.
+    """
+    __tablename__ = "generated_materials"
+
+    id = Column(Integer, primary_key=True, index=True)
+    pdf_sha256 = Column(String(64), index=True)
+    text_sha256 = Column(String(64), index=True)
+    syllabus = Column(JSON)
+    topic_contents = Column(JSON)  # list of {"flashcards": [...], "quiz": {...}, "arena": {...}}
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    """
+    Durable background job (e.g. turning an uploaded PDF into a study set).
+    `progress` is an append-only list of events that the status endpoint and the SSE stream replay.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, default="generate_pdf")
+    user_id = Column(Integer, ForeignKey("users.id"))
+    set_id = Column(Integer, ForeignKey("study_sets.id", ondelete="SET NULL"), nullable=True)
+
+    status = Column(String, default="queued", index=True)  # queued, running, succeeded, failed, dead
+    stage = Column(String, nullable=True)  # extraction, syllabus, topics, done
+    progress = Column(JSON, default=list)
+    payload = Column(JSON, nullable=True)
+    input_blob = Column(LargeBinary, nullable=True)  # uploaded PDF, dropped once the job succeeds
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+
+    # Queue bookkeeping (claimed with SELECT ... FOR UPDATE SKIP LOCKED, see jobs.py)
+    priority = Column(Integer, default=100)  # lower runs first
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.utcnow)  # retry backoff
+    locked_by = Column(String, nullable=True)
+    locked_until = Column(DateTime, nullable=True)  # visibility timeout; an expired lease is re-claimable
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_jobs_claim", "status", "priority", "run_after"),
+    )
+
+class LlmQuota(Base):
+    """
+    Model API budget shared by every API and worker process (see rate_limiter.py): the levels of the
+    requests- and tokens-per-minute buckets and the 429 cool-down. Changed by compare-and-swap on `version`.
+    """
+    __tablename__ = "llm_quota"
+
+    key = Column(String, primary_key=True)
+    requests = Column(Float, nullable=False)
+    tokens = Column(Float, nullable=False)
+    refilled_at = Column(Float, nullable=False)  # epoch seconds of the last refill
+    cooldown_until = Column(Float, nullable=False, default=0.0)  # epoch seconds
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,68 @@
+import os
+import json
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from dotenv import load_dotenv
+
+# --- Config ---
+load_dotenv()
+PAGE_MAX = int(os.getenv("PAGE_MAX", "1000"))
+
+# Response header carrying the cursor of the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: list) -> str:
+    """Opaque cursor for the sort key of the last row of a page."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, types: tuple) -> list:
+    """The sort key in a cursor, converted to `types` (int, datetime, ...). Raises 400 on a malformed cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(values) != len(types):
+            raise ValueError("wrong key length")
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(values, types)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def select_fields(fields: str, columns: dict, key: dict) -> tuple:
+    """
+    (fields to return, columns to query) for a comma-separated `fields` parameter (None: all of `columns`).
+    The `key` columns (the sort key) are always queried, even when not returned.
+    """
+    names = list(columns) if not fields else [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [n for n in names if n not in columns]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"fields must be a subset of {', '.join(columns)}")
+    queried = {**{n: columns[n] for n in names}, **key}
+    return names, [column.label(n) for n, column in queried.items()]
+
+def page(query, key: dict, types: tuple, cursor: str = None, limit: int = None):
+    """Keyset page of `query` ordered by the `key` columns: rows after `cursor`, at most `limit` (+1 to detect more)."""
+    if cursor:
+        query = query.where(tuple_(*key.values()) > tuple_(*decode_cursor(cursor, types)))
+    query = query.order_by(*key.values())
+    if limit is not None:
+        if not 1 <= limit <= PAGE_MAX:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {PAGE_MAX}")
+        query = query.limit(limit + 1)
+    return query
+
+def finish(rows: list, names: list, key: dict, limit: int = None) -> tuple:
+    """(dicts of the requested fields, next cursor or None) from the rows of a page() query."""
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], k) for k in key])
+    out = []
+    for row in rows:
+        item = {}
+        for n in names:
+            value = getattr(row, n)
+            item[n] = value.isoformat() if isinstance(value, datetime) else value
+        out.append(item)
+    return out, next_cursor
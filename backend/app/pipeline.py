@@ -0,0 +1,325 @@
+import os
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+from hashlib import sha256
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+try:
+    from app import models, ai_engine, jobs, warm_pool, due_queue
+except ImportError:
+    import models, ai_engine, jobs, warm_pool, due_queue
+
+# --- Config ---
+load_dotenv()
+# "stream" (default): each topic is committed to the set as soon as it is generated, so readers see cards
+# early but a failure can leave a partial set. "bulk" (opt-in): the set's content is written in one
+# transaction once every topic is done (finished topics are staged on the job row so a retry doesn't
+# regenerate them); cards only appear when the job completes.
+GENERATE_PERSIST_MODE = os.getenv("GENERATE_PERSIST_MODE", "stream").lower()
+# Multi-row VALUES must stay under Postgres' 65535 bind parameters; bigger writes use executemany
+BULK_MAX_PARAMS = int(os.getenv("BULK_MAX_PARAMS", "30000"))
+
+# --- Generated material (duplicate-upload reuse) ---
+def find_material(db: Session, pdf_sha256: str = None, text_sha256: str = None):
+    query = db.query(models.GeneratedMaterial)
+    if pdf_sha256:
+        query = query.filter(models.GeneratedMaterial.pdf_sha256 == pdf_sha256)
+    elif text_sha256:
+        query = query.filter(models.GeneratedMaterial.text_sha256 == text_sha256)
+    else:
+        return None
+    return query.order_by(models.GeneratedMaterial.id.desc()).first()
+
+def topic_rows(set_id: int, topic_contents: list):
+    """Flattens generated topic content into row dicts for bulk inserts."""
+    flashcards, quizzes, arenas = [], [], []
+    for topic_content in topic_contents:
+        if not topic_content: continue
+        for fc in topic_content.get("flashcards", []):
+            flashcards.append({"set_id": set_id, "question": fc.get("question"), "answer": fc.get("answer"), "tag": fc.get("tag")})
+        quiz = topic_content.get("quiz")
+        if quiz:
+            quizzes.append({
+                "set_id": set_id, "question": quiz.get("question"), "options": quiz.get("options") or [],
+                "correct_answer": quiz.get("correct_answer"), "tag": quiz.get("tag")
+            })
+        arena = topic_content.get("arena")
+        if arena:
+            arenas.append({
+                "set_id": set_id, "scenario": arena.get("scenario"), "ideal_response": arena.get("ideal_response"),
+                "related_topic_tag": arena.get("related_topic_tag")
+            })
+    return flashcards, quizzes, arenas
+
+def _bump_card_count(set_id: int, added: int):
+    study_sets = models.StudySet.__table__
+    return update(study_sets).where(study_sets.c.id == set_id)\
+        .values(card_count=func.coalesce(study_sets.c.card_count, 0) + added)
+
+def insert_topic_contents(db: Session, set_id: int, topic_contents: list) -> int:
+    """
+    Adds topic content to a set, bumps card_count and counts the new cards as due (due_queue), all in
+    the same transaction. Does not commit. On Postgres the whole write is a single statement: one
+    multi-row INSERT per table as data-modifying CTEs of the card_count UPDATE. Elsewhere it is one
+    executemany per table.
+    Returns the number of flashcards written.
+    """
+    flashcards, quizzes, arenas = topic_rows(set_id, topic_contents)
+    tables = [(models.Flashcard.__table__, flashcards), (models.QuizQuestion.__table__, quizzes),
+              (models.ArenaChallenge.__table__, arenas)]
+    if not (flashcards or quizzes or arenas):
+        return 0
+    params = sum(len(rows) * len(table.columns) for table, rows in tables)
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql" and params <= BULK_MAX_PARAMS:
+        # Postgres runs every data-modifying CTE to completion even though the UPDATE doesn't read them
+        stmt = _bump_card_count(set_id, len(flashcards))
+        for table, rows in tables:
+            if rows:
+                stmt = stmt.add_cte(insert(table).values(rows).cte(f"new_{table.name}"))
+        if flashcards:
+            stmt = stmt.add_cte(due_queue.new_cards_stmt(dialect, set_id, len(flashcards)).cte("new_due_cards"))
+        db.execute(stmt)
+        return len(flashcards)
+    for table, rows in tables:
+        if rows:
+            db.execute(insert(table), rows)
+    if flashcards:
+        db.execute(_bump_card_count(set_id, len(flashcards)))
+        db.execute(due_queue.new_cards_stmt(dialect, set_id, len(flashcards)))
+    return len(flashcards)
+
+# --- The PDF -> study set pipeline ---
+def create_generate_job(db: Session, user_id: int, title: str, pdf_bytes: bytes):
+    """Creates the (empty) study set and the queued job that will fill it."""
+    study_set = models.StudySet(
+        title=title,
+        description="Generated from PDF",
+        user_id=user_id,
+        card_count=0,
+        created_at=datetime.utcnow()
+    )
+    db.add(study_set)
+    db.flush()
+    return jobs.enqueue(
+        db, "generate_pdf", user_id=user_id, set_id=study_set.id,
+        payload={"title": title}, input_blob=pdf_bytes, priority=jobs.PRIORITY_BULK
+    )
+
+@jobs.register("generate_pdf")
+async def generate_pdf_job(db: Session, job) -> dict:
+    """
+    Runs (or resumes) a generate_pdf job. Every stage is recorded on the job row. In bulk mode
+    finished topics are staged on the job and the whole set is written in one transaction at the
+    end; in stream mode each topic is committed to the study set as soon as it is generated.
+    A retried job reuses the stored syllabus and skips topics that were already generated.
+    """
+    payload = dict(job.payload or {})
+    set_id = job.set_id
+    if set_id is None:
+        raise jobs.PermanentJobError("Study set was deleted")
+    pdf_bytes = job.input_blob or b""
+
+    # 1. Extraction (or reuse of a duplicate upload)
+    syllabus = payload.get("syllabus")
+    pdf_fingerprint = sha256(pdf_bytes).hexdigest()
+    text_fingerprint = payload.get("text_sha256")
+    if not syllabus:
+        jobs.emit(db, job, "extraction", "Extracting text from PDF")
+        material = find_material(db, pdf_sha256=pdf_fingerprint)
+        extracted_text = ""
+        if not material:
+            # PDF parsing is CPU-bound: keep it off the event loop
+            extracted_text = await asyncio.to_thread(ai_engine.extract_text_from_pdf, pdf_bytes)
+            if extracted_text:
+                text_fingerprint = ai_engine.text_hash(extracted_text)
+                material = find_material(db, text_sha256=text_fingerprint)
+        if material:
+            print(f"♻️ Reusing generated material #{material.id} for duplicate upload.")
+            total_cards = insert_topic_contents(db, set_id, material.topic_contents or [])
+            db.commit()
+            _prefill_pools(db, set_id)
+            return {"set_id": set_id, "cards_created": total_cards, "reused": True}
+
+        # 2. Syllabus
+        jobs.emit(db, job, "syllabus", "Building syllabus", characters=len(extracted_text))
+        syllabus = await ai_engine.generate_syllabus_async(extracted_text)
+        if not syllabus:
+            if (job.attempts or 0) >= (job.max_attempts or jobs.JOB_MAX_ATTEMPTS):
+                # Last attempt: drop the empty placeholder set instead of leaving it on the dashboard
+                db.query(models.StudySet).filter(models.StudySet.id == set_id).delete(synchronize_session=False)
+                job.set_id = None
+                db.commit()
+            raise RuntimeError("AI failed to generate syllabus")
+        payload.update({"syllabus": syllabus, "text_sha256": text_fingerprint})
+        job.payload = payload
+
+    # 3. Topics, recorded one by one as they finish (in the set itself unless in bulk mode)
+    bulk = GENERATE_PERSIST_MODE == "bulk"
+    done = {e["index"] for e in (job.progress or []) if e.get("stage") == "topic" and e.get("ok")}
+    staged = dict(payload.get("staged") or {}) if bulk else {}
+    todo = [i for i in range(len(syllabus)) if i not in done]
+    jobs.emit(db, job, "topics", f"Generating {len(todo)} of {len(syllabus)} topics", total_topics=len(syllabus))
+
+    async def _persist(pos, content):
+        idx = todo[pos]
+        name = syllabus[idx].get("topic", f"Topic {idx + 1}")
+        if not content:
+            jobs.emit(db, job, "topic", f"Topic '{name}' failed", index=idx, ok=False)
+            return
+        if bulk:
+            # One JSON column update on the job row; the set itself is untouched until the end
+            staged[str(idx)] = content
+            job.payload = {**payload, "staged": staged}
+            cards = len(content.get("flashcards") or [])
+        else:
+            cards = insert_topic_contents(db, set_id, [content])
+        jobs.emit(db, job, "topic", f"Topic '{name}' ready", index=idx, ok=True, cards=cards)
+
+    topic_contents = await ai_engine.generate_content_for_topics_async(
+        [syllabus[i] for i in todo], on_topic_done=_persist
+    )
+
+    # 4. One transaction: the set's rows, card_count, the reusable material and the cleared staging area
+    if bulk:
+        insert_topic_contents(db, set_id, [staged[k] for k in sorted(staged, key=int)])
+        job.payload = {k: v for k, v in payload.items() if k != "staged"}
+
+    # Only complete, single-run generations are reused; a partial one would hide the missing topics forever
+    if not done and topic_contents and all(topic_contents):
+        db.add(models.GeneratedMaterial(
+            pdf_sha256=pdf_fingerprint,
+            text_sha256=text_fingerprint,
+            syllabus=syllabus,
+            topic_contents=topic_contents
+        ))
+
+    db.commit()
+    study_set = db.get(models.StudySet, set_id)
+    db.refresh(study_set)
+    _prefill_pools(db, set_id)
+    return {"set_id": set_id, "cards_created": study_set.card_count or 0, "reused": False}
+
+def _prefill_pools(db: Session, set_id: int):
+    if warm_pool.POOL_PREFILL_ON_GENERATE:
+        warm_pool.schedule_refill(db, warm_pool.QUIZ, set_id)
+        warm_pool.schedule_refill(db, warm_pool.ARENA, set_id)
+
+# --- Interactive AI work (run inline by the API or by a worker in queue mode) ---
+def _replace_quiz(db: Session, set_id: int, questions: list):
+    db.query(models.QuizQuestion).filter(models.QuizQuestion.set_id == set_id).delete()
+    for q in questions:
+        db.add(models.QuizQuestion(
+            set_id=set_id,
+            question=q["question"],
+            options=q["options"],
+            correct_answer=q["correct_answer"],
+            tag=q.get("tag") or "Generated"
+        ))
+
+def quiz_from_pool(db: Session, set_id: int, num_questions: int = 5) -> int:
+    """Replaces the set's quiz with pooled questions if a full quiz is ready. Returns the count (0 = pool miss)."""
+    rows = warm_pool.pop(db, warm_pool.QUIZ, set_id, num_questions, exact=True)
+    if not rows:
+        return 0
+    _replace_quiz(db, set_id, [
+        {"question": r.question, "options": r.options, "correct_answer": r.correct_answer, "tag": r.tag} for r in rows
+    ])
+    db.commit()
+    return len(rows)
+
+def arena_scenario_from_pool(db: Session, set_id: int):
+    rows = warm_pool.pop(db, warm_pool.ARENA, set_id, 1)
+    if not rows:
+        return None
+    return {"scenario": rows[0].scenario, "ideal_response": rows[0].ideal_response, "meta": rows[0].meta or {}}
+
+def arena_session_from_pool(db: Session, session_row, num_questions: int) -> list:
+    """Fills an arena session from the pool as far as it goes. Returns the saved questions (possibly fewer than asked)."""
+    rows = warm_pool.pop(db, warm_pool.ARENA, session_row.set_id, num_questions)
+    saved = []
+    for row in rows:
+        qrow = models.ArenaSessionQuestion(
+            session_id=session_row.id, set_id=session_row.set_id,
+            question_text=row.scenario or "", ideal_response=row.ideal_response or "",
+            question_meta=row.meta or {}, created_at=datetime.utcnow()
+        )
+        db.add(qrow)
+        saved.append(qrow)
+    db.commit()
+    return [{"id": q.id, "question_text": q.question_text, "ideal_response": q.ideal_response, "meta": q.question_meta} for q in saved]
+
+async def regenerate_quiz_for_set(db: Session, set_id: int, num_questions: int = 5) -> int:
+    context_text = warm_pool.quiz_context(db, set_id)
+    if not context_text:
+        raise jobs.PermanentJobError("No flashcards available to generate quiz from.")
+
+    # A regeneration must replace the current quiz, not replay the cached answer for the same context
+    new_questions_data = await ai_engine.generate_quiz_from_context_async(context_text, num_questions=num_questions, use_cache=False)
+    if not new_questions_data:
+        raise RuntimeError("AI failed to generate quiz")
+
+    # Replace old questions
+    _replace_quiz(db, set_id, new_questions_data)
+    db.commit()
+    return len(new_questions_data)
+
+async def generate_arena_session(db: Session, session_id: int, num_questions: int) -> list:
+    session_row = db.get(models.ArenaSession, session_id)
+    if session_row is None:
+        raise jobs.PermanentJobError("Arena session not found")
+    study_set = db.get(models.StudySet, session_row.set_id)
+
+    generation_kwargs = {"temperature": 0.8, "top_p": 0.95, "random_seed": str(uuid4()), "num_questions": max(1, min(10, num_questions))}
+    generated = await ai_engine.generate_arena_questions_for_set_async(study_set, generation_kwargs)
+
+    saved_questions = []
+    for item in generated:
+        qrow = models.ArenaSessionQuestion(
+            session_id=session_row.id, set_id=session_row.set_id,
+            question_text=item.get("scenario") or item.get("question") or "",
+            ideal_response=item.get("ideal_response") or item.get("answer") or "",
+            question_meta=item.get("meta", {}),
+            created_at=datetime.utcnow()
+        )
+        db.add(qrow)
+        saved_questions.append(qrow)
+    db.commit()
+    return [{"id": q.id, "question_text": q.question_text, "ideal_response": q.ideal_response, "meta": q.question_meta} for q in saved_questions]
+
+async def grade_submission(db: Session, challenge_id: int, user_response: str) -> dict:
+    challenge = db.query(models.ArenaChallenge).filter(models.ArenaChallenge.id == challenge_id).first()
+    scenario_text = challenge.scenario if challenge else "General Context"
+    grading_result = await ai_engine.grade_arena_submission_async(scenario_text, user_response)
+    return {
+        "status": "success",
+        "ai_score": grading_result.get("score", 0),
+        "ai_feedback": grading_result.get("feedback", "No feedback.")
+    }
+
+@jobs.register("regenerate_quiz")
+async def regenerate_quiz_job(db: Session, job) -> dict:
+    count = await regenerate_quiz_for_set(db, job.set_id, (job.payload or {}).get("num_questions", 5))
+    return {"message": "Quiz regenerated successfully", "count": count}
+
+@jobs.register("arena_session")
+async def arena_session_job(db: Session, job) -> dict:
+    payload = job.payload or {}
+    questions = await generate_arena_session(db, payload["session_id"], payload.get("num_questions", 1))
+    return {"session_id": payload["session_id"], "questions": questions}
+
+@jobs.register("grade_arena")
+async def grade_arena_job(db: Session, job) -> dict:
+    payload = job.payload or {}
+    return await grade_submission(db, payload.get("challenge_id"), payload.get("user_response", ""))
+
+@jobs.register("refill_pool")
+async def refill_pool_job(db: Session, job) -> dict:
+    kind = (job.payload or {}).get("kind")
+    if kind not in (warm_pool.ARENA, warm_pool.QUIZ):
+        raise jobs.PermanentJobError(f"Unknown pool kind '{kind}'")
+    return {"kind": kind, "added": await warm_pool.refill(db, kind, job.set_id)}
@@ -0,0 +1,461 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from dotenv import load_dotenv
+
+# --- Config ---
+load_dotenv()
+LLM_RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# The project's quota at the model API
+LLM_RPM = float(os.getenv("LLM_RPM", "60"))
+LLM_TPM = float(os.getenv("LLM_TPM", "1000000"))
+# "shared": the budgets and the 429 cool-down live in the llm_quota table, so every API and worker process
+# on the database spends one quota. "process": in memory, each process gets 1/LLM_QUOTA_PROCESSES of it
+# (also the fallback when the table can't be reached).
+LLM_QUOTA_SCOPE = os.getenv("LLM_QUOTA_SCOPE", "shared").lower()
+LLM_QUOTA_PROCESSES = max(1, int(os.getenv("LLM_QUOTA_PROCESSES", "1")))
+# llm_quota row of this deployment (apps with different API keys may share a database)
+LLM_QUOTA_KEY = os.getenv("LLM_QUOTA_KEY", "default")
+# Lost compare-and-swap races on the row before a call falls back to this process's share
+LLM_QUOTA_CAS_RETRIES = int(os.getenv("LLM_QUOTA_CAS_RETRIES", "8"))
+# Output tokens assumed for a call until the real usage is known
+LLM_EST_OUTPUT_TOKENS = int(os.getenv("LLM_EST_OUTPUT_TOKENS", "1024"))
+# Longest a waiter sleeps before re-checking the buckets itself
+LLM_SCHEDULER_POLL_S = float(os.getenv("LLM_SCHEDULER_POLL_S", "0.5"))
+
+# Priority classes, highest first. Interactive calls (grading, quiz regeneration, arena sessions)
+# are always admitted before bulk PDF generation that is waiting on the same budget.
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITY_CLASSES = (INTERACTIVE, BULK)
+
+def estimate_tokens(prompt: str, generation_config: dict = None) -> int:
+    """Rough prompt + output size (~4 characters per token), corrected once the response arrives."""
+    output = (generation_config or {}).get("max_output_tokens") or LLM_EST_OUTPUT_TOKENS
+    return len(prompt or "") // 4 + int(output)
+
+def jittered(delay: float) -> float:
+    return delay * random.uniform(0.5, 1.5)
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute / 60` units per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, float(per_minute))
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # A single call larger than the whole budget waits for a full bucket rather than forever
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+    def correct(self, amount: float):
+        """Charges (positive) or refunds (negative) `amount` after the fact."""
+        if amount < 0:
+            self.give_back(-amount)
+        else:
+            self.level -= amount
+
+class _LocalBudget:
+    """RPM and TPM buckets in process memory."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self._lock = threading.Lock()
+
+    def take(self, tokens: int) -> float:
+        """Takes one request and `tokens` if both fit now (returns 0), else returns the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            delay = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if delay > 0:
+                return delay
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            return 0.0
+
+    def correct(self, tokens: float):
+        with self._lock:
+            self.tokens.correct(tokens)
+
+    def cool_down(self, until: float):
+        pass  # the scheduler keeps the process-local cool-down itself
+
+    def levels(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {"requests_available": round(self.requests.level, 2), "tokens_available": round(self.tokens.level)}
+
+class QuotaBusy(Exception):
+    """The llm_quota row kept changing under us (LLM_QUOTA_CAS_RETRIES lost races in a row)."""
+
+class _SharedBudget:
+    """
+    The same buckets, plus the 429 cool-down, in one llm_quota row shared by every process on the database.
+    Each change reads the row and writes it back with an UPDATE guarded on its version, retried with a short
+    jittered backoff when another process got there first (the lease pattern of jobs.py). Times are
+    wall-clock epoch seconds. Token corrections are held back and written with the next take, so
+    reconcile() never touches the database. Safe to call from several threads at once.
+    """
+
+    def __init__(self, rpm: float, tpm: float, key: str = LLM_QUOTA_KEY):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.key = key
+        self._pending = 0.0
+        self._pending_lock = threading.Lock()
+
+    def _table(self):
+        # Imported late: ai_engine (and so this module) is also used by scripts without a database
+        try:
+            from app import models
+        except ImportError:
+            import models
+        return models.LlmQuota.__table__
+
+    def _engine(self):
+        try:
+            from app import database
+        except ImportError:
+            import database
+        return database.engine
+
+    def _load(self, row, now: float) -> tuple:
+        """(requests, tokens) buckets holding the row's levels, refilled up to `now`."""
+        buckets = (_Bucket(self.rpm), _Bucket(self.tpm))
+        for bucket, level in zip(buckets, (row.requests, row.tokens)):
+            bucket.level = level
+            bucket.updated = min(row.refilled_at, now)  # clocks of other hosts may run ahead
+            bucket.refill(now)
+        return buckets
+
+    def _change(self, fn):
+        """
+        Runs fn(row, now, requests, tokens) -> (new cool-down or None to write nothing, result) atomically
+        and returns the result. Raises QuotaBusy after LLM_QUOTA_CAS_RETRIES lost races.
+        """
+        table = self._table()
+        engine = self._engine()
+        for attempt in range(LLM_QUOTA_CAS_RETRIES):
+            if attempt:
+                time.sleep(random.uniform(0, 0.005 * 2 ** min(attempt, 6)))
+            with engine.begin() as conn:
+                row = conn.execute(select(table).where(table.c.key == self.key)).first()
+                now = time.time()
+                if row is not None:
+                    requests, tokens = self._load(row, now)
+                    cooldown, result = fn(row, now, requests, tokens)
+                    if cooldown is None:
+                        return result
+                    written = conn.execute(update(table).where(table.c.key == self.key, table.c.version == row.version).values(
+                        requests=requests.level, tokens=tokens.level, refilled_at=now,
+                        cooldown_until=cooldown, version=row.version + 1,
+                    )).rowcount
+                    if written:
+                        return result
+                    continue
+            try:
+                with engine.begin() as conn:
+                    conn.execute(table.insert().values(
+                        key=self.key, requests=max(1.0, self.rpm), tokens=max(1.0, self.tpm),
+                        refilled_at=time.time(), cooldown_until=0.0, version=0,
+                    ))
+            except IntegrityError:
+                pass  # another process created it first
+        raise QuotaBusy(f"llm_quota row '{self.key}' is contended")
+
+    def take(self, tokens: int) -> float:
+        with self._pending_lock:
+            pending = self._pending
+
+        def _take(row, now, requests, bucket):
+            delay = max(row.cooldown_until - now, requests.wait_time(1), bucket.wait_time(tokens))
+            if delay > 0:
+                return None, delay
+            requests.take(1)
+            bucket.take(tokens)
+            bucket.correct(pending)
+            return row.cooldown_until, 0.0
+
+        delay = self._change(_take)
+        if delay == 0:
+            with self._pending_lock:
+                self._pending -= pending
+        return delay
+
+    def correct(self, tokens: float):
+        with self._pending_lock:
+            self._pending += tokens
+
+    def cool_down(self, until: float):
+        """Publishes a cool-down ending at monotonic time `until` to every process."""
+        wall = time.time() + until - time.monotonic()
+        self._change(lambda row, now, *_: (wall, None) if wall > row.cooldown_until else (None, None))
+
+    def levels(self) -> dict:
+        def _read(row, now, requests, tokens):
+            return None, {
+                "requests_available": round(requests.level, 2),
+                "tokens_available": round(tokens.level),
+                "shared_cooldown_s": round(max(0.0, row.cooldown_until - now), 2),
+            }
+        return self._change(_read)
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "enqueued", "granted", "cancelled", "wake")
+
+    def __init__(self, priority: str, tokens: int, wake):
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.wake = wake
+
+class Slot:
+    """Admission ticket for one model call; report real usage with `used()` so the TPM bucket stays honest."""
+
+    def __init__(self, scheduler, tokens: int):
+        self.scheduler = scheduler
+        self.tokens = tokens
+
+    def used(self, actual_tokens: int):
+        if actual_tokens and self.scheduler:
+            self.scheduler.reconcile(self.tokens, actual_tokens)
+            self.tokens = actual_tokens
+
+class RateScheduler:
+    """
+    Admission control for model calls: a requests-per-minute and a tokens-per-minute budget (shared
+    by all processes, or this process's share, see LLM_QUOTA_SCOPE), a priority queue of this process's
+    waiters (strict priority, FIFO within a class) and a cool-down that every caller honours after a 429.
+    Works for both threads and asyncio tasks.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, scope: str = LLM_QUOTA_SCOPE):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._local = _LocalBudget(rpm / LLM_QUOTA_PROCESSES, tpm / LLM_QUOTA_PROCESSES)
+        self._shared = _SharedBudget(rpm, tpm) if scope == "shared" else None
+        self._shared_error = None
+        # Publishes 429 cool-downs to the llm_quota row without making the throttled caller wait for it
+        self._publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-quota") if self._shared else None
+        self._lock = threading.Lock()  # the queue and counters; never held across a budget call
+        self._dispatching = threading.Lock()
+        self._heap = []  # (class rank, seq, waiter)
+        self._seq = itertools.count()
+        self._cooldown_until = 0.0
+        self._waits = {p: deque(maxlen=1000) for p in PRIORITY_CLASSES}
+        self.counters = {p: {"admitted": 0, "wait_s_total": 0.0, "wait_s_max": 0.0} for p in PRIORITY_CLASSES}
+        self.throttled = 0
+        self.tokens_used = 0
+
+    # --- scheduling core ---
+    def _budget(self, action, *args):
+        """Runs `action` on the shared budget, or on this process's share while the database is unreachable."""
+        if self._shared is not None:
+            try:
+                result = getattr(self._shared, action)(*args)
+                if self._shared_error is not None:
+                    print("✅ Shared LLM quota reachable again.")
+                    self._shared_error = None
+                return result
+            except (SQLAlchemyError, QuotaBusy, ImportError, ValueError) as e:
+                if self._shared_error is None:
+                    print(f"⚠️ Shared LLM quota unavailable, using this process's share (1/{LLM_QUOTA_PROCESSES}): {e}")
+                self._shared_error = str(e)
+        return getattr(self._local, action)(*args)
+
+    def _push(self, waiter):
+        rank = PRIORITY_CLASSES.index(waiter.priority) if waiter.priority in PRIORITY_CLASSES else len(PRIORITY_CLASSES)
+        heapq.heappush(self._heap, (rank, next(self._seq), waiter))
+
+    def _head(self):
+        """The next waiter to admit, or None (call with the lock held)."""
+        while self._heap:
+            waiter = self._heap[0][2]
+            if not (waiter.cancelled or waiter.granted):
+                return waiter
+            heapq.heappop(self._heap)
+        return None
+
+    def _dispatch(self):
+        """
+        Admits waiters from the head of the queue while the budgets allow; returns seconds until the next
+        could go. One thread dispatches at a time and the queue lock is not held during the budget take
+        (a database round trip with the shared scope). A thread that finds a dispatch under way returns
+        None and re-polls; the dispatching thread wakes every waiter it admits.
+        """
+        if not self._dispatching.acquire(blocking=False):
+            return None
+        try:
+            while True:
+                with self._lock:
+                    waiter = self._head()
+                    if waiter is None:
+                        return None
+                    delay = self._cooldown_until - time.monotonic()
+                if delay <= 0:
+                    delay = self._budget("take", waiter.tokens)
+                if delay > 0:
+                    return delay
+                with self._lock:
+                    given_up = waiter.cancelled
+                    if not given_up:
+                        waiter.granted = True
+                        self._record(waiter, time.monotonic())
+                if given_up:
+                    # The caller left while its budget was being taken: hand the tokens back
+                    self._budget("correct", -waiter.tokens)
+                    continue
+                waiter.wake()
+        finally:
+            self._dispatching.release()
+
+    def _record(self, waiter, now):
+        waited = now - waiter.enqueued
+        stats = self.counters.setdefault(waiter.priority, {"admitted": 0, "wait_s_total": 0.0, "wait_s_max": 0.0})
+        stats["admitted"] += 1
+        stats["wait_s_total"] += waited
+        stats["wait_s_max"] = max(stats["wait_s_max"], waited)
+        self._waits.setdefault(waiter.priority, deque(maxlen=1000)).append(waited)
+
+    def _poll_delay(self, delay):
+        return min(delay, LLM_SCHEDULER_POLL_S) if delay else LLM_SCHEDULER_POLL_S
+
+    async def _dispatch_async(self):
+        # With the shared budget a dispatch is a database round trip: keep it off the event loop
+        if self._shared is None:
+            return self._dispatch()
+        return await asyncio.to_thread(self._dispatch)
+
+    # --- public API ---
+    def acquire(self, priority: str = BULK, tokens: int = 1):
+        """Blocks the calling thread until the call may be sent."""
+        event = threading.Event()
+        waiter = _Waiter(priority, tokens, event.set)
+        with self._lock:
+            self._push(waiter)
+        delay = self._dispatch()
+        while not waiter.granted:
+            event.wait(self._poll_delay(delay))
+            delay = self._dispatch()
+
+    async def acquire_async(self, priority: str = BULK, tokens: int = 1):
+        """Waits without blocking the event loop; wake-ups may come from other threads."""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def _wake():
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(True))
+
+        waiter = _Waiter(priority, tokens, _wake)
+        with self._lock:
+            self._push(waiter)
+        try:
+            delay = await self._dispatch_async()
+            while not waiter.granted:
+                try:
+                    await asyncio.wait_for(asyncio.shield(ready), self._poll_delay(delay))
+                except asyncio.TimeoutError:
+                    pass
+                delay = await self._dispatch_async()
+        finally:
+            with self._lock:
+                if not waiter.granted:
+                    waiter.cancelled = True
+
+    def reconcile(self, estimated: int, actual: int):
+        """Corrects the TPM bucket once the real token count of a call is known."""
+        with self._lock:
+            self.tokens_used += actual
+        self._budget("correct", actual - estimated)
+        if self._shared is None:
+            # A refund may let the next waiter in (the shared budget applies it at the next take)
+            self._dispatch()
+
+    def throttle(self, delay: float):
+        """
+        A 429 came back: nobody sends anything for `delay` seconds, in this process at once and (shared
+        scope) in every other once the background publisher has written the cool-down to llm_quota.
+        """
+        with self._lock:
+            self.throttled += 1
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+            until = self._cooldown_until
+        if self._publisher is not None:
+            self._publisher.submit(self._budget, "cool_down", until)
+
+    def stats(self) -> dict:
+        levels = self._budget("levels")
+        with self._lock:
+            now = time.monotonic()
+            waiting = {p: 0 for p in PRIORITY_CLASSES}
+            for _, _, w in self._heap:
+                if not (w.cancelled or w.granted):
+                    waiting[w.priority] = waiting.get(w.priority, 0) + 1
+            classes = {}
+            for p, stats in self.counters.items():
+                recent = sorted(self._waits.get(p, ()))
+                classes[p] = {
+                    **stats,
+                    "waiting": waiting.get(p, 0),
+                    "wait_s_p50": round(recent[len(recent) // 2], 4) if recent else 0.0,
+                    "wait_s_p99": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 4) if recent else 0.0,
+                }
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "scope": "process" if self._shared is None or self._shared_error else "shared",
+                "processes": LLM_QUOTA_PROCESSES,
+                **levels,
+                "tokens_used": self.tokens_used,
+                "throttled": self.throttled,
+                "cooldown_s": round(max(0.0, self._cooldown_until - now), 2),
+                "classes": classes,
+            }
+
+# Process-wide scheduler used by ai_engine
+SCHEDULER = RateScheduler() if LLM_RATE_LIMIT_ENABLED else None
+
+@contextmanager
+def slot(priority: str = BULK, tokens: int = 1):
+    if SCHEDULER is not None:
+        SCHEDULER.acquire(priority, tokens)
+    yield Slot(SCHEDULER, tokens)
+
+@asynccontextmanager
+async def aslot(priority: str = BULK, tokens: int = 1):
+    if SCHEDULER is not None:
+        await SCHEDULER.acquire_async(priority, tokens)
+    yield Slot(SCHEDULER, tokens)
+
+def throttle(delay: float):
+    if SCHEDULER is not None:
+        SCHEDULER.throttle(delay)
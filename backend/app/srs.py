@@ -0,0 +1,310 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import func, literal, case, or_, extract, DateTime
+from dotenv import load_dotenv
+
+try:
+    from app import models
+except ImportError:
+    import models
+
+# --- Config ---
+load_dotenv()
+# Load balancing: move each next review to the least busy day (per the user's due histogram) within a
+# window around the SM-2 date, so cards learned together don't all come due together
+SRS_LOAD_BALANCE = os.getenv("SRS_LOAD_BALANCE", "false").lower() in ("1", "true", "yes")
+# Half-width of the window as a fraction of the interval, capped; intervals below the minimum stay exact
+SRS_LOAD_BALANCE_FRACTION = float(os.getenv("SRS_LOAD_BALANCE_FRACTION", "0.1"))
+SRS_LOAD_BALANCE_MAX_DAYS = int(os.getenv("SRS_LOAD_BALANCE_MAX_DAYS", "7"))
+SRS_LOAD_BALANCE_MIN_INTERVAL = float(os.getenv("SRS_LOAD_BALANCE_MIN_INTERVAL", "3"))
+# Scheduler for users without an srs_settings row: "sm2" or "fsrs"
+SRS_DEFAULT_SCHEDULER = os.getenv("SRS_DEFAULT_SCHEDULER", "sm2").lower()
+SRS_DEFAULT_RETENTION = float(os.getenv("SRS_DEFAULT_RETENTION", "0.9"))
+SCHEDULERS = ("sm2", "fsrs")
+
+# Button -> SM-2 quality (0-5): again=0, hard=3, good=4, easy=5
+QUALITY = {"again": 0, "hard": 3, "good": 4, "easy": 5}
+MIN_EASE_FACTOR = 1.3
+
+def quality(difficulty: str) -> int:
+    return QUALITY.get(difficulty, 4)
+
+def sm2(repetition_number: int, ease_factor: float, interval: float, q: int) -> tuple:
+    """One SM-2 step. Returns the new (repetition_number, ease_factor, interval in days)."""
+    repetition_number = repetition_number or 0
+    ease_factor = ease_factor or 2.5
+    interval = interval or 0.0
+    if q < 3:  # "Again" - Reset progress
+        return 0, ease_factor, 1
+    if repetition_number == 0:
+        interval = 1
+    elif repetition_number == 1:
+        interval = 6
+    else:
+        interval = int(interval * ease_factor)
+    # EF' = EF + (0.1 - (5-q) * (0.08 + (5-q)*0.02))
+    ease_factor = max(MIN_EASE_FACTOR, ease_factor + (0.1 - (5 - q) * (0.08 + (5 - q) * 0.02)))
+    return repetition_number + 1, ease_factor, interval
+
+# Scheduling columns of a Flashcard that review() reads and writes
+CARD_FIELDS = ("repetition_number", "ease_factor", "interval", "next_review_date", "last_review_date",
+               "fsrs_stability", "fsrs_difficulty")
+
+# Button -> FSRS rating
+RATING = {"again": 1, "hard": 2, "good": 3, "easy": 4}
+
+def rating(difficulty: str) -> int:
+    return RATING.get(difficulty, 3)
+
+def is_stale(card: dict, reviewed_at: datetime) -> bool:
+    """True if `reviewed_at` is before the card's last review: applying it would rewind the schedule."""
+    last = card.get("last_review_date")
+    return last is not None and reviewed_at < last
+
+def elapsed_days(card: dict, reviewed_at: datetime):
+    """Days since the card's previous review, or None before its first one."""
+    last = card.get("last_review_date")
+    return max(0.0, (reviewed_at - last).total_seconds() / 86400) if last else None
+
+def review(card: dict, difficulty: str, reviewed_at: datetime, settings: dict = None) -> dict:
+    """
+    Applies one rating to `card` ({"repetition_number", "ease_factor", "interval", "next_review_date",
+    "last_review_date", "fsrs_stability", "fsrs_difficulty"}) in place and returns it. The next review
+    is counted from `reviewed_at`. The FSRS memory state is updated under either scheduler, so a user
+    can switch at any time; `settings` (see scheduler_settings) decides which one sets the interval
+    (in days, a float like the column, whichever scheduler set it).
+    """
+    settings = settings or scheduler_settings()
+    elapsed = elapsed_days(card, reviewed_at)
+    g = rating(difficulty)
+    card["fsrs_stability"], card["fsrs_difficulty"] = fsrs_step(
+        settings["params"], card.get("fsrs_stability"), card.get("fsrs_difficulty"), elapsed, g
+    )
+    card["repetition_number"], card["ease_factor"], sm2_interval = sm2(
+        card.get("repetition_number"), card.get("ease_factor"), card.get("interval"), quality(difficulty)
+    )
+    if settings["scheduler"] == "fsrs":
+        card["interval"] = float(fsrs_interval(card["fsrs_stability"], settings["retention"]))
+    else:
+        card["interval"] = float(sm2_interval)
+    card["last_review_date"] = reviewed_at
+    card["next_review_date"] = reviewed_at + timedelta(days=card["interval"])
+    return card
+
+def balance_window(interval: float) -> int:
+    """Days the next review may move either way: 1 for short intervals, growing with the interval."""
+    if not SRS_LOAD_BALANCE or (interval or 0) < SRS_LOAD_BALANCE_MIN_INTERVAL:
+        return 0
+    return int(min(SRS_LOAD_BALANCE_MAX_DAYS, max(1, round(interval * SRS_LOAD_BALANCE_FRACTION))))
+
+def balance_range(cards: list) -> tuple:
+    """(first, last) moment any of the cards may be moved to; the span of due histogram to load."""
+    spans = [(c["next_review_date"], balance_window(c["interval"])) for c in cards]
+    return (min(d - timedelta(days=w) for d, w in spans), max(d + timedelta(days=w) for d, w in spans))
+
+def rebalance(card: dict, load: dict) -> dict:
+    """
+    Moves card["next_review_date"] by whole days to the day with the fewest due cards in its window
+    (ties: closest to the SM-2 date, earlier first) and counts the card in `load` ({date: due cards}).
+    """
+    due, window = card["next_review_date"], balance_window(card["interval"])
+    if window:
+        offsets = sorted(range(-window, window + 1), key=abs)
+        best = min(offsets, key=lambda k: (load.get((due + timedelta(days=k)).date(), 0), abs(k)))
+        card["next_review_date"] = due + timedelta(days=best)
+    day = card["next_review_date"].date()
+    load[day] = load.get(day, 0) + 1
+    return card
+
+# --- FSRS (Free Spaced Repetition Scheduler, v4.5 memory model) ---
+# Default weights, fitted by the FSRS project on a large public review corpus; optimize_srs.py fits per-user ones
+FSRS_DEFAULT_PARAMS = (0.4072, 1.1829, 3.1262, 15.4722, 7.2102, 0.5316, 1.0651, 0.0234, 1.616,
+                       0.1544, 1.0824, 1.9813, 0.0953, 0.2975, 2.2042, 0.2407, 2.9466)
+FSRS_DECAY = -0.5
+FSRS_FACTOR = 0.9 ** (1 / FSRS_DECAY) - 1  # 19/81: R(t = S) = 90%
+FSRS_MAX_INTERVAL = int(os.getenv("FSRS_MAX_INTERVAL", "36500"))
+
+def _w(w: np.ndarray, i: int):
+    # One weight; with a (P, 17) stack of parameter sets, a (P, 1) column that broadcasts over cards
+    return w[i] if w.ndim == 1 else w[:, i, None]
+
+def fsrs_retrievability(elapsed, stability):
+    """Probability of recall `elapsed` days after a review, for a memory of this stability."""
+    return (1 + FSRS_FACTOR * elapsed / stability) ** FSRS_DECAY
+
+def fsrs_init(w: np.ndarray, g):
+    """(stability, difficulty) after a card's first rating `g`."""
+    stability = np.take(w, np.asarray(g).astype(np.int64) - 1, axis=-1)
+    difficulty = np.clip(_w(w, 4) - _w(w, 5) * (g - 3), 1, 10)
+    return stability, difficulty
+
+def fsrs_next(w: np.ndarray, stability, difficulty, retrievability, g):
+    """(stability, difficulty) after rating `g` at the given recall probability."""
+    recall = stability * (1 + np.exp(_w(w, 8)) * (11 - difficulty) * stability ** -_w(w, 9)
+                          * (np.exp(_w(w, 10) * (1 - retrievability)) - 1)
+                          * np.where(g == 2, _w(w, 15), 1.0) * np.where(g == 4, _w(w, 16), 1.0))
+    forget = _w(w, 11) * difficulty ** -_w(w, 12) * ((stability + 1) ** _w(w, 13) - 1) \
+        * np.exp(_w(w, 14) * (1 - retrievability))
+    new_stability = np.where(g == 1, np.minimum(forget, stability), recall)
+    # Difficulty moves with the rating and reverts towards the difficulty of an "easy" first rating
+    moved = difficulty - _w(w, 6) * (g - 3)
+    new_difficulty = _w(w, 7) * (_w(w, 4) - _w(w, 5)) + (1 - _w(w, 7)) * moved
+    return np.clip(new_stability, 0.01, FSRS_MAX_INTERVAL), np.clip(new_difficulty, 1, 10)
+
+def fsrs_step(params, stability, difficulty, elapsed, g: int) -> tuple:
+    """One rating of one card. `stability` None (never reviewed under FSRS) starts a new memory."""
+    w = np.asarray(params, dtype=np.float64)
+    if stability is None or difficulty is None or elapsed is None:
+        s, d = fsrs_init(w, g)
+    else:
+        s, d = fsrs_next(w, stability, difficulty, fsrs_retrievability(elapsed, stability), g)
+    return float(s), float(d)
+
+def fsrs_interval(stability: float, retention: float) -> int:
+    """Whole days until recall probability falls to `retention`."""
+    days = stability / FSRS_FACTOR * (retention ** (1 / FSRS_DECAY) - 1)
+    return int(min(FSRS_MAX_INTERVAL, max(1, round(days))))
+
+def scheduler_settings(row=None) -> dict:
+    """{"scheduler", "retention", "params"} from a user's SrsSettings row (None: the defaults)."""
+    if row is None:
+        return {"scheduler": SRS_DEFAULT_SCHEDULER, "retention": SRS_DEFAULT_RETENTION, "params": FSRS_DEFAULT_PARAMS}
+    return {
+        "scheduler": row.scheduler or SRS_DEFAULT_SCHEDULER,
+        "retention": row.desired_retention or SRS_DEFAULT_RETENTION,
+        "params": tuple(row.fsrs_params or FSRS_DEFAULT_PARAMS),
+    }
+
+def utc_naive(moment: datetime = None, now: datetime = None) -> datetime:
+    """Client timestamps as naive UTC (like every DateTime column here), never later than now."""
+    now = now or datetime.utcnow()
+    if moment is None:
+        return now
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, now)
+
+# --- Vectorized engine (forecasts) ---
+# Answer mix used when the caller doesn't give one: P(again), P(hard), P(good), P(easy)
+DEFAULT_ANSWER_PROBS = (0.1, 0.15, 0.6, 0.15)
+_QUALITIES = np.array([QUALITY["again"], QUALITY["hard"], QUALITY["good"], QUALITY["easy"]], dtype=np.int8)
+
+def sm2_arrays(repetition_number: np.ndarray, ease_factor: np.ndarray, interval: np.ndarray, q: np.ndarray) -> tuple:
+    """sm2() over arrays, one element per card; same results as the scalar version."""
+    fail = q < 3
+    interval = np.where(repetition_number == 0, 1.0, np.where(repetition_number == 1, 6.0, np.floor(interval * ease_factor)))
+    d = 5 - q
+    grown = np.maximum(MIN_EASE_FACTOR, ease_factor + (0.1 - d * (0.08 + d * 0.02)))
+    return (
+        np.where(fail, 0, repetition_number + 1),
+        np.where(fail, ease_factor, grown),
+        np.where(fail, 1.0, interval),
+    )
+
+def _days_after(dialect: str, moment, today: datetime):
+    """SQL for the (fractional) days from `today` to the `moment` column; negative in the past, NULL for NULL."""
+    start = literal(today, DateTime())
+    if dialect == "postgresql":
+        return extract("epoch", moment - start) / 86400.0
+    if dialect == "sqlite":
+        return func.julianday(moment) - func.julianday(start)
+    raise NotImplementedError(f"card_columns needs date arithmetic; not available for {dialect}")
+
+def card_columns(dialect: str, now: datetime = None, scheduler: str = "sm2") -> list:
+    """
+    Flashcard columns forecast() simulates, as plain numbers computed by the database: the scalar
+    defaults for NULLs and dates as days from today (UTC). "fsrs" adds the memory state; a stability
+    of 0 marks a card FSRS hasn't seen yet (like fsrs_step's None).
+    """
+    now = now or datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    card = models.Flashcard
+    columns = [
+        func.coalesce(card.repetition_number, 0),
+        func.coalesce(func.nullif(card.ease_factor, 0), 2.5),
+        func.coalesce(card.interval, 0.0),
+        func.coalesce(_days_after(dialect, card.next_review_date, today), 0.0),
+    ]
+    if scheduler == "fsrs":
+        unseen = or_(card.fsrs_stability.is_(None), card.fsrs_difficulty.is_(None), card.last_review_date.is_(None))
+        columns += [
+            case((unseen, 0.0), else_=card.fsrs_stability),
+            case((unseen, 0.0), else_=card.fsrs_difficulty),
+            func.coalesce(_days_after(dialect, card.last_review_date, today), 0.0),
+        ]
+    return columns
+
+_CARD_DTYPE = [("repetition_number", np.int32), ("ease_factor", np.float64), ("interval", np.float64),
+               ("due_day", np.float64)]
+_FSRS_CARD_DTYPE = _CARD_DTYPE + [("fsrs_stability", np.float64), ("fsrs_difficulty", np.float64),
+                                  ("last_day", np.float64)]
+
+def card_arrays(result, scheduler: str = "sm2") -> dict:
+    """
+    Column arrays from a Core result of select(*card_columns(...)), read straight off the DBAPI cursor
+    (no Row objects). `due_day` is whole days from today; overdue and new cards are due on day 0.
+    """
+    try:
+        data = np.fromiter(result.cursor, dtype=_FSRS_CARD_DTYPE if scheduler == "fsrs" else _CARD_DTYPE)
+    finally:
+        result.close()
+    cards = {name: np.ascontiguousarray(data[name]) for name in data.dtype.names}
+    cards["due_day"] = np.maximum(np.floor(cards["due_day"]), 0).astype(np.int32)
+    return cards
+
+def fsrs_intervals(stability: np.ndarray, retention: float) -> np.ndarray:
+    """fsrs_interval() over an array of stabilities."""
+    days = stability / FSRS_FACTOR * (retention ** (1 / FSRS_DECAY) - 1)
+    return np.clip(np.rint(days), 1, FSRS_MAX_INTERVAL)
+
+def forecast(cards: dict, days: int = 90, answer_probs=DEFAULT_ANSWER_PROBS, runs: int = 1, seed: int = None,
+             settings: dict = None) -> np.ndarray:
+    """
+    Simulates `days` days of reviews: every day each due card is answered with a rating drawn from
+    `answer_probs` and rescheduled by the scheduler in `settings` (see scheduler_settings; FSRS needs
+    the card_arrays of its scheduler). Returns the expected number of reviews per day
+    (the mean over `runs` simulations).
+    """
+    settings = settings or scheduler_settings()
+    use_fsrs = settings["scheduler"] == "fsrs"
+    if use_fsrs and "fsrs_stability" not in cards:
+        raise ValueError("an FSRS forecast needs card_arrays(..., scheduler=\"fsrs\")")
+    w = np.asarray(settings["params"], dtype=np.float64)
+    probs = np.asarray(answer_probs, dtype=np.float64)
+    probs = probs / probs.sum()
+    rng = np.random.default_rng(seed)
+    totals = np.zeros(days, dtype=np.float64)
+    for _ in range(max(1, runs)):
+        due_day = cards["due_day"].copy()
+        if use_fsrs:
+            stability = cards["fsrs_stability"].copy()
+            difficulty = cards["fsrs_difficulty"].copy()
+            last_day = cards["last_day"].copy()
+        else:
+            rep = cards["repetition_number"].copy()
+            ease = cards["ease_factor"].copy()
+            interval = cards["interval"].copy()
+        for day in range(days):
+            idx = np.flatnonzero(due_day == day)
+            if idx.size == 0:
+                continue
+            totals[day] += idx.size
+            answers = rng.choice(4, size=idx.size, p=probs)
+            if use_fsrs:
+                g = answers + 1
+                seen = stability[idx] > 0
+                # Unseen cards start a memory; the placeholder 1.0 only keeps fsrs_next finite for them
+                s = np.where(seen, stability[idx], 1.0)
+                d = np.where(seen, difficulty[idx], 1.0)
+                next_s, next_d = fsrs_next(w, s, d, fsrs_retrievability(np.maximum(0.0, day - last_day[idx]), s), g)
+                init_s, init_d = fsrs_init(w, g)
+                stability[idx] = np.where(seen, next_s, init_s)
+                difficulty[idx] = np.where(seen, next_d, init_d)
+                last_day[idx] = day
+                due_day[idx] = day + fsrs_intervals(stability[idx], settings["retention"]).astype(np.int32)
+            else:
+                rep[idx], ease[idx], interval[idx] = sm2_arrays(rep[idx], ease[idx], interval[idx], _QUALITIES[answers])
+                due_day[idx] = day + np.maximum(1, np.rint(interval[idx])).astype(np.int32)
+    return totals / max(1, runs)
@@ -0,0 +1,88 @@
+import os
+from itertools import groupby
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    from app import srs
+except ImportError:
+    import srs
+
+# --- Config ---
+load_dotenv()
+FSRS_EPOCHS = int(os.getenv("FSRS_EPOCHS", "150"))
+FSRS_LEARNING_RATE = float(os.getenv("FSRS_LEARNING_RATE", "0.05"))
+# Pull towards the default weights, worth this many reviews: small logs barely move the parameters
+FSRS_PRIOR_REVIEWS = float(os.getenv("FSRS_PRIOR_REVIEWS", "200"))
+# Reviews of one card beyond this are ignored (bounds the padded matrices)
+FSRS_MAX_SEQUENCE = int(os.getenv("FSRS_MAX_SEQUENCE", "128"))
+
+_EPS = 1e-3  # finite-difference step, in log-parameter space
+
+def sequences(rows) -> tuple:
+    """
+    Padded per-card review sequences from (card_id, reviewed_at, rating) rows sorted by card, then time.
+    Returns (ratings int8 [C, K], elapsed days [C, K], lengths [C]), cards sorted by length, longest first;
+    cards with a single review (nothing to predict) are dropped.
+    """
+    cards = []
+    for _, reviews in groupby(rows, key=lambda r: r[0]):
+        reviews = list(reviews)[:FSRS_MAX_SEQUENCE]
+        if len(reviews) >= 2:
+            cards.append(reviews)
+    cards.sort(key=len, reverse=True)
+    width = len(cards[0]) if cards else 0
+    ratings = np.zeros((len(cards), width), dtype=np.int8)
+    elapsed = np.zeros((len(cards), width), dtype=np.float64)
+    for i, reviews in enumerate(cards):
+        ratings[i, :len(reviews)] = [r[2] for r in reviews]
+        times = np.array([r[1] for r in reviews], dtype="datetime64[s]").astype(np.float64)
+        elapsed[i, 1:len(reviews)] = np.maximum(0.0, np.diff(times) / 86400)
+    return ratings, elapsed, np.array([len(c) for c in cards], dtype=np.int32)
+
+def batch_loss(W: np.ndarray, ratings: np.ndarray, elapsed: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Mean log loss of predicting recall (rating > 1) at every review after a card's first, for each of
+    the P parameter sets in W [P, 17] at once. The recurrence runs review by review, vectorized over
+    cards and parameter sets; cards are sorted longest first so step k only touches the first n_k rows.
+    """
+    stability, difficulty = srs.fsrs_init(W, ratings[:, 0].astype(np.float64))
+    total = np.zeros(W.shape[0])
+    for k in range(1, ratings.shape[1]):
+        n = int(np.count_nonzero(lengths > k))
+        g = ratings[:n, k].astype(np.float64)
+        s, d = stability[:, :n], difficulty[:, :n]
+        r = np.clip(srs.fsrs_retrievability(elapsed[:n, k], s), 1e-6, 1 - 1e-6)
+        recalled = g > 1
+        total += -np.where(recalled, np.log(r), np.log(1 - r)).sum(axis=1)
+        stability[:, :n], difficulty[:, :n] = srs.fsrs_next(W, s, d, r, g)
+    return total / max(1, int(lengths.sum() - lengths.size))
+
+def fit(ratings: np.ndarray, elapsed: np.ndarray, lengths: np.ndarray, init=None, epochs: int = FSRS_EPOCHS) -> dict:
+    """
+    Fits FSRS weights to one user's log with Adam. Weights are optimized as log-multipliers of the
+    defaults (so they stay positive and share one step size); every step evaluates the central
+    finite-difference gradient of all 17 weights in a single vectorized batch_loss call.
+    Returns {"params", "log_loss", "log_loss_before", "reviews"}.
+    """
+    base = np.asarray(srs.FSRS_DEFAULT_PARAMS, dtype=np.float64)
+    x = np.log(np.asarray(init, dtype=np.float64) / base) if init is not None else np.zeros_like(base)
+    reviews = int(lengths.sum() - lengths.size)
+    prior = FSRS_PRIOR_REVIEWS / max(1, reviews)
+    probe = np.vstack([np.zeros_like(base), np.eye(base.size) * _EPS, -np.eye(base.size) * _EPS])
+
+    def losses(points):
+        return batch_loss(base * np.exp(points), ratings, elapsed, lengths) + prior * (points ** 2).sum(axis=1)
+
+    m, v = np.zeros_like(x), np.zeros_like(x)
+    before = float(batch_loss((base * np.exp(x))[None, :], ratings, elapsed, lengths)[0])
+    for step in range(1, epochs + 1):
+        values = losses(x + probe)
+        grad = (values[1:1 + x.size] - values[1 + x.size:]) / (2 * _EPS)
+        m = 0.9 * m + 0.1 * grad
+        v = 0.999 * v + 0.001 * grad ** 2
+        x = np.clip(x - FSRS_LEARNING_RATE * (m / (1 - 0.9 ** step)) / (np.sqrt(v / (1 - 0.999 ** step)) + 1e-8), -3, 3)
+    params = base * np.exp(x)
+    after = float(batch_loss(params[None, :], ratings, elapsed, lengths)[0])
+    return {"params": [round(float(p), 4) for p in params], "log_loss": after, "log_loss_before": before, "reviews": reviews}
@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+try:
+    from app import database, models, ai_engine, jobs
+except ImportError:
+    import database, models, ai_engine, jobs
+
+# --- Config ---
+load_dotenv()
+WARM_POOL_ENABLED = os.getenv("WARM_POOL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Unused items kept ready per study set
+ARENA_POOL_DEPTH = int(os.getenv("ARENA_POOL_DEPTH", "5"))
+QUIZ_POOL_DEPTH = int(os.getenv("QUIZ_POOL_DEPTH", "10"))
+# Refills running at once in this process (they go through the scheduler as bulk work)
+POOL_REFILL_CONCURRENCY = int(os.getenv("POOL_REFILL_CONCURRENCY", "2"))
+# Pooled items older than this are thrown away instead of served
+POOL_MAX_AGE_S = float(os.getenv("POOL_MAX_AGE_S", str(7 * 24 * 3600)))
+# Fill the pools as soon as a study set has been generated
+POOL_PREFILL_ON_GENERATE = os.getenv("POOL_PREFILL_ON_GENERATE", "true").lower() in ("1", "true", "yes")
+
+ARENA = "arena"
+QUIZ = "quiz"
+_MODELS = {ARENA: models.PooledArenaScenario, QUIZ: models.PooledQuizQuestion}
+_DEPTH = {ARENA: ARENA_POOL_DEPTH, QUIZ: QUIZ_POOL_DEPTH}
+
+# --- Metrics ---
+RATE_WINDOW_S = 300
+_events = {(kind, what): deque(maxlen=10000) for kind in _MODELS for what in ("consumed", "refilled")}
+COUNTERS = {kind: {"served": 0, "misses": 0, "refills": 0, "refill_failures": 0, "generated": 0, "stale_dropped": 0}
+            for kind in _MODELS}
+
+def _note(kind: str, what: str, count: int):
+    if count:
+        now = time.monotonic()
+        _events[(kind, what)].extend([now] * count)
+
+def _per_minute(kind: str, what: str) -> float:
+    cutoff = time.monotonic() - RATE_WINDOW_S
+    recent = sum(1 for t in _events[(kind, what)] if t >= cutoff)
+    return round(recent * 60.0 / RATE_WINDOW_S, 3)
+
+def stats(db: Session) -> dict:
+    out = {"enabled": WARM_POOL_ENABLED}
+    for kind, model in _MODELS.items():
+        pooled, sets = db.query(func.count(model.id), func.count(func.distinct(model.set_id))).one()
+        out[kind] = {
+            **COUNTERS[kind],
+            "pooled_items": pooled,
+            "sets_with_pool": sets,
+            "depth": _DEPTH[kind],
+            "consumed_per_min": _per_minute(kind, "consumed"),
+            "refilled_per_min": _per_minute(kind, "refilled"),
+            "refills_in_flight": sum(1 for (_, k) in _IN_FLIGHT if k == kind),
+        }
+    return out
+
+# --- Consumption ---
+def _fresh_after() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=POOL_MAX_AGE_S)
+
+def _drop_stale(db: Session, kind: str, set_id: int):
+    model = _MODELS[kind]
+    dropped = db.query(model).filter(model.set_id == set_id, model.created_at < _fresh_after())\
+        .delete(synchronize_session=False)
+    COUNTERS[kind]["stale_dropped"] += dropped
+
+def pop(db: Session, kind: str, set_id: int, count: int, exact: bool = False) -> list:
+    """
+    Takes up to `count` pooled items (oldest first) and deletes them in the caller's transaction.
+    With exact=True it takes all `count` or nothing. SKIP LOCKED keeps two concurrent requests
+    from being handed the same rows. Does not commit.
+    """
+    if not WARM_POOL_ENABLED or count <= 0:
+        return []
+    model = _MODELS[kind]
+    _drop_stale(db, kind, set_id)
+    rows = db.query(model).filter(model.set_id == set_id)\
+        .order_by(model.id).limit(count).with_for_update(skip_locked=True).all()
+    if exact and len(rows) < count:
+        rows = []
+    for row in rows:
+        db.delete(row)
+    db.flush()
+    COUNTERS[kind]["served"] += len(rows)
+    COUNTERS[kind]["misses"] += count - len(rows)
+    _note(kind, "consumed", len(rows))
+    return rows
+
+def quiz_context(db: Session, set_id: int) -> str:
+    flashcards = db.query(models.Flashcard.question, models.Flashcard.answer)\
+        .filter(models.Flashcard.set_id == set_id).all()
+    return "\n".join([f"Q: {f.question}\nA: {f.answer}" for f in flashcards])
+
+# --- Refill ---
+async def refill(db: Session, kind: str, set_id: int) -> int:
+    """Tops the pool of one study set back up to its depth. Returns the number of items added."""
+    model = _MODELS[kind]
+    study_set = db.get(models.StudySet, set_id)
+    if study_set is None:
+        return 0
+    COUNTERS[kind]["refills"] += 1
+    _drop_stale(db, kind, set_id)
+    have = db.query(func.count(model.id)).filter(model.set_id == set_id).scalar() or 0
+    deficit = _DEPTH[kind] - have
+    db.commit()
+    if deficit <= 0:
+        return 0
+
+    now = datetime.utcnow()
+    if kind == ARENA:
+        generated = await ai_engine.generate_arena_questions_for_set_async(
+            study_set, {"num_questions": deficit, "random_seed": str(uuid4())}, priority=ai_engine.rate_limiter.BULK
+        )
+        # Placeholders (model unavailable / unparseable) never go into the pool
+        rows = [
+            models.PooledArenaScenario(
+                set_id=set_id, scenario=item["scenario"], ideal_response=item.get("ideal_response") or "",
+                related_topic_tag=(item.get("meta") or {}).get("topic"), meta=item.get("meta") or {}, created_at=now
+            )
+            for item in generated if item.get("scenario") and (item.get("meta") or {}).get("topic")
+        ]
+    else:
+        context_text = quiz_context(db, set_id)
+        if not context_text:
+            return 0
+        generated = await ai_engine.generate_quiz_from_context_async(
+            context_text, num_questions=deficit, use_cache=False, priority=ai_engine.rate_limiter.BULK
+        )
+        rows = [
+            models.PooledQuizQuestion(
+                set_id=set_id, question=q["question"], options=q["options"],
+                correct_answer=q["correct_answer"], tag="Generated", created_at=now
+            )
+            for q in (generated or [])[:deficit]
+            if isinstance(q, dict) and q.get("question") and q.get("options") and q.get("correct_answer")
+        ]
+    db.add_all(rows)
+    db.commit()
+    COUNTERS[kind]["generated"] += len(rows)
+    _note(kind, "refilled", len(rows))
+    return len(rows)
+
+_IN_FLIGHT = set()
+_BACKGROUND_TASKS = set()
+_REFILL_SEM = None
+
+def _refill_sem():
+    global _REFILL_SEM
+    if _REFILL_SEM is None:
+        _REFILL_SEM = asyncio.Semaphore(max(1, POOL_REFILL_CONCURRENCY))
+    return _REFILL_SEM
+
+async def _refill_in_background(kind: str, set_id: int):
+    async with _refill_sem():
+        db = database.SessionLocal()
+        try:
+            added = await refill(db, kind, set_id)
+            print(f"🧊 Warm pool: +{added} {kind} item(s) for set {set_id}.")
+        except Exception as e:
+            db.rollback()
+            COUNTERS[kind]["refill_failures"] += 1
+            print(f"⚠️ Warm pool refill ({kind}, set {set_id}) failed: {e}")
+        finally:
+            db.close()
+            _IN_FLIGHT.discard((set_id, kind))
+
+def schedule_refill(db: Session, kind: str, set_id: int):
+    """
+    Asks for the pool to be topped up without waiting for it. Queue mode hands the work to the
+    job workers (one pending refill per set and kind); inline mode runs it as a task in this process.
+    """
+    if not WARM_POOL_ENABLED:
+        return
+    if jobs.QUEUE_MODE:
+        pending = db.query(models.Job.id).filter(
+            models.Job.kind == "refill_pool", models.Job.set_id == set_id,
+            models.Job.status.in_(("queued", "running")), models.Job.payload["kind"].as_string() == kind
+        ).first()
+        if not pending:
+            jobs.enqueue(db, "refill_pool", set_id=set_id, payload={"kind": kind}, priority=jobs.PRIORITY_BULK)
+        return
+    if (set_id, kind) in _IN_FLIGHT:
+        return
+    _IN_FLIGHT.add((set_id, kind))
+    task = asyncio.get_running_loop().create_task(_refill_in_background(kind, set_id))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
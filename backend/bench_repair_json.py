@@ -0,0 +1,201 @@
+import sys
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import argparse
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+from app.ai_engine import repair_json
+
+# --- The previous implementation, kept verbatim for comparison ---
+def legacy_repair_json(json_str: str) -> str:
+    if not json_str:
+        return ""
+    json_str = re.sub(r"^```(?:json)?\s*", "", json_str.strip())
+    json_str = re.sub(r"\s*```$", "", json_str.strip())
+    replacements = {
+        r"\Omega": r"\\Omega",
+        r"\times": r"\\times",
+        r"\le": r"\\le",
+        r"\ge": r"\\ge",
+        r"\frac": r"\\frac",
+    }
+    for old, new in replacements.items():
+        if old in json_str and new not in json_str:
+            json_str = json_str.replace(old, new)
+    json_str = json_str.replace('\\\\', '@@DOUBLE_BACKSLASH@@')
+    json_str = json_str.replace('\\"', '@@QUOTE@@')
+    json_str = json_str.replace('\\n', '@@NEWLINE@@')
+    json_str = json_str.replace('\\t', '@@TAB@@')
+    json_str = json_str.replace('\\/', '@@SLASH@@')
+    json_str = json_str.replace('\\b', '@@BACKSPACE@@')
+    json_str = json_str.replace('\\f', '@@FORMFEED@@')
+    json_str = json_str.replace('\\r', '@@RETURN@@')
+    json_str = json_str.replace('\\', '\\\\')
+    json_str = json_str.replace('@@DOUBLE_BACKSLASH@@', '\\\\')
+    json_str = json_str.replace('@@QUOTE@@', '\\"')
+    json_str = json_str.replace('@@NEWLINE@@', '\\n')
+    json_str = json_str.replace('@@TAB@@', '\\t')
+    json_str = json_str.replace('@@SLASH@@', '\\/')
+    json_str = json_str.replace('@@BACKSPACE@@', '\\b')
+    json_str = json_str.replace('@@FORMFEED@@', '\\f')
+    json_str = json_str.replace('@@RETURN@@', '\\r')
+    return json_str
+
+def legacy_parse(text: str):
+    """Old call-site behaviour: repair, then a greedy regex fallback."""
+    cleaned = legacy_repair_json(text)
+    try:
+        return json.loads(cleaned)
+    except Exception:
+        m = re.search(r"(\[.*\])", cleaned, flags=re.S) or re.search(r"(\{.*\})", cleaned, flags=re.S)
+        return json.loads(m.group(1)) if m else None
+
+def new_parse(text: str):
+    return json.loads(repair_json(text))
+
+# --- Corpus: outputs shaped like what the model actually returns ---
+SAMPLES = [
+    '```json\n[{"topic": "Ohm\'s Law", "complexity": 2, "context": "V = IR relates voltage and current."}]\n```',
+    '[{"topic":"Kinematics","complexity":3,"context":"Motion in one dimension"},{"topic":"Forces","complexity":4,"context":"Newton\'s laws"}]',
+    'Here is the syllabus you asked for:\n```json\n[{"topic": "Limits", "complexity": 3, "context": "Approaching values"}]\n```\nLet me know if you need more.',
+    '{"flashcards": [{"question": "What is \\frac{1}{2} + \\frac{1}{4}?", "answer": "\\frac{3}{4}"}], "quiz": {"question": "Unit of resistance?", "options": ["\\Omega", "V", "A", "W"], "correct_answer": "\\Omega"}, "arena": {"scenario": "Design a divider", "ideal_response": "Use R1 and R2"}}',
+    '{"flashcards": [{"question": "Define \\alpha decay", "answer": "Emission of a helium nucleus, \\alpha = {}^4_2He"}], "quiz": null, "arena": null}',
+    '{"flashcards": [{"question": "Gradient?", "answer": "\\nabla f points uphill; \\theta \\neq 0"}], "quiz": {"question": "q", "options": ["a", "b"], "correct_answer": "a"}, "arena": {"scenario": "s", "ideal_response": "r"}}',
+    '{"score": 82, "feedback": "Good use of \\sigma and \\mu.\nMissed the edge case."}',
+    '{"score": 40, "feedback": "Line one\\nLine two\\tTabbed \\"quoted\\" \\u00e9t\\u00e9"}',
+    '[{"question": "2 \\times 3 \\le 7?", "options": ["Yes", "No"], "correct_answer": "Yes"}, {"question": "x \\ge 0 for x = |y|?", "options": ["Yes", "No"], "correct_answer": "Yes"}]',
+    '{"scenario": "A path C:\\Users\\data needs parsing", "ideal_response": "Escape the backslashes"}',
+    'Sure! {"scenario": "Balance the equation", "ideal_response": "2H2 + O2 -> 2H2O"} Hope this helps {really}.',
+    '[{"topic": "Arrays [basics]", "complexity": 1, "context": "Index {0} is first"}]',
+]
+
+def load_cache_outputs(path: str, limit: int) -> list:
+    """Real model responses, as stored by the LLM response cache."""
+    try:
+        db = sqlite3.connect(path)
+        rows = db.execute("SELECT value FROM llm_cache ORDER BY accessed_at DESC LIMIT ?", (limit,)).fetchall()
+        db.close()
+        return [r[0] for r in rows]
+    except Exception as e:
+        print(f"⚠️ Could not read cache corpus from {path}: {e}")
+        return []
+
+# --- Fuzz: random documents, "model-ified", with the original object as ground truth ---
+WORDS = ["energy", "matrix", "cell", "force", "velocity", "proof", "lemma", "value", "graph", "node"]
+LATEX = ["\\frac{a}{b}", "\\alpha", "\\beta", "\\times", "\\theta", "\\nabla", "\\sum_{i=1}^n", "\\le", "\\Omega", "\\rho", "\\sqrt{2}"]
+NOISE = ["", "Here you go:\n", "```json\n", "```\n", "Sure! "]
+
+def random_text(rng) -> str:
+    parts = []
+    for _ in range(rng.randint(3, 12)):
+        r = rng.random()
+        if r < 0.15:
+            parts.append(rng.choice(LATEX))
+        elif r < 0.2:
+            parts.append('"quoted"')
+        elif r < 0.25:
+            parts.append(rng.choice(["[x]", "{y}", "a/b", "é"]))
+        else:
+            parts.append(rng.choice(WORDS))
+    text = " ".join(parts)
+    if rng.random() < 0.2:
+        text += "@@NL@@" + rng.choice(WORDS)
+    return text
+
+def random_doc(rng):
+    if rng.random() < 0.5:
+        return [{"topic": random_text(rng), "complexity": rng.randint(1, 5), "context": random_text(rng)} for _ in range(rng.randint(1, 8))]
+    return {
+        "flashcards": [{"question": random_text(rng), "answer": random_text(rng)} for _ in range(rng.randint(1, 6))],
+        "quiz": {"question": random_text(rng), "options": [random_text(rng) for _ in range(4)], "correct_answer": "a"},
+        "arena": {"scenario": random_text(rng), "ideal_response": random_text(rng)},
+    }
+
+def ground_truth(doc):
+    return json.loads(json.dumps(doc).replace("@@NL@@", "\\n"))
+
+def modelify(doc, rng) -> str:
+    """Serializes like a model does: LaTeX backslashes left single, raw newlines, fences and prose around."""
+    text = json.dumps(doc, ensure_ascii=rng.random() < 0.3, indent=rng.choice([None, 2]))
+    for cmd in LATEX:
+        if rng.random() < 0.8:
+            text = text.replace(json.dumps(cmd)[1:-1], cmd)
+    text = text.replace("@@NL@@", "\n" if rng.random() < 0.5 else "\\n")
+    prefix = rng.choice(NOISE)
+    suffix = "\n```" if prefix.endswith("```json\n") else rng.choice(["", "\nAnything else?"])
+    return prefix + text + suffix
+
+# --- Reporting ---
+def outcome(fn, text):
+    try:
+        return fn(text), None
+    except Exception as e:
+        return None, e
+
+def compare(corpus: list, truth: list = None) -> dict:
+    stats = {"both_ok_equal": 0, "both_ok_differ": 0, "new_only": 0, "old_only": 0, "both_fail": 0,
+             "new_matches_truth": 0, "old_matches_truth": 0}
+    regressions = []
+    for idx, text in enumerate(corpus):
+        old, old_err = outcome(legacy_parse, text)
+        new, new_err = outcome(new_parse, text)
+        if old_err is None and new_err is None:
+            stats["both_ok_equal" if old == new else "both_ok_differ"] += 1
+        elif new_err is None:
+            stats["new_only"] += 1
+        elif old_err is None:
+            stats["old_only"] += 1
+            regressions.append(text)
+        else:
+            stats["both_fail"] += 1
+        if truth is not None:
+            stats["new_matches_truth"] += int(new_err is None and new == truth[idx])
+            stats["old_matches_truth"] += int(old_err is None and old == truth[idx])
+    return stats, regressions
+
+def bench(fn, corpus: list, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            fn(text)
+    return (time.perf_counter() - t0) / (rounds * len(corpus)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare repair_json against the previous implementation.")
+    parser.add_argument("--fuzz", type=int, default=2000, help="number of generated fuzz cases")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--cache", default=os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3"), help="LLM cache file to pull real outputs from")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    real = SAMPLES + (load_cache_outputs(args.cache, 5000) if os.path.exists(args.cache) else [])
+    rng = random.Random(args.seed)
+    docs = [random_doc(rng) for _ in range(args.fuzz)]
+    fuzz = [modelify(doc, rng) for doc in docs]
+    truth = [ground_truth(doc) for doc in docs]
+
+    print("--- repair_json: correctness ---")
+    for name, corpus, expected in (("real outputs", real, None), ("fuzz", fuzz, truth)):
+        stats, regressions = compare(corpus, expected)
+        print(f"{name} ({len(corpus)} cases): {stats}")
+        for text in regressions[:5]:
+            print(f"   ❌ regression: {text[:120]!r}")
+
+    print("\n--- repair_json: speed (µs per call, repair + parse) ---")
+    big = [json.dumps([{"topic": f"t{i}", "complexity": 3, "context": "x \\\\frac{1}{2} " * 40} for i in range(400)])]
+    broken_big = ["Here is the output:\n" + big[0] + "\nThanks! [end]"]
+    for name, corpus in (("real outputs", real), ("fuzz", fuzz[:500]), ("large (~300KB)", big), ("large + prose", broken_big)):
+        rounds = args.rounds if len(corpus) > 1 else max(3, args.rounds // 4)
+        old_us = bench(lambda t: outcome(legacy_parse, t), corpus, rounds)
+        new_us = bench(lambda t: outcome(new_parse, t), corpus, rounds)
+        print(f"{name:>16}: old {old_us:10.1f}   new {new_us:10.1f}   speedup x{old_us / new_us:.2f}")
+
+if __name__ == "__main__":
+    main()
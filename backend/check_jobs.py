@@ -0,0 +1,34 @@
+import sys
+import os
+import argparse
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import SessionLocal
+from app.models import Job
+from app import jobs
+
+parser = argparse.ArgumentParser(description="Job queue overview.")
+parser.add_argument("--requeue-dead", action="store_true", help="move dead-lettered jobs back to the queue")
+args = parser.parse_args()
+
+db = SessionLocal()
+
+print("--- JOB QUEUE CHECK ---")
+
+# 1. Counts by kind / status
+for kind, by_status in sorted(jobs.queue_stats(db).items()):
+    print(f" - {kind}: " + ", ".join(f"{status}={count}" for status, count in sorted(by_status.items())))
+
+# 2. Dead letters
+dead = db.query(Job).filter(Job.status == "dead").order_by(Job.updated_at.desc()).limit(20).all()
+print(f"\nDead-lettered jobs (latest {len(dead)}):")
+for j in dead:
+    print(f" - #{j.id} {j.kind} | attempts: {j.attempts} | error: {(j.error or '')[:120]}")
+
+# 3. Optional requeue
+if args.requeue_dead:
+    print(f"\n🔁 Requeued {jobs.requeue_dead(db)} dead job(s).")
+
+db.close()
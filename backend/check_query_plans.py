@@ -0,0 +1,162 @@
+import sys
+import os
+import json
+import argparse
+from datetime import datetime
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text, inspect, select
+from app.database import engine
+from app import models, due_queue, jobs, pagination, mainapp
+
+def hot_queries(user_id: int, set_id: int, session_id: int, now: datetime) -> dict:
+    """
+    The per-request statements behind /api/reviews/today, the study set and flashcard listings, the
+    per-set endpoints and the job queue, built by the same code that runs them. None may read a whole table.
+    """
+    return {
+        "reviews_today": due_queue.due_counts_stmt(user_id, now),
+        "flashcards_due": mainapp.flashcards_query(set_id, "due", now=now)[1],
+        "flashcards_all": mainapp.flashcards_query(set_id)[1],
+        "flashcards_page": mainapp.flashcards_query(set_id, cursor=pagination.encode_cursor([set_id, 0]), limit=100)[1],
+        "study_sets_page": mainapp.study_sets_query(user_id, cursor=pagination.encode_cursor([user_id, now, 0]), limit=100)[1],
+        "study_sets_of_user": mainapp.study_sets_query(user_id)[1],
+        "study_set_owner": select(models.StudySet).where(models.StudySet.id == set_id, models.StudySet.user_id == user_id).limit(1),
+        "quiz_of_set": select(models.QuizQuestion).where(models.QuizQuestion.set_id == set_id),
+        "arena_of_set": select(models.ArenaChallenge).where(models.ArenaChallenge.set_id == set_id).limit(1),
+        "arena_session_questions": select(models.ArenaSessionQuestion).where(models.ArenaSessionQuestion.session_id == session_id),
+        "jobs_claim_next": jobs.claim_next_stmt(now),
+    }
+HOT_TABLES = {"study_sets", "flashcards", "quiz_questions", "arena_challenges", "arena_session_questions", "due_card_counters", "jobs"}
+SEED_EMAIL = "plan-check-%@local"
+# Below this many cards Postgres rightly prefers a seq scan; the check then only asks whether an index path exists
+SMALL_TABLE_ROWS = 1_000_000
+
+def _rand(dialect: str) -> str:
+    return "random()" if dialect == "postgresql" else "((abs(random()) % 1000000) / 1000000.0)"
+
+def _due_date(dialect: str) -> str:
+    # 10% never reviewed, the rest spread from 10 days overdue to 50 days ahead
+    r = _rand(dialect)
+    if dialect == "postgresql":
+        when = f"now() + ({r} * 60 - 10) * interval '1 day'"
+    else:
+        when = f"datetime('now', printf('%+.3f days', {r} * 60 - 10))"
+    return f"CASE WHEN {r} < 0.1 THEN NULL ELSE {when} END"
+
+def seed(conn, cards: int, cards_per_set: int, sets_per_user: int):
+    """Adds `cards` flashcards spread over plan-check users and sets, then refreshes planner statistics."""
+    dialect = conn.dialect.name
+    sets = max(1, cards // cards_per_set)
+    users = max(1, sets // sets_per_user)
+    print(f"🌱 Seeding {users} users, {users * sets_per_user} sets, {users * sets_per_user * cards_per_set} cards...")
+    series = "WITH RECURSIVE g(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM g WHERE n < {n}) "
+    conn.execute(text(
+        series.format(n=users) + "INSERT INTO users (email, password_hash) SELECT 'plan-check-' || n || '@local', '' FROM g"
+    ))
+    conn.execute(text(
+        series.format(n=sets_per_user) +
+        "INSERT INTO study_sets (user_id, title, card_count, mastery_score, srs_success_rate, total_time_studied, created_at) "
+        "SELECT u.id, 'plan check', :per_set, 0, 0, 0, CURRENT_TIMESTAMP FROM users u CROSS JOIN g WHERE u.email LIKE :email"
+    ), {"per_set": cards_per_set, "email": SEED_EMAIL})
+    conn.execute(text(
+        series.format(n=cards_per_set) +
+        "INSERT INTO flashcards (set_id, question, answer, repetition_number, ease_factor, interval, next_review_date) "
+        f"SELECT s.id, 'q', 'a', 0, 2.5, 1.0, {_due_date(dialect)} "
+        "FROM study_sets s JOIN users u ON u.id = s.user_id CROSS JOIN g WHERE u.email LIKE :email"
+    ), {"email": SEED_EMAIL})
+    if inspect(conn).has_table("due_card_counters"):
+        # Day-sized buckets: close enough to the real hourly ones for the planner
+        day = "date_trunc('day', f.next_review_date)" if dialect == "postgresql" else "datetime(date(f.next_review_date))"
+        conn.execute(text(
+            "INSERT INTO due_card_counters (user_id, set_id, due_at, card_count) "
+            f"SELECT u.id, f.set_id, coalesce({day}, '1970-01-01'), count(*) "
+            "FROM flashcards f JOIN study_sets s ON s.id = f.set_id JOIN users u ON u.id = s.user_id "
+            f"WHERE u.email LIKE :email GROUP BY u.id, f.set_id, coalesce({day}, '1970-01-01')"
+        ), {"email": SEED_EMAIL})
+    conn.execute(text("ANALYZE"))
+
+def cleanup(conn):
+    print("🧹 Removing plan-check data...")
+    seeded_sets = "SELECT s.id FROM study_sets s JOIN users u ON u.id = s.user_id WHERE u.email LIKE :email"
+    if inspect(conn).has_table("due_card_counters"):
+        conn.execute(text(f"DELETE FROM due_card_counters WHERE set_id IN ({seeded_sets})"), {"email": SEED_EMAIL})
+    conn.execute(text(f"DELETE FROM flashcards WHERE set_id IN ({seeded_sets})"), {"email": SEED_EMAIL})
+    conn.execute(text(f"DELETE FROM study_sets WHERE id IN ({seeded_sets})"), {"email": SEED_EMAIL})
+    conn.execute(text("DELETE FROM users WHERE email LIKE :email"), {"email": SEED_EMAIL})
+
+def _params(conn) -> dict:
+    row = conn.execute(text(
+        "SELECT s.user_id, s.id FROM study_sets s JOIN users u ON u.id = s.user_id "
+        "ORDER BY CASE WHEN u.email LIKE :email THEN 0 ELSE 1 END, s.id LIMIT 1"
+    ), {"email": SEED_EMAIL}).first()
+    user_id, set_id = row if row else (1, 1)
+    return {"user_id": user_id, "set_id": set_id, "session_id": 1, "now": datetime.utcnow()}
+
+def _pg_seq_scans(node: dict) -> list:
+    found = []
+    if node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in HOT_TABLES:
+        found.append(f"Seq Scan on {node['Relation Name']} (rows={node.get('Plan Rows')})")
+    for child in node.get("Plans", []):
+        found.extend(_pg_seq_scans(child))
+    return found
+
+def explain(conn, stmt) -> tuple:
+    """Returns (plan text, full table scans of hot tables in it)."""
+    # Values inlined, so the plan is the one for these values (as for the app's own custom plans)
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "postgresql":
+        plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+        plan = plan if isinstance(plan, list) else json.loads(plan)
+        return json.dumps(plan[0]["Plan"], indent=1), _pg_seq_scans(plan[0]["Plan"])
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql).all()
+    details = [row[-1] for row in rows]
+    scans = [d for d in details if d.startswith("SCAN ") and d.split()[1] in HOT_TABLES]
+    return "\n".join(details), scans
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a hot query would read a whole table instead of using an index.")
+    parser.add_argument("--seed-cards", type=int, default=0, help="first add this many plan-check cards (e.g. 10000000)")
+    parser.add_argument("--cards-per-set", type=int, default=200)
+    parser.add_argument("--sets-per-user", type=int, default=10)
+    parser.add_argument("--cleanup", action="store_true", help="remove the plan-check data afterwards")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        if args.seed_cards:
+            seed(conn, args.seed_cards, args.cards_per_set, args.sets_per_user)
+
+    failures = 0
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            cards = conn.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'flashcards'")).scalar() or 0
+            if cards < SMALL_TABLE_ROWS:
+                print(f"ℹ️ flashcards has ~{cards} rows; seq scans disabled so only a missing index path fails "
+                      f"(use --seed-cards 10000000 for a full-scale check).")
+                conn.execute(text("SET enable_seqscan = off"))
+        print(f"--- QUERY PLAN CHECK ({conn.dialect.name}) ---")
+        for name, stmt in hot_queries(**_params(conn)).items():
+            plan, scans = explain(conn, stmt)
+            if scans:
+                failures += 1
+                print(f" ❌ {name}: " + "; ".join(scans))
+            else:
+                print(f" ✅ {name}")
+            if args.verbose or scans:
+                print("    " + plan.replace("\n", "\n    "))
+        conn.rollback()
+
+    if args.cleanup:
+        with engine.begin() as conn:
+            cleanup(conn)
+
+    if failures:
+        print(f"\n🔥 {failures} hot query(ies) fall back to a full table scan. Run `python migrate.py`?")
+        sys.exit(1)
+    print("\n✨ Every hot query uses an index.")
+
+if __name__ == "__main__":
+    main()
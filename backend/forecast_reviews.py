@@ -0,0 +1,74 @@
+import sys
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+parser = argparse.ArgumentParser(description="Review-workload forecast for one user or the whole cohort (SM-2 or FSRS simulation).")
+parser.add_argument("--user-id", type=int, default=None, help="only this user's cards (default: every card)")
+parser.add_argument("--days", type=int, default=90)
+parser.add_argument("--answers", type=float, nargs=4, metavar=("AGAIN", "HARD", "GOOD", "EASY"), default=None,
+                    help="relative weights of the four ratings")
+parser.add_argument("--runs", type=int, default=1, help="simulations to average")
+parser.add_argument("--seed", type=int, default=None)
+parser.add_argument("--scheduler", choices=("sm2", "fsrs"), default=None,
+                    help="scheduler to simulate (default: the user's own with --user-id, else SRS_DEFAULT_SCHEDULER)")
+parser.add_argument("--synthetic", type=int, default=0, help="forecast N random cards instead of the database (timing)")
+args = parser.parse_args()
+
+if args.synthetic:
+    # No database needed
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+from app import srs
+
+answers = args.answers or srs.DEFAULT_ANSWER_PROBS
+now = datetime.utcnow()
+settings = srs.scheduler_settings()
+if args.scheduler:
+    settings["scheduler"] = args.scheduler
+
+started = time.perf_counter()
+if args.synthetic:
+    rng = np.random.default_rng(args.seed)
+    n = args.synthetic
+    cards = {
+        "repetition_number": rng.integers(0, 6, n).astype(np.int32),
+        "ease_factor": rng.uniform(1.3, 2.8, n),
+        "interval": rng.integers(0, 60, n).astype(np.float64),
+        "due_day": rng.integers(0, 60, n).astype(np.int32),
+        "fsrs_stability": rng.uniform(0.5, 60, n),
+        "fsrs_difficulty": rng.uniform(1, 10, n),
+        "last_day": -rng.uniform(0, 30, n),
+    }
+else:
+    from sqlalchemy import select
+    from app.database import SessionLocal
+    from app import models
+
+    db = SessionLocal()
+    if args.user_id is not None:
+        user_settings = srs.scheduler_settings(db.get(models.SrsSettings, args.user_id))
+        settings = {**user_settings, "scheduler": args.scheduler or user_settings["scheduler"]}
+    query = select(*srs.card_columns(db.get_bind().dialect.name, now, settings["scheduler"])).select_from(models.Flashcard)
+    if args.user_id is not None:
+        query = query.join(models.StudySet, models.StudySet.id == models.Flashcard.set_id)\
+            .where(models.StudySet.user_id == args.user_id)
+    cards = srs.card_arrays(db.connection().execute(query), settings["scheduler"])
+    db.close()
+loaded = time.perf_counter()
+
+per_day = srs.forecast(cards, args.days, answers, runs=args.runs, seed=args.seed, settings=settings)
+done = time.perf_counter()
+
+print(f"--- REVIEW FORECAST ({cards['due_day'].size} cards, {args.days} days, {settings['scheduler']}) ---")
+print(f"⏱️ load {loaded - started:.3f}s | simulate {done - loaded:.3f}s")
+peak = int(per_day.argmax()) if per_day.size else 0
+for i, n in enumerate(per_day):
+    marker = "  ← peak" if i == peak else ""
+    print(f" {(now.date() + timedelta(days=i)).isoformat()} | {n:10.1f}{marker}")
+print(f"\nTotal: {per_day.sum():.0f} reviews, {per_day.mean():.1f}/day on average.")
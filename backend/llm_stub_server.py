@@ -0,0 +1,143 @@
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.llm_backends import stub_response, estimate_usage
+
+# Run the API with LLM_BACKEND=stub LLM_STUB_URL=http://127.0.0.1:<port> to send every model call here.
+
+class StubState:
+    """Latency and fault injection shared by all request threads."""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.recent = deque()  # admission times for the --rpm window
+        self.counters = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0}
+
+    def latency_s(self, output_tokens: int) -> float:
+        a = self.args
+        with self.lock:
+            if a.latency == "fixed":
+                ms = a.latency_ms
+            elif a.latency == "uniform":
+                ms = self.rng.uniform(a.latency_ms - a.spread_ms, a.latency_ms + a.spread_ms)
+            elif a.latency == "normal":
+                ms = self.rng.gauss(a.latency_ms, a.spread_ms)
+            else:  # lognormal: latency_ms is the median, spread the sigma of the log
+                ms = self.rng.lognormvariate(0, a.sigma) * a.latency_ms
+        return max(0.0, ms + output_tokens * a.ms_per_token) / 1000.0
+
+    def fault(self):
+        """Returns (status, message) for an injected failure, or None to answer normally."""
+        a = self.args
+        with self.lock:
+            self.counters["requests"] += 1
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            if a.rpm and len(self.recent) >= a.rpm:
+                self.counters["rate_limited"] += 1
+                return 429, "Resource has been exhausted (e.g. check quota)."
+            if self.rng.random() < a.rate_limit_rate:
+                self.counters["rate_limited"] += 1
+                return 429, "Resource has been exhausted (e.g. check quota)."
+            self.recent.append(now)
+            if self.rng.random() < a.error_rate:
+                self.counters["errors"] += 1
+                return 500, "An internal error has occurred."
+        return None
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok"})
+            elif self.path == "/stats":
+                with state.lock:
+                    self._send(200, dict(state.counters))
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/v1/generate":
+                self._send(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send(400, {"error": "invalid JSON"})
+                return
+            prompt = request.get("prompt") or ""
+            fault = state.fault()
+            if fault:
+                # Failures come back fast, like the real API's
+                time.sleep(state.latency_s(0) * 0.1)
+                self._send(fault[0], {"error": fault[1]})
+                return
+            text = stub_response(prompt, request.get("generation_config"))
+            total = estimate_usage(prompt, text)
+            time.sleep(state.latency_s(len(text) // 4))
+            with state.lock:
+                state.counters["ok"] += 1
+            self._send(200, {"text": text, "usage": {"prompt_tokens": len(prompt) // 4, "total_tokens": total}})
+
+        def log_message(self, format, *args):
+            if state.args.verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic stand-in for the model API, with latency and fault injection.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", choices=("fixed", "uniform", "normal", "lognormal"), default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=800, help="mean (median for lognormal) time to first byte")
+    parser.add_argument("--spread-ms", type=float, default=200, help="half-width (uniform) or std-dev (normal)")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal shape; 0.5 gives a p99 of ~3x the median")
+    parser.add_argument("--ms-per-token", type=float, default=0.0, help="extra latency per output token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--rpm", type=int, default=0, help="answer 429 above this many requests per minute (0 = no cap)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for latency and fault injection")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubState(args)))
+    server.daemon_threads = True
+    print(f"🧪 LLM stub listening on http://{args.host}:{args.port} "
+          f"(latency={args.latency} {args.latency_ms:.0f}ms, 500s={args.error_rate:.1%}, 429s={args.rate_limit_rate:.1%}, rpm={args.rpm or '∞'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("👋 LLM stub stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import sys
+import os
+import argparse
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import migrations
+
+parser = argparse.ArgumentParser(description="Apply versioned schema migrations (app/migrations).")
+parser.add_argument("--status", action="store_true", help="list migrations and whether they are applied")
+parser.add_argument("--to", type=int, default=None, help="apply up to this version only")
+parser.add_argument("--dry-run", action="store_true", help="show what would be applied")
+args = parser.parse_args()
+
+if args.status:
+    print("--- SCHEMA MIGRATIONS ---")
+    for version, description, applied_at in migrations.status():
+        state = f"applied {applied_at}" if applied_at else "pending"
+        print(f" - {version:04d} {description} | {state}")
+    sys.exit(0)
+
+done = migrations.upgrade(target=args.to, dry_run=args.dry_run)
+if args.dry_run:
+    print(f"\n{len(done)} migration(s) pending.")
+elif done:
+    print(f"\n✨ Applied {len(done)} migration(s).")
+else:
+    print("✅ Schema is up to date.")
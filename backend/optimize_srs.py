@@ -0,0 +1,70 @@
+import sys
+import os
+import time
+import argparse
+from datetime import datetime
+from itertools import groupby
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select
+from app.database import SessionLocal
+from app import models, srs, srs_optimizer
+
+parser = argparse.ArgumentParser(description="Re-fit every user's FSRS parameters to their review log (nightly batch).")
+parser.add_argument("--user-id", type=int, default=None, help="only this user (default: everyone)")
+parser.add_argument("--min-reviews", type=int, default=100, help="skip users with fewer reviews than this")
+parser.add_argument("--epochs", type=int, default=srs_optimizer.FSRS_EPOCHS)
+parser.add_argument("--dry-run", action="store_true", help="fit and report, but store nothing")
+args = parser.parse_args()
+
+db = SessionLocal()
+started = time.perf_counter()
+
+# 1. Current parameters, the starting point of every fit (one small row per user)
+current = {row.user_id: row.fsrs_params for row in db.execute(
+    select(models.SrsSettings.user_id, models.SrsSettings.fsrs_params)
+    .where(models.SrsSettings.fsrs_params.isnot(None))
+)}
+
+# 2. One streaming pass over the log, ordered so each user's reviews arrive together:
+#    only one user's log is held in memory at a time
+log = select(models.ReviewLog.user_id, models.ReviewLog.card_id, models.ReviewLog.reviewed_at, models.ReviewLog.rating)\
+    .order_by(models.ReviewLog.user_id, models.ReviewLog.card_id, models.ReviewLog.reviewed_at)
+if args.user_id is not None:
+    log = log.where(models.ReviewLog.user_id == args.user_id)
+
+print("--- FSRS OPTIMIZATION ---")
+fitted, skipped = {}, 0
+for user_id, rows in groupby(db.execute(log.execution_options(yield_per=10000)), key=lambda r: r.user_id):
+    ratings, elapsed, lengths = srs_optimizer.sequences((r.card_id, r.reviewed_at, r.rating) for r in rows)
+    reviews = int(lengths.sum() - lengths.size)
+    if reviews < args.min_reviews:
+        skipped += 1
+        continue
+    result = srs_optimizer.fit(ratings, elapsed, lengths, init=current.get(user_id), epochs=args.epochs)
+    improved = result["log_loss"] < result["log_loss_before"]
+    print(f" {'✅' if improved else '➖'} user {user_id}: {reviews} reviews | "
+          f"log loss {result['log_loss_before']:.4f} → {result['log_loss']:.4f}")
+    if improved:
+        fitted[user_id] = result
+print(f"\n⏱️ {len(fitted)} user(s) improved, {skipped} skipped (< {args.min_reviews} reviews) in {time.perf_counter() - started:.1f}s")
+
+# 3. Store the new parameters in one transaction, after the read is finished
+#    (SQLite cannot commit while the streaming read holds its lock)
+if fitted and not args.dry_run:
+    now = datetime.utcnow()
+    for user_id, result in fitted.items():
+        row = db.get(models.SrsSettings, user_id)
+        if row is None:
+            row = models.SrsSettings(user_id=user_id, scheduler=srs.SRS_DEFAULT_SCHEDULER,
+                                     desired_retention=srs.SRS_DEFAULT_RETENTION)
+            db.add(row)
+        row.fsrs_params = result["params"]
+        row.optimized_at = now
+        row.optimized_reviews = result["reviews"]
+        row.log_loss = result["log_loss"]
+    db.commit()
+    print(f"💾 Stored parameters for {len(fitted)} user(s).")
+db.close()
@@ -0,0 +1,33 @@
+import sys
+import os
+import signal
+import asyncio
+import argparse
+
+# Setup path to import from 'app'
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import jobs
+
+def main():
+    parser = argparse.ArgumentParser(description="Claims and runs queued jobs (set JOB_EXECUTION=queue on the API).")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "4")), help="jobs in flight per process")
+    parser.add_argument("--kinds", default="", help="comma-separated job kinds to take (default: all)")
+    parser.add_argument("--worker-id", default=None, help="lease owner name (default: host:pid)")
+    args = parser.parse_args()
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()] or None
+
+    async def _run():
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass  # Windows
+        await jobs.run_worker(args.worker_id, args.concurrency, kinds, stop)
+        print("👋 Worker stopped (in-flight jobs finished).")
+
+    asyncio.run(_run())
+
+if __name__ == "__main__":
+    main()